@@ -0,0 +1,119 @@
+"""Import-time regression check for the API process.
+
+Runs `python -X importtime -c "import agent_host.app.main"` in `--runs` fresh
+interpreters. It reports the median total import time and the top-level
+packages that cost the most (self time summed over their modules).
+
+It exits with status 1 when:
+
+- a module in --lazy was imported (chromadb, bs4, ... must load on first use)
+- the median exceeds --budget-ms
+- the median is more than --tolerance slower than a --baseline report
+
+    PYTHONPATH=src python benchmarks/bench_importtime.py
+    PYTHONPATH=src python benchmarks/bench_importtime.py --out importtime.json
+    PYTHONPATH=src python benchmarks/bench_importtime.py --baseline importtime.json --budget-ms 900
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+TARGET = "agent_host.app.main"
+LAZY = ("chromadb", "bs4", "onnxruntime", "agent_host.app.clients.duckduckgo")
+
+_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def parse(stderr: str) -> List[Tuple[str, int, int]]:
+    """(module, self_us, cumulative_us) for every line of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            rows.append((m.group(4), int(m.group(1)), int(m.group(2))))
+    return rows
+
+
+def measure(target: str = TARGET) -> List[Tuple[str, int, int]]:
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(REPO_ROOT / "src"), os.environ.get("PYTHONPATH", "")])}
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {target}"],
+        check=True, capture_output=True, text=True, env=env,
+    )
+    return parse(out.stderr)
+
+
+def run(runs: int, lazy: List[str], top: int) -> Dict[str, Any]:
+    totals: List[float] = []
+    packages: Dict[str, List[int]] = defaultdict(list)
+    imported: List[str] = []
+    for _ in range(runs):
+        rows = measure()
+        totals.append(next(cum for name, _, cum in rows if name == TARGET) / 1000)
+        per_package: Dict[str, int] = defaultdict(int)
+        for name, self_us, _ in rows:
+            per_package[name.split(".")[0]] += self_us
+        for name, us in per_package.items():
+            packages[name].append(us)
+        imported = [m for m in lazy if any(name == m or name.startswith(m + ".") for name, _, _ in rows)]
+    slowest = sorted(packages.items(), key=lambda kv: -statistics.median(kv[1]))[:top]
+    return {
+        "total_ms": statistics.median(totals),
+        "runs": runs,
+        "packages_ms": {name: statistics.median(us) / 1000 for name, us in slowest},
+        "lazy_imported": imported,
+    }
+
+
+def check(report: Dict[str, Any], budget_ms: float, baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    problems = [f"{m} is imported eagerly" for m in report["lazy_imported"]]
+    if budget_ms and report["total_ms"] > budget_ms:
+        problems.append(f"import took {report['total_ms']:.0f} ms, budget {budget_ms:.0f} ms")
+    if baseline and report["total_ms"] > baseline["total_ms"] * (1 + tolerance):
+        problems.append(f"import took {report['total_ms']:.0f} ms, baseline {baseline['total_ms']:.0f} ms "
+                        f"(+{100 * tolerance:.0f}% allowed)")
+    return problems
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import-time benchmark for agent_host.app.main")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=12, help="slowest top-level packages to list")
+    parser.add_argument("--lazy", default=",".join(LAZY), help="modules that must not be imported")
+    parser.add_argument("--budget-ms", type=float, default=0.0, help="fail above this median (0 disables)")
+    parser.add_argument("--baseline", help="earlier --out report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against --baseline")
+    parser.add_argument("--out", help="write the JSON report here")
+    args = parser.parse_args()
+
+    report = run(args.runs, [m for m in args.lazy.split(",") if m], args.top)
+    print(f"{TARGET}: {report['total_ms']:.1f} ms (median of {args.runs})")
+    for name, ms in report["packages_ms"].items():
+        print(f"  {name:<32} {ms:8.1f} ms")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    baseline: Dict[str, Any] = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    problems = check(report, args.budget_ms, baseline, args.tolerance)
+    for problem in problems:
+        print("FAIL:", problem)
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""Microbenchmarks for the storage hot paths.
+
+Covers chat history (load_history, append_turn, update_turn, delete_turn, search) at
+several history sizes, chroma_store upsert/query with and without a `where`
+filter, and profiles.list_profiles over many agents. Each case runs `--repeat`
+times against a fresh data directory; the report holds min/median/max seconds
+per case and can be compared against a saved baseline to catch regressions
+between branches.
+
+    PYTHONPATH=src python benchmarks/bench_storage.py --out main.json
+    PYTHONPATH=src python benchmarks/bench_storage.py --history-sizes 1000,100000,1000000 --compare main.json
+
+By default memories are embedded with a cheap deterministic hash embedding so
+the numbers measure storage rather than the embedding model; pass
+`--embedder default` to use Chroma's bundled model instead.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List
+
+from agent_host.app.agents import profiles
+from agent_host.app.orchestrator import history as H
+from agent_host.app.orchestrator import history_index
+
+AGENT = "bench"
+TYPES = ("preference", "fact", "event", "task")
+TAGS = ("food", "travel", "work", "family", "music")
+
+
+def _timeit(fn: Callable[[], Any], repeat: int, setup: Callable[[], Any] = lambda: None) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        setup()
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"min": min(times), "median": statistics.median(times), "max": max(times)}
+
+
+def _report(results: Dict[str, Any], name: str, timing: Dict[str, float]) -> None:
+    results[name] = timing
+    print(f"{name:<40} median {timing['median'] * 1000:10.3f} ms  (min {timing['min'] * 1000:.3f})")
+
+
+# ===== History =====
+
+def _seed_history(root: str, n: int) -> List[str]:
+    """Write n records straight to the JSONL file and return their ids."""
+    path = H._hist_path(root, AGENT)
+    ids = []
+    ts = H._now_ts()
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(n):
+            mid = f"m{i:08d}"
+            ids.append(mid)
+            role = "user" if i % 2 == 0 else "assistant"
+            record = {"message_id": mid, "role": role, "content": f"message {i} " + "lorem ipsum " * 8,
+                      "created_at": ts, "updated_at": ts}
+            f.write(json.dumps(record) + "\n")
+    return ids
+
+
+def bench_history(sizes: List[int], repeat: int, results: Dict[str, Any]) -> None:
+    for n in sizes:
+        root = tempfile.mkdtemp(prefix="bench-history-")
+        try:
+            ids = _seed_history(root, n)
+            mid = ids[n // 2]
+            _report(results, f"history.load_history[{n}]",
+                    _timeit(lambda: H.load_history(root, AGENT, max_pairs=20), repeat))
+            _report(results, f"history.append_turn[{n}]",
+                    _timeit(lambda: H.append_turn(root, AGENT, "user", "hello"), repeat))
+            _report(results, f"history.update_turn[{n}]",
+                    _timeit(lambda: H.update_turn(root, AGENT, mid, {"content": "edited"}), repeat))
+            # Deleting the same id twice would be a no-op, so put it back between runs
+            _report(results, f"history.delete_turn[{n}]",
+                    _timeit(lambda: H.delete_turn(root, AGENT, mid), repeat,
+                            setup=lambda: H.append_turn(root, AGENT, "user", "x", message_id=mid)))
+            # First search builds the in-memory index; later ones only query it
+            _report(results, f"history.search_build[{n}]",
+                    _timeit(lambda: H.search(root, AGENT, f"message {n // 3}"), 1,
+                            setup=lambda: history_index.drop(root, AGENT)))
+            _report(results, f"history.search[{n}]",
+                    _timeit(lambda: H.search(root, AGENT, f"message {n // 3}"), repeat))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+# ===== Chroma =====
+
+class HashEmbedding:
+    """Deterministic bag-of-words hashing embedding; no model download needed."""
+
+    def __init__(self, dim: int = 384):
+        self.dim = dim
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        out = []
+        for text in input:
+            vec = [0.0] * self.dim
+            for word in text.lower().split():
+                h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+                vec[h % self.dim] += 1.0 if h & 1 << 63 else -1.0
+            norm = sum(v * v for v in vec) ** 0.5 or 1.0
+            out.append([v / norm for v in vec])
+        return out
+
+    def embed_query(self, input: List[str]) -> List[List[float]]:
+        return self(input)
+
+    @staticmethod
+    def name() -> str:
+        return "bench-hash"
+
+    def is_legacy(self) -> bool:
+        return False
+
+
+def _use_hash_embedding(chroma_store) -> None:
+    embed = HashEmbedding()
+    chroma_store.embedding_function = lambda: embed
+
+
+def _memory(i: int) -> Dict[str, Any]:
+    return {
+        "text": f"memory {i} about {TAGS[i % len(TAGS)]} and {TYPES[i % len(TYPES)]} number {i % 97}",
+        "type": TYPES[i % len(TYPES)],
+        "tag": TAGS[i % len(TAGS)],
+        "date": 20250101 + i % 28,
+        "salience": (i % 10) / 10,
+    }
+
+
+def bench_chroma(sizes: List[int], repeat: int, embedder: str, results: Dict[str, Any]) -> None:
+    from agent_host.app.memory import chroma_store
+
+    if embedder == "hash":
+        _use_hash_embedding(chroma_store)
+    batch = 1000
+    for n in sizes:
+        root = tempfile.mkdtemp(prefix="bench-chroma-")
+        try:
+            start = time.perf_counter()
+            for offset in range(0, n, batch):
+                chroma_store.upsert_memories(AGENT, root, [_memory(i) for i in range(offset, min(n, offset + batch))])
+            results[f"chroma.seed[{n}]"] = {"total": time.perf_counter() - start}
+            print(f"{'chroma.seed[' + str(n) + ']':<40} total  {results[f'chroma.seed[{n}]']['total']:10.3f} s")
+
+            counter = iter(range(n, n + 10 * repeat * batch))
+            _report(results, f"chroma.upsert_memories[{n}]x100",
+                    _timeit(lambda: chroma_store.upsert_memories(AGENT, root, [_memory(next(counter)) for _ in range(100)]),
+                            repeat))
+            _report(results, f"chroma.query_memories[{n}]",
+                    _timeit(lambda: chroma_store.query_memories(AGENT, root, "what food do I like", k=6), repeat))
+            _report(results, f"chroma.query_memories[{n}]+where",
+                    _timeit(lambda: chroma_store.query_memories(AGENT, root, "what food do I like", k=6,
+                                                                where={"tag": "food", "type": "preference"}),
+                            repeat))
+        finally:
+            shutil.rmtree(root, ignore_errors=True)
+
+
+# ===== Profiles =====
+
+def bench_profiles(agents: int, repeat: int, results: Dict[str, Any]) -> None:
+    root = tempfile.mkdtemp(prefix="bench-profiles-")
+    try:
+        for i in range(agents):
+            agent_id = f"agent-{i:06d}"
+            os.makedirs(os.path.join(root, agent_id))
+            with open(profiles._profile_path(root, agent_id), "w", encoding="utf-8") as f:
+                json.dump({"agent_id": agent_id, "character": "Benchmark agent", "notes": ""}, f)
+        _report(results, f"profiles.list_profiles[{agents}] cold",
+                _timeit(lambda: profiles.list_profiles(root), repeat, setup=lambda: profiles.invalidate(root)))
+        _report(results, f"profiles.list_profiles[{agents}] warm",
+                _timeit(lambda: profiles.list_profiles(root), repeat, setup=lambda: profiles.list_profiles(root)))
+    finally:
+        profiles.invalidate(root)
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Return the cases whose median got slower than the baseline by more than `threshold`."""
+    regressions = []
+    for name, timing in current.items():
+        old = baseline.get(name, {}).get("median")
+        new = timing.get("median")
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        print(f"{name:<40} {old * 1000:10.3f} -> {new * 1000:10.3f} ms ({change:+.1%})")
+        if change > threshold:
+            regressions.append(f"{name} slower by {change:.1%}")
+    return regressions
+
+
+def _sizes(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Storage microbenchmarks")
+    parser.add_argument("--history-sizes", type=_sizes, default=[1000, 100000],
+                        help="comma-separated record counts (e.g. 1000,100000,1000000)")
+    parser.add_argument("--memory-sizes", type=_sizes, default=[1000],
+                        help="comma-separated memory counts (e.g. 1000,100000)")
+    parser.add_argument("--profile-agents", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--embedder", choices=("hash", "default"), default="hash")
+    parser.add_argument("--only", choices=("history", "chroma", "profiles"), action="append",
+                        help="run only these groups (repeatable)")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative slowdown of a median that fails --compare")
+    args = parser.parse_args()
+
+    groups = set(args.only or ("history", "chroma", "profiles"))
+    results: Dict[str, Any] = {}
+    if "history" in groups:
+        bench_history(args.history_sizes, args.repeat, results)
+    if "chroma" in groups:
+        bench_chroma(args.memory_sizes, args.repeat, args.embedder, results)
+    if "profiles" in groups:
+        bench_profiles(args.profile_agents, args.repeat, results)
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Compare the text TOOL_CALL convention against native tool calling.
+
+Runs the same tool-seeking prompts through a live llama-server in both modes and
+reports prompt tokens (from the server's `usage`), latency, and how often the
+expected tool call could not be parsed. Native mode needs llama-server started
+with --jinja.
+
+    PYTHONPATH=src python benchmarks/bench_tool_calling.py --trials 5 --out bench_tool_calling.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from typing import Any, Dict, List
+
+from agent_host.app.clients.llamacpp import nonstream_chat
+from agent_host.app.orchestrator.prompt import compile_prompt
+from agent_host.app.orchestrator.session import parse_native_tool_calls, parse_tool_calls
+from agent_host.app.orchestrator.tools import TOOLS, list_tools_native
+
+PROFILE = {
+    "agent_id": "bench",
+    "character": "You are a concise assistant that uses tools when they help",
+    "notes": "none",
+}
+
+PROMPTS = [
+    "Search the web for the latest llama.cpp release notes.",
+    "Fetch https://example.com and tell me what it says.",
+    "Update your notes: the user prefers metric units.",
+    "Look up who won the most recent Tour de France.",
+]
+
+
+async def _trial(mode: str, prompt: str) -> Dict[str, Any]:
+    native = mode == "native"
+    messages = [
+        {"role": "system", "content": compile_prompt(PROFILE, include_tools=not native).text},
+        {"role": "user", "content": prompt},
+    ]
+    kwargs = {"tools": list_tools_native()} if native else {}
+    start = time.perf_counter()
+    out = await nonstream_chat(messages, cache_prompt=False, **kwargs)
+    elapsed = time.perf_counter() - start
+
+    try:
+        if native:
+            calls = [(name, payload) for _, name, payload in parse_native_tool_calls(out["tool_calls"])]
+        else:
+            calls = list(parse_tool_calls(out["text"]))
+        parse_ok = bool(calls) and all(name in TOOLS for name, _ in calls)
+    except Exception:
+        parse_ok = False
+
+    usage = out["raw"].get("usage") or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "latency_s": elapsed,
+        "parse_ok": parse_ok,
+    }
+
+
+def _summarize(trials: List[Dict[str, Any]]) -> Dict[str, Any]:
+    prompt_tokens = [t["prompt_tokens"] for t in trials if t["prompt_tokens"] is not None]
+    return {
+        "trials": len(trials),
+        "mean_prompt_tokens": statistics.mean(prompt_tokens) if prompt_tokens else None,
+        "mean_latency_s": statistics.mean(t["latency_s"] for t in trials),
+        "parse_failure_rate": sum(not t["parse_ok"] for t in trials) / len(trials),
+    }
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=3, help="runs per prompt and mode")
+    parser.add_argument("--modes", default="text,native")
+    parser.add_argument("--out", help="write the JSON report here")
+    args = parser.parse_args()
+
+    report: Dict[str, Any] = {}
+    for mode in args.modes.split(","):
+        trials = []
+        for prompt in PROMPTS:
+            for _ in range(args.trials):
+                try:
+                    trials.append(await _trial(mode, prompt))
+                except Exception as exc:
+                    print(f"[{mode}] request failed: {exc}")
+                    trials.append({"prompt_tokens": None, "completion_tokens": None,
+                                   "latency_s": 0.0, "parse_ok": False})
+        report[mode] = _summarize(trials)
+
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
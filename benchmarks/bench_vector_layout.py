@@ -0,0 +1,150 @@
+"""Compare the vector storage layouts (CHROMA_LAYOUT, VECTOR_BACKEND) at growing agent counts.
+
+For each layout and agent count a fresh data directory is seeded with
+`--memories` memories per agent. A separate process then queries `--sample`
+randomly chosen agents. It reports:
+
+- cold_query_ms: the first query for each agent, opening its store
+- warm_query_ms: the same queries repeated
+- rss_mb: resident memory after every sampled agent was touched
+- open_files: file descriptors held at that point
+- disk_mb: size of the data directory
+
+    PYTHONPATH=src python benchmarks/bench_vector_layout.py
+    PYTHONPATH=src python benchmarks/bench_vector_layout.py --agents 10,1000,10000 --out layouts.json
+
+Seeding the per_agent layout with 10k agents creates 10k SQLite databases and
+takes a while. Embeddings use the hash embedding from bench_storage.py, so the
+numbers measure storage rather than the embedding model.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from bench_storage import HashEmbedding, _memory, _sizes
+
+# "numpy" is VECTOR_BACKEND=numpy (memory-mapped arrays, never promoted here)
+LAYOUTS = ("per_agent", "collection", "shared", "numpy")
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+
+def _setup(layout: str):
+    from agent_host.app import config
+    from agent_host.app.memory import chroma_store
+
+    if layout == "numpy":
+        config.VECTOR_BACKEND = "numpy"
+    else:
+        config.CHROMA_LAYOUT = layout
+    embed = HashEmbedding()
+    chroma_store.embedding_function = lambda: embed
+    return chroma_store
+
+
+def _seed(root: str, layout: str, agents: int, memories: int) -> Dict[str, Any]:
+    chroma_store = _setup(layout)
+    start = time.perf_counter()
+    for a in range(agents):
+        chroma_store.upsert_memories(f"agent-{a}", root, [_memory(a * memories + i) for i in range(memories)])
+    return {"seed_s": time.perf_counter() - start}
+
+
+def _query(root: str, layout: str, agents: int, sample: int) -> Dict[str, Any]:
+    chroma_store = _setup(layout)
+    picked = random.Random(0).sample(range(agents), min(sample, agents))
+    cold, warm = [], []
+    for a in picked:
+        start = time.perf_counter()
+        chroma_store.query_memories(f"agent-{a}", root, "what food do I like", k=6)
+        cold.append(time.perf_counter() - start)
+    for a in picked:
+        start = time.perf_counter()
+        chroma_store.query_memories(f"agent-{a}", root, "what food do I like", k=6)
+        warm.append(time.perf_counter() - start)
+    return {
+        "cold_query_ms": 1000 * statistics.median(cold),
+        "cold_query_p95_ms": 1000 * sorted(cold)[int(0.95 * (len(cold) - 1))],
+        "warm_query_ms": 1000 * statistics.median(warm),
+        "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "open_files": len(os.listdir("/proc/self/fd")) if os.path.isdir("/proc/self/fd") else None,
+    }
+
+
+def _child(mode: str, root: str, layout: str, agents: int, arg: int) -> Dict[str, Any]:
+    """Run one phase in a fresh interpreter so caches and RSS start clean."""
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(REPO_ROOT / "src"), os.environ.get("PYTHONPATH", "")])}
+    out = subprocess.run(
+        [sys.executable, __file__, "--child", mode, "--root", root, "--layout", layout,
+         "--agents", str(agents), "--child-arg", str(arg)],
+        check=True, capture_output=True, text=True, env=env,
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def _disk_mb(root: str) -> float:
+    total = 0
+    for dirpath, _, files in os.walk(root):
+        total += sum(os.path.getsize(os.path.join(dirpath, f)) for f in files)
+    return total / (1024 * 1024)
+
+
+def run(agent_counts: List[int], layouts: List[str], memories: int, sample: int) -> Dict[str, Any]:
+    results: Dict[str, Any] = {}
+    for n in agent_counts:
+        for layout in layouts:
+            root = tempfile.mkdtemp(prefix="bench-layout-")
+            try:
+                row = _child("seed", root, layout, n, memories)
+                row.update(_child("query", root, layout, n, sample))
+                row["disk_mb"] = _disk_mb(root)
+            finally:
+                shutil.rmtree(root, ignore_errors=True)
+            name = f"{layout}[{n}]"
+            results[name] = row
+            print(f"{name:<20} cold {row['cold_query_ms']:8.2f} ms  warm {row['warm_query_ms']:7.2f} ms  "
+                  f"rss {row['rss_mb']:7.1f} MB  fds {row['open_files']}  disk {row['disk_mb']:8.1f} MB  "
+                  f"seed {row['seed_s']:7.1f} s")
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Vector store layout benchmark")
+    parser.add_argument("--agents", default="10,1000", help="comma-separated agent counts (e.g. 10,1000,10000)")
+    parser.add_argument("--layouts", default=",".join(LAYOUTS))
+    parser.add_argument("--memories", type=int, default=20, help="memories per agent")
+    parser.add_argument("--sample", type=int, default=200, help="agents queried per run")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--child", choices=["seed", "query"], help=argparse.SUPPRESS)
+    parser.add_argument("--root", help=argparse.SUPPRESS)
+    parser.add_argument("--layout", help=argparse.SUPPRESS)
+    parser.add_argument("--child-arg", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child == "seed":
+        print(json.dumps(_seed(args.root, args.layout, int(args.agents), args.child_arg)))
+        return
+    if args.child == "query":
+        print(json.dumps(_query(args.root, args.layout, int(args.agents), args.child_arg)))
+        return
+
+    results = run(_sizes(args.agents), [l for l in args.layouts.split(",") if l], args.memories, args.sample)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""Fake OpenAI-compatible llama-server for load tests and local development.
+
+Implements the parts of llama-server the agent host talks to:
+/v1/chat/completions (streaming and not, text TOOL_CALLs or native tool_calls),
+/v1/embeddings (deterministic hashed bag-of-words vectors), /tokenize, /health,
+/slots and /metrics. Timing is synthetic: each request
+waits for a free slot, sleeps `ttft` seconds of "prefill", then emits
+`completion_tokens` tokens at `token_rate` tokens/s.
+
+    python benchmarks/fake_llama_server.py --port 50000 --token-rate 40 --ttft 0.15 --tool-call-rate 0.1
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+from typing import Any, AsyncIterator, Dict, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+
+EMBEDDING_DIM = 384
+TOOL_CALL_TEXT = 'TOOL_CALL: {"name":"agent.update_notes","payload":{"notes":"load test note"}}'
+
+
+def create_app(
+    token_rate: float = 50.0,
+    ttft: float = 0.1,
+    completion_tokens: int = 32,
+    tool_call_rate: float = 0.0,
+    slots: int = 4,
+    seed: int = 0,
+) -> FastAPI:
+    app = FastAPI(title="fake llama-server")
+    rng = random.Random(seed)
+    slot_sem = asyncio.Semaphore(slots)
+    state: Dict[str, Any] = {
+        "processing": 0,
+        "deferred": 0,
+        "prompt_tokens_total": 0,
+        "tokens_predicted_total": 0,
+        "requests_total": 0,
+    }
+
+    def _prompt_tokens(messages: List[Dict[str, Any]]) -> int:
+        return sum(len(str(m.get("content") or "").split()) for m in messages)
+
+    def _wants_tool_call(body: Dict[str, Any]) -> bool:
+        messages = body.get("messages") or []
+        if messages and messages[-1].get("role") in ("tool", "assistant"):
+            return False
+        return tool_call_rate > 0 and rng.random() < tool_call_rate
+
+    def _timings(prompt_n: int, predicted_n: int, started: float, first: float) -> Dict[str, Any]:
+        now = time.perf_counter()
+        return {
+            "prompt_n": prompt_n,
+            "prompt_ms": (first - started) * 1000,
+            "cache_n": 0,
+            "predicted_n": predicted_n,
+            "predicted_ms": (now - first) * 1000,
+        }
+
+    async def _acquire_slot() -> None:
+        state["deferred"] += 1
+        await slot_sem.acquire()
+        state["deferred"] -= 1
+        state["processing"] += 1
+
+    def _release_slot() -> None:
+        state["processing"] -= 1
+        slot_sem.release()
+
+    async def _tokens(body: Dict[str, Any]) -> AsyncIterator[str]:
+        n = min(completion_tokens, int(body.get("max_tokens", completion_tokens)))
+        for i in range(n):
+            if i:
+                await asyncio.sleep(1.0 / token_rate)
+            yield f" tok{i}"
+
+    def _chunk(delta: Dict[str, Any], finish_reason: Any = None, **extra: Any) -> str:
+        obj = {
+            "object": "chat.completion.chunk",
+            "model": "fake",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            **extra,
+        }
+        return f"data: {json.dumps(obj)}\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        state["requests_total"] += 1
+        prompt_n = _prompt_tokens(body.get("messages") or [])
+        native = bool(body.get("tools"))
+        constrained = "response_format" in body or "json_schema" in body
+        tool_call = _wants_tool_call(body)
+
+        if not body.get("stream"):
+            await _acquire_slot()
+            try:
+                started = time.perf_counter()
+                await asyncio.sleep(ttft)
+                first = time.perf_counter()
+                parts = [t async for t in _tokens(body)]
+            finally:
+                _release_slot()
+            text = "".join(parts)
+            message: Dict[str, Any] = {"role": "assistant", "content": text}
+            if constrained:
+                message["content"] = TOOL_CALL_TEXT.split("TOOL_CALL: ", 1)[1]
+            elif tool_call and native:
+                message["tool_calls"] = [{
+                    "id": f"call_{state['requests_total']}",
+                    "type": "function",
+                    "function": {"name": "agent__update_notes", "arguments": '{"notes":"load test note"}'},
+                }]
+            elif tool_call:
+                message["content"] = text + "\n" + TOOL_CALL_TEXT
+            state["prompt_tokens_total"] += prompt_n
+            state["tokens_predicted_total"] += len(parts)
+            return JSONResponse({
+                "object": "chat.completion",
+                "model": "fake",
+                "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_n, "completion_tokens": len(parts),
+                          "total_tokens": prompt_n + len(parts)},
+                "timings": _timings(prompt_n, len(parts), started, first),
+            })
+
+        async def event_stream() -> AsyncIterator[str]:
+            await _acquire_slot()
+            try:
+                started = time.perf_counter()
+                await asyncio.sleep(ttft)
+                first = time.perf_counter()
+                n = 0
+                yield _chunk({"role": "assistant", "content": None})
+                async for tok in _tokens(body):
+                    n += 1
+                    yield _chunk({"content": tok})
+                if tool_call and native:
+                    yield _chunk({"tool_calls": [{
+                        "index": 0,
+                        "id": f"call_{state['requests_total']}",
+                        "type": "function",
+                        "function": {"name": "agent__update_notes", "arguments": '{"notes":"load test note"}'},
+                    }]})
+                elif tool_call:
+                    yield _chunk({"content": "\n" + TOOL_CALL_TEXT})
+                state["prompt_tokens_total"] += prompt_n
+                state["tokens_predicted_total"] += n
+                yield _chunk({}, "stop", timings=_timings(prompt_n, n, started, first))
+                yield "data: [DONE]\n\n"
+            finally:
+                _release_slot()
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        inputs = body.get("input", [])
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        data = [{"object": "embedding", "index": i, "embedding": _hash_embedding(text)}
+                for i, text in enumerate(inputs)]
+        return {"object": "list", "model": body.get("model", "fake"), "data": data}
+
+    @app.post("/tokenize")
+    async def tokenize(request: Request):
+        body = await request.json()
+        return {"tokens": list(range(len(str(body.get("content", "")).split())))}
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/slots")
+    async def get_slots():
+        busy = state["processing"]
+        return [{"id": i, "is_processing": i < busy} for i in range(slots)]
+
+    @app.get("/metrics")
+    async def get_metrics():
+        lines = [
+            "# TYPE llamacpp:prompt_tokens_total counter",
+            f"llamacpp:prompt_tokens_total {state['prompt_tokens_total']}",
+            "# TYPE llamacpp:tokens_predicted_total counter",
+            f"llamacpp:tokens_predicted_total {state['tokens_predicted_total']}",
+            "# TYPE llamacpp:requests_processing gauge",
+            f"llamacpp:requests_processing {state['processing']}",
+            "# TYPE llamacpp:requests_deferred gauge",
+            f"llamacpp:requests_deferred {state['deferred']}",
+        ]
+        return PlainTextResponse("\n".join(lines) + "\n")
+
+    return app
+
+
+def _hash_embedding(text: str) -> List[float]:
+    vec = [0.0] * EMBEDDING_DIM
+    for word in text.lower().split():
+        h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+        vec[h % EMBEDDING_DIM] += 1.0 if h & 1 << 63 else -1.0
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible llama-server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=50000)
+    parser.add_argument("--token-rate", type=float, default=50.0, help="tokens per second per request")
+    parser.add_argument("--ttft", type=float, default=0.1, help="seconds before the first token")
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    parser.add_argument("--tool-call-rate", type=float, default=0.0,
+                        help="probability that a reply contains a tool call")
+    parser.add_argument("--slots", type=int, default=4, help="concurrent generations")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    app = create_app(
+        token_rate=args.token_rate,
+        ttft=args.ttft,
+        completion_tokens=args.completion_tokens,
+        tool_call_rate=args.tool_call_rate,
+        slots=args.slots,
+        seed=args.seed,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
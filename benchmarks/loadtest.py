@@ -0,0 +1,263 @@
+"""End-to-end load test of the chat API against a fake llama-server.
+
+Starts benchmarks/fake_llama_server.py and the FastAPI app (uvicorn) as
+subprocesses, creates M agents, then drives N concurrent SSE clients that each
+run a number of /chat turns round-robin over the agents. Reports TTFT and
+inter-token latency percentiles, turns/s, and the API process' CPU and RSS,
+and writes everything as JSON so runs can be compared.
+
+    PYTHONPATH=src python benchmarks/loadtest.py --clients 16 --agents 8 --turns 5 --out run.json
+    PYTHONPATH=src python benchmarks/loadtest.py ... --compare run.json --threshold 0.15
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+REPO_ROOT = Path(__file__).resolve().parents[1]
+
+# Metrics checked by --compare, and whether higher is better
+COMPARED = {
+    "ttft_ms.p50": False,
+    "ttft_ms.p95": False,
+    "itl_ms.p50": False,
+    "itl_ms.p95": False,
+    "turns_per_s": True,
+    "cpu_percent": False,
+}
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    ordered = sorted(values)
+
+    def pick(q: float) -> float:
+        idx = min(len(ordered) - 1, max(0, round(q * (len(ordered) - 1))))
+        return ordered[idx]
+
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+class ProcStats:
+    """CPU time and RSS of a process, read from /proc (Linux only)."""
+
+    def __init__(self, pid: int):
+        self.pid = pid
+        self.peak_rss_mb = 0.0
+        self._ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def cpu_seconds(self) -> Optional[float]:
+        try:
+            with open(f"/proc/{self.pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        utime, stime = int(fields[11]), int(fields[12])
+        return (utime + stime) / self._ticks
+
+    def sample_rss(self) -> None:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        self.peak_rss_mb = max(self.peak_rss_mb, int(line.split()[1]) / 1024)
+                        return
+        except OSError:
+            pass
+
+
+async def _wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get(url)).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+async def _chat_turn(client: httpx.AsyncClient, agent_id: str, text: str) -> Dict[str, Any]:
+    start = time.perf_counter()
+    first: Optional[float] = None
+    last: Optional[float] = None
+    gaps: List[float] = []
+    event = None
+    async with client.stream("POST", "/chat", json={"agent_id": agent_id, "user": text}) as r:
+        r.raise_for_status()
+        async for line in r.aiter_lines():
+            if line.startswith("event:"):
+                event = line[len("event:"):].strip()
+            elif line.startswith("data:") and event == "chunk":
+                now = time.perf_counter()
+                if first is None:
+                    first = now
+                else:
+                    gaps.append(now - last)
+                last = now
+            elif line.startswith("data:") and event == "done":
+                break
+    end = time.perf_counter()
+    return {"ttft": (first or end) - start, "gaps": gaps, "duration": end - start}
+
+
+async def _client_loop(base_url: str, agents: List[str], client_idx: int, turns: int,
+                       results: List[Dict[str, Any]], errors: List[str]) -> None:
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        for turn in range(turns):
+            agent_id = agents[(client_idx + turn) % len(agents)]
+            try:
+                results.append(await _chat_turn(client, agent_id, f"client {client_idx} turn {turn}"))
+            except Exception as exc:
+                errors.append(f"{type(exc).__name__}: {exc}")
+
+
+async def run(args: argparse.Namespace) -> Dict[str, Any]:
+    fake_ports = [_free_port() for _ in range(max(1, args.backends))]
+    api_port = _free_port()
+    fake_urls = [f"http://127.0.0.1:{port}" for port in fake_ports]
+    data_dir = tempfile.mkdtemp(prefix="agent-loadtest-")
+    env = {
+        **os.environ,
+        "PYTHONPATH": os.pathsep.join([str(REPO_ROOT / "src"), os.environ.get("PYTHONPATH", "")]),
+        "LLAMACPP_BASE_URL": fake_urls[0],
+        "LLAMACPP_BASE_URLS": ",".join(fake_urls),
+        "CHROMA_PERSIST_ROOT": data_dir,
+    }
+    fakes = [subprocess.Popen([
+        sys.executable, str(REPO_ROOT / "benchmarks" / "fake_llama_server.py"),
+        "--port", str(port),
+        "--token-rate", str(args.token_rate),
+        "--ttft", str(args.ttft),
+        "--completion-tokens", str(args.completion_tokens),
+        "--tool-call-rate", str(args.tool_call_rate),
+        "--slots", str(args.slots),
+    ], env=env) for port in fake_ports]
+    api = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "agent_host.app.main:app",
+        "--port", str(api_port), "--log-level", "warning",
+    ], env=env)
+    base_url = f"http://127.0.0.1:{api_port}"
+    try:
+        for url in fake_urls:
+            await _wait_ready(f"{url}/health")
+        await _wait_ready(f"{base_url}/healthz", timeout=150.0)  # waits out the warmup
+
+        agents = [f"load-{i}" for i in range(args.agents)]
+        async with httpx.AsyncClient(base_url=base_url) as client:
+            # "default" receives the fake server's agent.update_notes tool calls
+            for agent_id in agents + ["default"]:
+                await client.post("/agents", json={"agent_id": agent_id, "character": "Load tester", "notes": ""})
+
+        stats = ProcStats(api.pid)
+        results: List[Dict[str, Any]] = []
+        errors: List[str] = []
+        cpu_start = stats.cpu_seconds()
+        wall_start = time.perf_counter()
+        clients = asyncio.gather(*(
+            _client_loop(base_url, agents, i, args.turns, results, errors) for i in range(args.clients)
+        ))
+        while not clients.done():
+            stats.sample_rss()
+            await asyncio.sleep(0.1)
+        await clients
+        wall = time.perf_counter() - wall_start
+        cpu_end = stats.cpu_seconds()
+    finally:
+        for proc in [api, *fakes]:
+            proc.terminate()
+        for proc in [api, *fakes]:
+            proc.wait(timeout=10)
+
+    cpu = (cpu_end - cpu_start) if cpu_start is not None and cpu_end is not None else None
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "threshold")},
+        "turns": len(results),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "wall_s": wall,
+        "turns_per_s": len(results) / wall if wall else None,
+        "ttft_ms": percentiles([r["ttft"] * 1000 for r in results]),
+        "itl_ms": percentiles([g * 1000 for r in results for g in r["gaps"]]),
+        "turn_ms": percentiles([r["duration"] * 1000 for r in results]),
+        "cpu_percent": 100 * cpu / wall if cpu is not None and wall else None,
+        "rss_peak_mb": stats.peak_rss_mb or None,
+    }
+
+
+def _lookup(report: Dict[str, Any], dotted: str) -> Optional[float]:
+    value: Any = report
+    for part in dotted.split("."):
+        value = value.get(part) if isinstance(value, dict) else None
+    return value
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """Return human-readable regressions larger than `threshold` (relative)."""
+    regressions = []
+    for metric, higher_is_better in COMPARED.items():
+        new, old = _lookup(current, metric), _lookup(baseline, metric)
+        if new is None or old is None or old == 0:
+            continue
+        change = (new - old) / old
+        worse = -change if higher_is_better else change
+        print(f"{metric:>14}: {old:10.2f} -> {new:10.2f} ({change:+.1%})")
+        if worse > threshold:
+            regressions.append(f"{metric} regressed by {worse:.1%}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load-test /chat against a fake llama-server")
+    parser.add_argument("--clients", type=int, default=8, help="concurrent SSE clients")
+    parser.add_argument("--agents", type=int, default=4, help="agents the clients rotate over")
+    parser.add_argument("--turns", type=int, default=5, help="turns per client")
+    parser.add_argument("--token-rate", type=float, default=50.0)
+    parser.add_argument("--ttft", type=float, default=0.1)
+    parser.add_argument("--completion-tokens", type=int, default=32)
+    parser.add_argument("--tool-call-rate", type=float, default=0.0)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--backends", type=int, default=1, help="fake llama-servers to balance across")
+    parser.add_argument("--out", help="write the JSON report here")
+    parser.add_argument("--compare", help="baseline JSON report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="relative regression that fails --compare")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.threshold)
+        if regressions:
+            print("\n".join(regressions))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Stand-in for an OpenTelemetry collector (OTLP/HTTP JSON traces only).
+
+Run it and point the API at it:
+
+    uvicorn scripts.otlp_collector_stub:app --port 4318
+    OTEL_EXPORTER_OTLP_ENDPOINT=http://127.0.0.1:4318 uvicorn agent_host.app.main:app ...
+
+Every received span is printed as an indented tree and appended to
+otlp_spans.jsonl.
+"""
+
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List
+
+from fastapi import FastAPI, Request
+
+OUTPUT_PATH = "otlp_spans.jsonl"
+
+app = FastAPI(title="OTLP collector stub")
+
+
+def _print_tree(spans: List[Dict[str, Any]]) -> None:
+    children: Dict[str, List[Dict[str, Any]]] = {}
+    for span in spans:
+        children.setdefault(span.get("parentSpanId", ""), []).append(span)
+
+    def walk(parent_id: str, depth: int) -> None:
+        for span in children.get(parent_id, []):
+            ms = (int(span["endTimeUnixNano"]) - int(span["startTimeUnixNano"])) / 1e6
+            attrs = {a["key"]: next(iter(a["value"].values())) for a in span.get("attributes", [])}
+            print(f"{'  ' * depth}{span['name']} {ms:.1f}ms {attrs}")
+            walk(span["spanId"], depth + 1)
+
+    walk("", 0)
+
+
+@app.post("/v1/traces")
+async def traces(request: Request):
+    body = await request.json()
+    with open(OUTPUT_PATH, "a", encoding="utf-8") as f:
+        for resource_spans in body.get("resourceSpans", []):
+            for scope_spans in resource_spans.get("scopeSpans", []):
+                spans = scope_spans.get("spans", [])
+                for span in spans:
+                    f.write(json.dumps(span) + "\n")
+                _print_tree(spans)
+    return {"partialSuccess": {}}
@@ -1,35 +1,160 @@
 import os
 import json
-from typing import List
+import stat
+import tempfile
+import time
+from typing import Dict, List, Optional, Tuple
 
+from ..config import PROFILE_CACHE_TTL
 from ..models import AgentProfile
 
+# Parsed profiles keyed by (root, agent_id). Each entry keeps the stat signature
+# of the profile.json it was parsed from, so any edit on disk invalidates it.
+_CACHE: Dict[Tuple[str, str], "_CachedProfile"] = {}
+# Per-root agent index: the agent ids that own a profile.json.
+_INDEX: Dict[str, "_AgentIndex"] = {}
+
+# mkstemp creates 0600 files; new profiles get the mode open() would give them
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+
+class _CachedProfile:
+    __slots__ = ("signature", "profile", "checked_at")
+
+    def __init__(self, signature: Tuple[int, int, int], profile: AgentProfile, checked_at: float):
+        self.signature = signature
+        self.profile = profile
+        self.checked_at = checked_at
+
+
+class _AgentIndex:
+    # `pending` are agent directories without a profile.json yet (e.g. created by
+    # history writes); creating the file inside them leaves the root mtime alone
+    __slots__ = ("root_mtime", "agent_ids", "pending", "checked_at")
+
+    def __init__(self, root_mtime: int, agent_ids: List[str], pending: List[str], checked_at: float):
+        self.root_mtime = root_mtime
+        self.agent_ids = agent_ids
+        self.pending = pending
+        self.checked_at = checked_at
+
+
 def _profile_path(root: str, agent_id: str) -> str:
     return os.path.join(root, agent_id, "profile.json")
 
-def read_profile(root: str, agent_id: str) -> AgentProfile:
+def _signature(st: os.stat_result) -> Tuple[int, int, int]:
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _load(root: str, agent_id: str) -> _CachedProfile:
+    """Return the cache entry for an agent, re-parsing only when the file changed."""
     path = _profile_path(root, agent_id)
-    # print(f"current dir: {os.getcwd()}")
-    # print(f"Reading profile from {path}")
+    sig = _signature(os.stat(path))
+    key = (root, agent_id)
+    entry = _CACHE.get(key)
+    now = time.monotonic()
+    if entry is not None and entry.signature == sig:
+        entry.checked_at = now
+        return entry
     with open(path, "r", encoding="utf-8") as f:
-        return AgentProfile(**json.load(f))
+        profile = AgentProfile(**json.load(f))
+    entry = _CachedProfile(sig, profile, now)
+    _CACHE[key] = entry
+    return entry
+
+def read_profile(root: str, agent_id: str) -> AgentProfile:
+    # Callers may mutate the returned model, so never hand out the cached instance.
+    return _load(root, agent_id).profile.model_copy()
 
 def write_profile(root: str, profile: AgentProfile):
-    base = os.path.dirname(_profile_path(root, profile.agent_id))
+    path = _profile_path(root, profile.agent_id)
+    base = os.path.dirname(path)
     os.makedirs(base, exist_ok=True)
-    with open(_profile_path(root, profile.agent_id), "w", encoding="utf-8") as f:
-        json.dump(profile.model_dump(), f, ensure_ascii=False, indent=2)
+    # Write to a sibling temp file and rename over the target so concurrent
+    # readers see either the old or the new JSON, never a partial write.
+    try:
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+    except FileNotFoundError:
+        mode = 0o666 & ~_UMASK
+    fd, tmp_path = tempfile.mkstemp(prefix=".profile.", suffix=".tmp", dir=base)
+    try:
+        os.chmod(tmp_path, mode)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(profile.model_dump(), f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    _CACHE[(root, profile.agent_id)] = _CachedProfile(
+        _signature(os.stat(path)), profile.model_copy(), time.monotonic()
+    )
+    index = _INDEX.get(root)
+    if index is not None and profile.agent_id not in index.agent_ids:
+        index.agent_ids = sorted(index.agent_ids + [profile.agent_id])
+        if profile.agent_id in index.pending:
+            index.pending = [a for a in index.pending if a != profile.agent_id]
+
+
+def invalidate(root: Optional[str] = None) -> None:
+    """Drop cached profiles and the agent index (for one root, or everything)."""
+    if root is None:
+        _CACHE.clear()
+        _INDEX.clear()
+        return
+    _INDEX.pop(root, None)
+    for key in [k for k in _CACHE if k[0] == root]:
+        del _CACHE[key]
+
+
+def _agent_ids(root: str) -> List[str]:
+    now = time.monotonic()
+    index = _INDEX.get(root)
+    if index is not None and now - index.checked_at < PROFILE_CACHE_TTL:
+        return index.agent_ids
+
+    root_mtime = os.stat(root).st_mtime_ns
+    if index is None or index.root_mtime != root_mtime:
+        agent_ids, pending = [], []
+        for agent_id in sorted(os.listdir(root)):
+            if os.path.isfile(_profile_path(root, agent_id)):
+                agent_ids.append(agent_id)
+            elif os.path.isdir(os.path.join(root, agent_id)):
+                pending.append(agent_id)
+        index = _AgentIndex(root_mtime, agent_ids, pending, now)
+        _INDEX[root] = index
+    else:
+        found = [a for a in index.pending if os.path.isfile(_profile_path(root, a))]
+        if found:
+            index.agent_ids = sorted(index.agent_ids + found)
+            index.pending = [a for a in index.pending if a not in found]
+        index.checked_at = now
+    return index.agent_ids
 
 
 def list_profiles(root: str) -> List[AgentProfile]:
     if not os.path.isdir(root):
+        _INDEX.pop(root, None)
         return []
 
+    # Within PROFILE_CACHE_TTL of the last check a listing is served entirely
+    # from memory; after that each profile is re-validated with a single stat.
+    now = time.monotonic()
     profiles_data: List[AgentProfile] = []
-    for agent_id in sorted(os.listdir(root)):
-        path = _profile_path(root, agent_id)
-        if os.path.isfile(path):
-            profiles_data.append(read_profile(root, agent_id))
+    for agent_id in _agent_ids(root):
+        entry = _CACHE.get((root, agent_id))
+        if entry is None or now - entry.checked_at >= PROFILE_CACHE_TTL:
+            try:
+                entry = _load(root, agent_id)
+            except FileNotFoundError:
+                _CACHE.pop((root, agent_id), None)
+                continue
+        profiles_data.append(entry.profile.model_copy())
     return profiles_data
 
 
@@ -59,6 +184,11 @@ def delete_profile(root: str, agent_id: str) -> None:
         raise FileNotFoundError(f"Profile for agent '{agent_id}' does not exist")
 
     os.remove(path)
+    _CACHE.pop((root, agent_id), None)
+    index = _INDEX.get(root)
+    if index is not None and agent_id in index.agent_ids:
+        index.agent_ids = [a for a in index.agent_ids if a != agent_id]
+        index.pending = index.pending + [agent_id]
 
     agent_dir = os.path.dirname(path)
     try:
@@ -0,0 +1,122 @@
+"""Cache of finished completions for deterministic requests.
+
+Only requests that should reproduce exactly are cached: temperature 0 or a
+fixed seed. The key is a SHA-256 of the canonical request (model, messages,
+sampling params, tools/grammar), ignoring transport-only fields such as
+`stream`, `cache_prompt` and slot ids, so a streamed and a non-streamed call
+share an entry. The system prompt's "Current time:" line is left out of the
+key as well; otherwise no two turns would ever match. The date stays in, so an
+answer that depends on it is not replayed on a later day. Entries keep the
+content chunks as they were streamed, so a hit replays through stream_chat
+just like a live generation.
+
+Entries live in an in-process LRU (COMPLETION_CACHE_SIZE) and, when
+COMPLETION_CACHE_DIR is set, one JSON file per key that survives restarts.
+"""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from .. import config
+from ..metrics import COMPLETION_CACHE_REQUESTS
+
+# Payload fields that do not change what the model generates
+_TRANSPORT_FIELDS = {"stream", "cache_prompt", "id", "id_slot", "n_probs", "timings_per_token"}
+
+# The time line of orchestrator/prompt.py's VOLATILE_HEADER
+_TIME_LINE = re.compile(r"^Current time: .*(?:\n|$)", re.MULTILINE)
+
+_lock = threading.Lock()
+_entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+
+def cacheable(payload: Dict[str, Any]) -> bool:
+    if not config.COMPLETION_CACHE:
+        return False
+    seed = payload.get("seed")
+    return payload.get("temperature") == 0 or (seed is not None and seed != -1)
+
+
+def _stable_messages(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    return [
+        {**m, "content": _TIME_LINE.sub("", m["content"])}
+        if m.get("role") == "system" and isinstance(m.get("content"), str) else m
+        for m in messages
+    ]
+
+
+def key_for(payload: Dict[str, Any]) -> str:
+    request = {k: v for k, v in payload.items() if k not in _TRANSPORT_FIELDS}
+    if isinstance(request.get("messages"), list):
+        request["messages"] = _stable_messages(request["messages"])
+    canonical = json.dumps(request, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def _disk_path(key: str) -> Optional[str]:
+    if not config.COMPLETION_CACHE_DIR:
+        return None
+    return os.path.join(config.COMPLETION_CACHE_DIR, key[:2], key + ".json")
+
+
+def _remember(key: str, entry: Dict[str, Any]) -> None:
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > max(0, config.COMPLETION_CACHE_SIZE):
+            _entries.popitem(last=False)
+
+
+def get(key: str) -> Optional[Dict[str, Any]]:
+    with _lock:
+        entry = _entries.get(key)
+        if entry is not None:
+            _entries.move_to_end(key)
+    if entry is None:
+        path = _disk_path(key)
+        if path is not None:
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                entry = None
+            if entry is not None:
+                _remember(key, entry)
+    COMPLETION_CACHE_REQUESTS.inc(result="hit" if entry is not None else "miss")
+    return entry
+
+
+def put(key: str, chunks: List[str], tool_calls: List[Dict[str, Any]], stats: Dict[str, Any]) -> None:
+    entry = {"chunks": chunks, "tool_calls": tool_calls, "stats": stats}
+    _remember(key, entry)
+    path = _disk_path(key)
+    if path is None:
+        return
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".entry.", suffix=".tmp", dir=os.path.dirname(path))
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except OSError as exc:
+        print("Completion cache write failed:", exc)
+
+
+def as_response(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """A cached entry in nonstream_chat's return shape."""
+    text = "".join(entry["chunks"])
+    message: Dict[str, Any] = {"role": "assistant", "content": text}
+    if entry["tool_calls"]:
+        message["tool_calls"] = entry["tool_calls"]
+    raw = {"choices": [{"index": 0, "message": message, "finish_reason": "stop"}], **entry["stats"]}
+    return {"text": text, "tool_calls": entry["tool_calls"], "raw": raw}
+
+
+def clear() -> None:
+    with _lock:
+        _entries.clear()
@@ -0,0 +1,113 @@
+"""Embedding function backed by an OpenAI-compatible /v1/embeddings server.
+
+Point EMBEDDING_BASE_URL at a llama-server started with --embeddings (or any
+compatible server) and set EMBEDDING_BACKEND=remote. Memories are then embedded
+out of process, and the web process never loads Chroma's ONNX model.
+
+Calls go through one pooled httpx.Client. Large inputs are split into requests
+of EMBEDDING_REMOTE_BATCH texts. Vectors are cached in an LRU keyed by text, so
+repeated queries and re-upserted documents cost no request at all. Instances
+pickle without their client, so they also work in EmbeddingBatcher's process pool.
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from ..config import (
+    EMBEDDING_BASE_URL,
+    EMBEDDING_CACHE_SIZE,
+    EMBEDDING_MODEL,
+    EMBEDDING_REMOTE_BATCH,
+)
+
+
+class RemoteEmbeddingFunction:
+    def __init__(self, base_url: str = EMBEDDING_BASE_URL, model: str = EMBEDDING_MODEL,
+                 batch_size: int = EMBEDDING_REMOTE_BATCH, cache_size: int = EMBEDDING_CACHE_SIZE,
+                 timeout: float = 60.0, transport: Optional[httpx.BaseTransport] = None):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.batch_size = max(1, batch_size)
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self._transport = transport
+        self._client: Optional[httpx.Client] = None
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        state.update(_client=None, _lock=None, _cache=OrderedDict())
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def client(self) -> httpx.Client:
+        if self._client is None:
+            kwargs: Dict[str, Any] = {"timeout": self.timeout}
+            if self._transport is not None:
+                kwargs["transport"] = self._transport
+            self._client = httpx.Client(**kwargs)
+        return self._client
+
+    def __call__(self, input: List[str]) -> List[List[float]]:
+        out: List[Optional[List[float]]] = [None] * len(input)
+        missing: Dict[str, List[int]] = {}
+        with self._lock:
+            for i, text in enumerate(input):
+                vector = self._cache.get(text)
+                if vector is not None:
+                    self._cache.move_to_end(text)
+                    out[i] = vector
+                else:
+                    missing.setdefault(text, []).append(i)
+        texts = list(missing)
+        for start in range(0, len(texts), self.batch_size):
+            chunk = texts[start:start + self.batch_size]
+            for text, vector in zip(chunk, self._request(chunk)):
+                for i in missing[text]:
+                    out[i] = vector
+                self._remember(text, vector)
+        return out  # type: ignore[return-value]
+
+    def embed_query(self, input: List[str]) -> List[List[float]]:
+        return self(input)
+
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        r = self.client().post(f"{self.base_url}/v1/embeddings", json={"model": self.model, "input": texts})
+        r.raise_for_status()
+        data = sorted(r.json()["data"], key=lambda item: item.get("index", 0))
+        if len(data) != len(texts):
+            raise ValueError(f"embedding server returned {len(data)} vectors for {len(texts)} inputs")
+        return [item["embedding"] for item in data]
+
+    def _remember(self, text: str, vector: List[float]) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[text] = vector
+            self._cache.move_to_end(text)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    # Chroma's embedding-function protocol
+    @staticmethod
+    def name() -> str:
+        return "agent-host-remote"
+
+    def is_legacy(self) -> bool:
+        return False
+
+    def get_config(self) -> Dict[str, Any]:
+        return {"base_url": self.base_url, "model": self.model}
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "RemoteEmbeddingFunction":
+        return RemoteEmbeddingFunction(config.get("base_url", EMBEDDING_BASE_URL),
+                                       config.get("model", EMBEDDING_MODEL))
@@ -1,8 +1,208 @@
 # app/clients/llamacpp.py
 
+import asyncio
+import re
+import time
+import weakref
+from collections import OrderedDict
+
 import httpx
-from typing import AsyncGenerator, Dict, Any, Optional
-from ..config import LLAMACPP_BASE_URL
+from typing import AsyncGenerator, Dict, Any, Iterable, List, Optional
+from ..config import LLAMACPP_BASE_URLS, LLAMACPP_HEALTH_INTERVAL, LLAMACPP_MODEL
+from . import completion_cache
+from ..metrics import (
+    LLM_BACKEND_OUTSTANDING,
+    LLM_BACKEND_UP,
+    LLM_DECODE_TOKENS_PER_SECOND,
+    LLM_FAILOVERS,
+    LLM_REQUESTS_IN_FLIGHT,
+    LLM_TTFT_SECONDS,
+)
+
+# Models whose server rejected a native `tools` request (e.g. no --jinja),
+# mapped to when to try native calls again; callers fall back to the text
+# TOOL_CALL convention until then. Only a client error that names tools counts:
+# 5xx, 429 and busy-slot 503s are ordinary failures.
+_NATIVE_TOOLS_UNSUPPORTED: Dict[str, float] = {}
+NATIVE_TOOLS_RECHECK_SECONDS = 600.0
+_TOOLS_REJECTION = re.compile(r"tool|jinja|function", re.IGNORECASE)
+
+
+class NativeToolsUnsupported(RuntimeError):
+    """The server refused a request carrying `tools`; retry with the text convention."""
+
+
+def native_tools_supported(model: str = LLAMACPP_MODEL) -> bool:
+    retry_at = _NATIVE_TOOLS_UNSUPPORTED.get(model)
+    if retry_at is None:
+        return True
+    if time.monotonic() >= retry_at:
+        _NATIVE_TOOLS_UNSUPPORTED.pop(model, None)
+        return True
+    return False
+
+
+def _check_tools_rejected(status_code: int, body: str, payload: Dict[str, Any]) -> None:
+    if status_code in (400, 422, 501) and payload.get("tools") and _TOOLS_REJECTION.search(body):
+        _NATIVE_TOOLS_UNSUPPORTED[payload["model"]] = time.monotonic() + NATIVE_TOOLS_RECHECK_SECONDS
+        print(f"Native tool calling rejected for model {payload['model']!r}: {body[:200]}")
+        raise NativeToolsUnsupported(body)
+
+
+def _merge_tool_call_deltas(tool_calls: List[Dict[str, Any]], deltas: List[Dict[str, Any]]) -> None:
+    """Accumulate streamed `tool_calls` fragments into complete calls, keyed by index."""
+    for tc in deltas:
+        idx = tc.get("index", len(tool_calls))
+        while len(tool_calls) <= idx:
+            tool_calls.append({"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+        call = tool_calls[idx]
+        if tc.get("id"):
+            call["id"] = tc["id"]
+        fn = tc.get("function") or {}
+        if fn.get("name"):
+            call["function"]["name"] += fn["name"]
+        if fn.get("arguments"):
+            call["function"]["arguments"] += fn["arguments"]
+
+
+def _collect_stats(stats: Dict[str, Any], obj: Dict[str, Any]) -> None:
+    for key in ("timings", "usage"):
+        if obj.get(key):
+            stats[key] = obj[key]
+
+
+# ===== Backend routing =====
+
+class Backend:
+    __slots__ = ("url", "outstanding", "healthy", "idle_slots", "total_slots")
+
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.healthy = True
+        self.idle_slots: Optional[int] = None  # from the last /slots poll
+        self.total_slots: Optional[int] = None
+
+    def full(self) -> bool:
+        if self.idle_slots == 0:
+            return True
+        return self.total_slots is not None and self.outstanding >= self.total_slots
+
+    def acquire(self) -> None:
+        self.outstanding += 1
+        LLM_BACKEND_OUTSTANDING.set(self.outstanding, backend=self.url)
+
+    def release(self) -> None:
+        self.outstanding -= 1
+        LLM_BACKEND_OUTSTANDING.set(self.outstanding, backend=self.url)
+
+
+class Router:
+    """Spread requests over llama-server backends.
+
+    Picks the healthy backend with the fewest outstanding requests (then the
+    most idle slots), but keeps an agent on the backend it used last while that
+    one has room, so its KV cache is reused. A request that fails before any
+    output is retried on another backend and the failed one is marked down until
+    the next health poll brings it back.
+    """
+
+    AFFINITY_LIMIT = 10000
+
+    def __init__(self, urls: Iterable[str], health_interval: float = LLAMACPP_HEALTH_INTERVAL,
+                 transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.backends = [Backend(url.rstrip("/")) for url in urls]
+        self.health_interval = health_interval
+        self._transport = transport
+        self._affinity: "OrderedDict[str, Backend]" = OrderedDict()
+        # One pooled client (and one health poller) per event loop
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._pollers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            kwargs: Dict[str, Any] = {"timeout": None}
+            if self._transport is not None:
+                kwargs["transport"] = self._transport
+            client = self._clients[loop] = httpx.AsyncClient(**kwargs)
+        return client
+
+    def pick(self, affinity: Optional[str] = None, exclude: Iterable[Backend] = ()) -> Backend:
+        excluded = set(map(id, exclude))
+        candidates = [b for b in self.backends if id(b) not in excluded] or self.backends
+        healthy = [b for b in candidates if b.healthy] or candidates
+        pinned = self._affinity.get(affinity) if affinity is not None else None
+        if pinned is not None and pinned in healthy and (
+            not pinned.full() or all(b.full() for b in healthy)
+        ):
+            chosen = pinned
+        else:
+            chosen = min(healthy, key=lambda b: (b.outstanding, -(b.idle_slots or 0)))
+        if affinity is not None:
+            self._affinity[affinity] = chosen
+            self._affinity.move_to_end(affinity)
+            if len(self._affinity) > self.AFFINITY_LIMIT:
+                self._affinity.popitem(last=False)
+        return chosen
+
+    def has_alternative(self, tried: List[Backend]) -> bool:
+        return any(b not in tried for b in self.backends)
+
+    def mark_down(self, backend: Backend, reason: str) -> None:
+        backend.healthy = False
+        LLM_BACKEND_UP.set(0, backend=backend.url)
+        LLM_FAILOVERS.inc(backend=backend.url)
+        print(f"llama-server backend {backend.url} failed ({reason}); failing over")
+
+    async def _check(self, backend: Backend) -> None:
+        client = self.client()
+        try:
+            r = await client.get(f"{backend.url}/slots", timeout=2.0)
+            if r.status_code == 200 and isinstance(r.json(), list):
+                slots = r.json()
+                backend.total_slots = len(slots)
+                backend.idle_slots = sum(1 for s in slots if not s.get("is_processing"))
+                backend.healthy = True
+            else:
+                # /slots disabled (--no-slots): fall back to plain liveness
+                r = await client.get(f"{backend.url}/health", timeout=2.0)
+                backend.healthy = r.status_code == 200
+                backend.idle_slots = backend.total_slots = None
+        except Exception:
+            backend.healthy = False
+        LLM_BACKEND_UP.set(1 if backend.healthy else 0, backend=backend.url)
+
+    async def poll(self) -> None:
+        await asyncio.gather(*(self._check(b) for b in self.backends))
+
+    async def _poll_forever(self) -> None:
+        while True:
+            await self.poll()
+            await asyncio.sleep(self.health_interval)
+
+    def ensure_polling(self) -> None:
+        """Start the health poller on this loop; a single backend needs none."""
+        if len(self.backends) < 2:
+            return
+        loop = asyncio.get_running_loop()
+        task = self._pollers.get(loop)
+        if task is None or task.done():
+            self._pollers[loop] = loop.create_task(self._poll_forever())
+
+    def prepare(self, payload: Dict[str, Any]) -> None:
+        # Scheduler slot ids index a single server's slots; meaningless across several
+        if len(self.backends) > 1:
+            payload.pop("id_slot", None)
+
+
+ROUTER = Router(LLAMACPP_BASE_URLS)
+
 
 async def stream_chat(
     messages,
@@ -10,11 +210,20 @@ async def stream_chat(
     max_tokens=1024,
     cache_prompt: bool = True,
     cache_key: Optional[str] = None,
+    tool_calls: Optional[List[Dict[str, Any]]] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    affinity: Optional[str] = None,
     **kwargs
 ) -> AsyncGenerator[str, None]:
-    url = f"{LLAMACPP_BASE_URL}/v1/chat/completions"
+    """Stream content tokens.
+
+    Structured tool calls are collected into `tool_calls`, and llama.cpp's final
+    `timings`/`usage` into `stats`, when those are given. Deterministic requests
+    may be answered from the completion cache, replaying the recorded chunks.
+    `affinity` (an agent id) keeps related requests on the same backend.
+    """
     payload = {
-        "model": "local-llama",
+        "model": LLAMACPP_MODEL,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
@@ -25,23 +234,110 @@ async def stream_chat(
         # if your server build supports a cache/session key, pass it through
         payload["id"] = cache_key  # harmless if ignored
     payload.update(kwargs)
-    async with httpx.AsyncClient(timeout=None) as client:
-        async with client.stream("POST", url, json=payload) as r:
-            async for line in r.aiter_lines():
-                if not line:
-                    continue
-                if line.startswith("data: "):
-                    data = line[len("data: "):].strip()
-                    if data == "[DONE]":
-                        break
-                    try:
-                        obj = httpx.Response(200, content=data).json()
-                    except Exception:
+    memo_key = completion_cache.key_for(payload) if completion_cache.cacheable(payload) else None
+    if memo_key is not None:
+        entry = completion_cache.get(memo_key)
+        if entry is not None:
+            if tool_calls is not None:
+                tool_calls.extend(entry["tool_calls"])
+            if stats is not None:
+                stats.update(entry["stats"])
+            for chunk in entry["chunks"]:
+                yield chunk
+            return
+    ROUTER.prepare(payload)
+    ROUTER.ensure_polling()
+    client = ROUTER.client()
+    chunks: List[str] = []
+    collected: Dict[str, Any] = {}
+    streamed_calls: List[Dict[str, Any]] = tool_calls if tool_calls is not None else []
+    tried: List[Backend] = []
+    received = False  # once any data arrived the request is not retried elsewhere
+    start = time.perf_counter()
+    first_token_at = None
+    n_tokens = 0
+    LLM_REQUESTS_IN_FLIGHT.inc()
+    try:
+        while True:
+            backend = ROUTER.pick(affinity, exclude=tried)
+            tried.append(backend)
+            backend.acquire()
+            try:
+                async with client.stream("POST", f"{backend.url}/v1/chat/completions", json=payload) as r:
+                    if r.status_code >= 500 and ROUTER.has_alternative(tried):
+                        ROUTER.mark_down(backend, f"HTTP {r.status_code}")
                         continue
-                    delta = obj.get("choices", [{}])[0].get("delta", {})
-                    tok = delta.get("content")
-                    if tok:
-                        yield tok
+                    if r.status_code >= 400:
+                        body = (await r.aread()).decode("utf-8", "replace")
+                        _check_tools_rejected(r.status_code, body, payload)
+                        r.raise_for_status()
+                    async for line in r.aiter_lines():
+                        if not line:
+                            continue
+                        if line.startswith("data: "):
+                            data = line[len("data: "):].strip()
+                            if data == "[DONE]":
+                                break
+                            try:
+                                obj = httpx.Response(200, content=data).json()
+                            except Exception:
+                                continue
+                            received = True
+                            _collect_stats(collected, obj)
+                            delta = (obj.get("choices") or [{}])[0].get("delta", {})
+                            if delta.get("tool_calls"):
+                                _merge_tool_call_deltas(streamed_calls, delta["tool_calls"])
+                            tok = delta.get("content")
+                            if tok:
+                                n_tokens += 1
+                                if memo_key is not None:
+                                    chunks.append(tok)
+                                if first_token_at is None:
+                                    first_token_at = time.perf_counter()
+                                    LLM_TTFT_SECONDS.observe(first_token_at - start)
+                                yield tok
+                break
+            except httpx.TransportError as exc:
+                if received or not ROUTER.has_alternative(tried):
+                    raise
+                ROUTER.mark_down(backend, str(exc) or type(exc).__name__)
+            finally:
+                backend.release()
+        if stats is not None:
+            stats.update(collected)
+        # Only a stream that ran to the end is worth replaying
+        if memo_key is not None:
+            completion_cache.put(memo_key, chunks, streamed_calls, collected)
+    finally:
+        LLM_REQUESTS_IN_FLIGHT.dec()
+        if first_token_at is not None and n_tokens > 1:
+            decode_time = time.perf_counter() - first_token_at
+            if decode_time > 0:
+                LLM_DECODE_TOKENS_PER_SECOND.observe((n_tokens - 1) / decode_time)
+
+async def _post_with_failover(path: str, payload: Dict[str, Any], affinity: Optional[str] = None,
+                              timeout: Optional[float] = None) -> httpx.Response:
+    """POST to a backend; connection errors and 5xx move on to the next one."""
+    ROUTER.ensure_polling()
+    client = ROUTER.client()
+    tried: List[Backend] = []
+    while True:
+        backend = ROUTER.pick(affinity, exclude=tried)
+        tried.append(backend)
+        backend.acquire()
+        try:
+            r = await client.post(f"{backend.url}{path}", json=payload, timeout=timeout)
+        except httpx.TransportError as exc:
+            if not ROUTER.has_alternative(tried):
+                raise
+            ROUTER.mark_down(backend, str(exc) or type(exc).__name__)
+            continue
+        finally:
+            backend.release()
+        if r.status_code >= 500 and ROUTER.has_alternative(tried):
+            ROUTER.mark_down(backend, f"HTTP {r.status_code}")
+            continue
+        return r
 
 async def nonstream_chat(
     messages,
@@ -49,11 +345,12 @@ async def nonstream_chat(
     max_tokens=1024,
     cache_prompt: bool = True,
     cache_key: Optional[str] = None,
+    stats: Optional[Dict[str, Any]] = None,
+    affinity: Optional[str] = None,
     **kwargs
 ) -> Dict[str, Any]:
-    url = f"{LLAMACPP_BASE_URL}/v1/chat/completions"
     payload = {
-        "model": "local-llama",
+        "model": LLAMACPP_MODEL,
         "messages": messages,
         "temperature": temperature,
         "max_tokens": max_tokens,
@@ -63,11 +360,36 @@ async def nonstream_chat(
     if cache_key is not None:
         payload["id"] = cache_key
     payload.update(kwargs)
-    async with httpx.AsyncClient(timeout=None) as client:
-        r = await client.post(url, json=payload)
-        r.raise_for_status()
-        data = r.json()
-        return {
-            "text": data["choices"][0]["message"]["content"],
-            "raw": data
-        }
+    memo_key = completion_cache.key_for(payload) if completion_cache.cacheable(payload) else None
+    if memo_key is not None:
+        entry = completion_cache.get(memo_key)
+        if entry is not None:
+            if stats is not None:
+                stats.update(entry["stats"])
+            return completion_cache.as_response(entry)
+    ROUTER.prepare(payload)
+    LLM_REQUESTS_IN_FLIGHT.inc()
+    try:
+        r = await _post_with_failover("/v1/chat/completions", payload, affinity)
+    finally:
+        LLM_REQUESTS_IN_FLIGHT.dec()
+    _check_tools_rejected(r.status_code, r.text, payload)
+    r.raise_for_status()
+    data = r.json()
+    collected: Dict[str, Any] = {}
+    _collect_stats(collected, data)
+    if stats is not None:
+        stats.update(collected)
+    message = data["choices"][0]["message"]
+    if memo_key is not None:
+        completion_cache.put(memo_key, [message.get("content") or ""], message.get("tool_calls") or [], collected)
+    return {
+        "text": message.get("content") or "",
+        "tool_calls": message.get("tool_calls") or [],
+        "raw": data
+    }
+
+async def tokenize(text: str) -> List[int]:
+    r = await _post_with_failover("/tokenize", {"content": text}, timeout=30.0)
+    r.raise_for_status()
+    return r.json()["tokens"]
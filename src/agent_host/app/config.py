@@ -2,7 +2,133 @@ import os
 from dotenv import load_dotenv
 load_dotenv()
 
+def _env_flag(name: str, default: str = "0") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
 LLAMACPP_BASE_URL = os.getenv("LLAMACPP_BASE_URL", "http://127.0.0.1:50000")
 CHROMA_PERSIST_ROOT = os.getenv("CHROMA_PERSIST_ROOT", "./data/agents")
 HOST = os.getenv("HOST", "0.0.0.0")
 PORT = int(os.getenv("PORT", "50001"))
+
+# Several llama-server instances (comma-separated) to balance requests across;
+# defaults to LLAMACPP_BASE_URL alone. With more than one, their /slots (or
+# /health) are polled every LLAMACPP_HEALTH_INTERVAL seconds
+LLAMACPP_BASE_URLS = [
+    u.strip().rstrip("/") for u in os.getenv("LLAMACPP_BASE_URLS", LLAMACPP_BASE_URL).split(",")
+    if u.strip()
+]
+LLAMACPP_HEALTH_INTERVAL = float(os.getenv("LLAMACPP_HEALTH_INTERVAL", "2.0"))
+
+# Vector store layout: "per_agent" (a Chroma DB in each agent directory),
+# "collection" (one DB under CHROMA_PERSIST_ROOT/_chroma, a collection per agent)
+# or "shared" (one collection, partitioned by an agent_id metadata field).
+# Move existing data with `python -m agent_host.app.memory.migrate`
+CHROMA_LAYOUT = os.getenv("CHROMA_LAYOUT", "per_agent")
+
+# "numpy": new agents keep memories in a memory-mapped float16/int8 array
+# (<agent>/memory_np) until they pass VECTOR_PROMOTE_AT, then move to Chroma
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+NUMPY_STORE_DTYPE = os.getenv("NUMPY_STORE_DTYPE", "float16")
+VECTOR_PROMOTE_AT = int(os.getenv("VECTOR_PROMOTE_AT", "5000"))
+
+# Embedding requests from all sessions are batched: a batch closes after
+# EMBED_BATCH_WAIT_MS or EMBED_BATCH_MAX texts. EMBED_PROCESSES > 0 runs the
+# model in that many worker processes
+EMBED_BATCH_MAX = int(os.getenv("EMBED_BATCH_MAX", "64"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("EMBED_BATCH_WAIT_MS", "5"))
+EMBED_PROCESSES = int(os.getenv("EMBED_PROCESSES", "0"))
+
+# "chroma": Chroma's bundled ONNX model, loaded in this process.
+# "remote": POST to EMBEDDING_BASE_URL/v1/embeddings (e.g. llama-server --embeddings);
+# vectors are cached per text (EMBEDDING_CACHE_SIZE). Stores remember their
+# embedder; after changing it run `python -m agent_host.app.memory.migrate --reembed`
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "chroma")
+EMBEDDING_BASE_URL = os.getenv("EMBEDDING_BASE_URL", LLAMACPP_BASE_URL)
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "local-embed")
+EMBEDDING_REMOTE_BATCH = int(os.getenv("EMBEDDING_REMOTE_BATCH", "64"))
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "4096"))
+
+# Seconds a cached agent listing is trusted before profiles are re-validated on disk
+PROFILE_CACHE_TTL = float(os.getenv("PROFILE_CACHE_TTL", "2.0"))
+
+# Model name sent to llama-server; also keys per-model capability fallbacks
+LLAMACPP_MODEL = os.getenv("LLAMACPP_MODEL", "local-llama")
+
+# Recent chat history kept in memory per agent (records), for up to
+# HISTORY_CACHE_AGENTS agents; a stat of the file detects outside edits
+HISTORY_CACHE_WINDOW = int(os.getenv("HISTORY_CACHE_WINDOW", "200"))
+HISTORY_CACHE_AGENTS = int(os.getenv("HISTORY_CACHE_AGENTS", "64"))
+
+# Full-text search indexes over chat history kept in memory (agents, LRU)
+HISTORY_INDEX_AGENTS = int(os.getenv("HISTORY_INDEX_AGENTS", "8"))
+
+# Parallel slots llama-server was started with (-np); bounds batch concurrency
+LLAMACPP_SLOTS = int(os.getenv("LLAMACPP_SLOTS", "4"))
+
+# "text": TOOL_CALL lines described in the system prompt
+# "native": OpenAI-style `tools` / `tool_calls` (llama-server started with --jinja)
+TOOL_CALL_MODE = os.getenv("TOOL_CALL_MODE", "text")
+
+# Once the model emits "TOOL_CALL:", finish the call under a JSON schema built
+# from the registry so llama.cpp can only produce a well-formed call
+CONSTRAIN_TOOL_CALLS = _env_flag("CONSTRAIN_TOOL_CALLS")
+
+# Speculatively run likely tool calls (web search; memory.retrieve once a memory
+# tool is registered) for the user's text while the first generation streams;
+# matching TOOL_CALLs reuse the result
+SPECULATIVE_PREFETCH = _env_flag("SPECULATIVE_PREFETCH")
+SPECULATIVE_TOOLS = [
+    t.strip() for t in os.getenv("SPECULATIVE_TOOLS", "duckduckgo.search").split(",")
+    if t.strip()
+]
+
+# Startup warmup: /healthz answers 503 until it finishes or WARMUP_TIMEOUT passes.
+# It imports WARMUP_IMPORTS, opens the vector stores of the WARMUP_AGENTS most
+# recently active agents, runs one embedding and prefills those agents' prompts
+# into llama-server's KV cache (at most one agent per slot). By default only
+# what this process will load anyway is imported: chromadb for the Chroma
+# store or embedder, the ONNX runtime only when the model runs in-process
+WARMUP = _env_flag("WARMUP", "1")
+WARMUP_AGENTS = int(os.getenv("WARMUP_AGENTS", "8"))
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "120"))
+_LOCAL_EMBEDDER = EMBEDDING_BACKEND == "chroma" and EMBED_PROCESSES == 0
+_WARMUP_IMPORTS_DEFAULT = ",".join(
+    (["chromadb"] if VECTOR_BACKEND == "chroma" or EMBEDDING_BACKEND == "chroma" else [])
+    + (["onnxruntime", "tokenizers"] if _LOCAL_EMBEDDER else [])
+)
+WARMUP_IMPORTS = [
+    m.strip() for m in os.getenv("WARMUP_IMPORTS", _WARMUP_IMPORTS_DEFAULT).split(",") if m.strip()
+]
+
+# Per-turn traces: rolling JSONL log (empty disables) and OTLP/HTTP export
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", "")
+TRACE_LOG_MAX_BYTES = int(os.getenv("TRACE_LOG_MAX_BYTES", str(10 * 1024 * 1024)))
+OTEL_EXPORTER_OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "agent-host")
+
+# Stack profiles in collapsed ("folded") format for flamegraph.pl / speedscope.
+# Turns running longer than SLOW_TURN_SECONDS are sampled automatically (0 disables)
+STACK_PROFILE_DIR = os.getenv("STACK_PROFILE_DIR", "./data/stack_profiles")
+STACK_SAMPLE_INTERVAL = float(os.getenv("STACK_SAMPLE_INTERVAL", "0.005"))
+SLOW_TURN_SECONDS = float(os.getenv("SLOW_TURN_SECONDS", "10"))
+
+# WebSocket transport: token frames are flushed at most once per this many ms,
+# so tokens that arrive faster than that are sent together
+WS_COALESCE_MS = float(os.getenv("WS_COALESCE_MS", "15"))
+# Frames queued per connection before its sessions wait for the client
+WS_BUFFER_EVENTS = int(os.getenv("WS_BUFFER_EVENTS", "256"))
+
+# SSE: after the first chunk, tokens are flushed every SSE_FLUSH_MS or once
+# SSE_FLUSH_BYTES are pending. At most SSE_BUFFER_EVENTS wait for a slow client,
+# then SSE_SLOW_CONSUMER applies: "coalesce" (merge, then pause generation),
+# "drop" (send the rest of the text with the final event) or "abort"
+SSE_FLUSH_MS = float(os.getenv("SSE_FLUSH_MS", "20"))
+SSE_FLUSH_BYTES = int(os.getenv("SSE_FLUSH_BYTES", "256"))
+SSE_BUFFER_EVENTS = int(os.getenv("SSE_BUFFER_EVENTS", "256"))
+SSE_SLOW_CONSUMER = os.getenv("SSE_SLOW_CONSUMER", "coalesce")
+
+# Completion cache for deterministic requests (temperature 0 or a fixed seed):
+# in-memory LRU entries, plus one file per entry under COMPLETION_CACHE_DIR if set
+COMPLETION_CACHE = _env_flag("COMPLETION_CACHE")
+COMPLETION_CACHE_SIZE = int(os.getenv("COMPLETION_CACHE_SIZE", "256"))
+COMPLETION_CACHE_DIR = os.getenv("COMPLETION_CACHE_DIR", "")
@@ -1,15 +1,38 @@
-from fastapi import FastAPI, HTTPException, Response, status
+from fastapi import FastAPI, Header, HTTPException, Query, Response, WebSocket, WebSocketDisconnect, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
-from typing import AsyncGenerator
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, Dict, List, Optional
+import asyncio
+import hashlib
 import json
+import time
 
-from agent_host.app.config import HOST, PORT, CHROMA_PERSIST_ROOT
+from pydantic import ValidationError
+
+from agent_host.app.config import (
+    HOST,
+    PORT,
+    CHROMA_PERSIST_ROOT,
+    LLAMACPP_BASE_URLS,
+    SSE_BUFFER_EVENTS,
+    SSE_FLUSH_BYTES,
+    SSE_FLUSH_MS,
+    SSE_SLOW_CONSUMER,
+    WS_BUFFER_EVENTS,
+    WS_COALESCE_MS,
+)
+from agent_host.app import metrics, profiling, warmup
+from agent_host.app.streaming import EventBuffer, coalesce_events, drain, encode_binary_frame, pump
 from agent_host.app.agents import profiles
 from agent_host.app.orchestrator.session import run_turn
+from agent_host.app.orchestrator.scheduler import run_batch
 from agent_host.app.models import (
     AgentProfile,
     AgentProfileCreate,
     AgentProfilePatch,
+    BatchChatRequest,
     ChatMessage,
     ChatMessagePatch,
     ChatRequest,
@@ -25,11 +48,50 @@ app = FastAPI(title="Local LLM Host")
 @app.on_event("startup")
 async def startup():
     print("Starting up...")
+    if warmup.STATE.enabled:
+        # Runs in the background; /healthz reports 503 until it is done
+        app.state.warmup_task = asyncio.create_task(warmup.run(CHROMA_PERSIST_ROOT))
 
 @app.get("/healthz")
 async def healthz():
+    if not warmup.STATE.ready:
+        return JSONResponse({"ok": False, "warmup": warmup.STATE.status()},
+                            status_code=status.HTTP_503_SERVICE_UNAVAILABLE)
+    if warmup.STATE.enabled:
+        return {"ok": True, "warmup": warmup.STATE.status()}
     return {"ok": True}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """Prometheus scrape target: our turn pipeline plus llama-server's own metrics."""
+    scraped = await metrics.scrape_all_llamacpp(LLAMACPP_BASE_URLS)
+    body = metrics.render() + scraped + "\n"
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+# ------- Admin: stack profiles (collapsed format, feed to flamegraph.pl or speedscope) --------
+
+@app.post("/admin/profile", response_class=PlainTextResponse)
+async def capture_profile(seconds: float = 5.0):
+    """Sample every thread for `seconds` (max 60) and return the collapsed stacks."""
+    if not 0 < seconds <= 60:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="seconds must be in (0, 60]")
+    with profiling.StackSampler() as sampler:
+        await asyncio.sleep(seconds)
+    text = sampler.collapsed()
+    profiling.save_collapsed(text, f"process-{int(time.time())}")
+    return PlainTextResponse(text)
+
+@app.get("/admin/profiles")
+async def list_stack_profiles():
+    return {"profiles": profiling.list_saved()}
+
+@app.get("/admin/profiles/{name}", response_class=PlainTextResponse)
+async def get_stack_profile(name: str):
+    try:
+        return PlainTextResponse(profiling.read_saved(name))
+    except FileNotFoundError as exc:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=name) from exc
+
 @app.get("/tools")
 async def get_tools():
     # Helpful for inspecting what the LLM sees
@@ -44,52 +106,248 @@ async def chat(req: ChatRequest):
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(exc)) from exc
 
     async def event_gen() -> AsyncGenerator[dict, None]:
-        async for ev in run_turn(
+        turn = run_turn(
             prof.model_dump(),
             req.user,
             allow_tools=req.tool_calls_allowed,
-            stream=req.stream
-        ):
-            if ev["type"] == "token":
-                # one token (or line chunk) at a time
-                yield {"event": "chunk", "data": ev["data"]}
-            elif ev["type"] == "tool":
-                yield {"event": "chunk", "data": json.dumps(ev["data"])}
-            elif ev["type"] == "done":
-                yield {"event": "done", "data": json.dumps(ev["data"])}
-    return EventSourceResponse(event_gen())
+            stream=req.stream,
+            profile_stacks=req.profile,
+            temperature=req.temperature,
+            seed=req.seed,
+        )
+        # The turn runs ahead into a bounded buffer; this side sends coalesced
+        # chunks as fast as the client reads them
+        buffer = EventBuffer(SSE_BUFFER_EVENTS, SSE_SLOW_CONSUMER)
+        producer = asyncio.create_task(pump(turn, buffer))
+        running.append(producer)
+        try:
+            async for batch in buffer.batches(SSE_FLUSH_MS / 1000, SSE_FLUSH_BYTES):
+                for ev in batch:
+                    if ev["type"] == "token":
+                        yield {"event": "chunk", "data": ev["data"]}
+                    elif ev["type"] == "tool":
+                        yield {"event": "chunk", "data": json.dumps(ev["data"])}
+                    elif ev["type"] == "done":
+                        yield {"event": "done", "data": json.dumps(ev["data"])}
+                    elif ev["type"] == "error":
+                        yield {"event": "error", "data": ev["data"]}
+            await producer
+        finally:
+            producer.cancel()
+
+    async def on_disconnect(message) -> None:
+        # Cancelling the producer closes the turn: the llama-server stream is
+        # dropped (freeing its slot) and the partial reply is saved as truncated
+        for task in running:
+            task.cancel()
+
+    running: List[asyncio.Task] = []
+    return EventSourceResponse(event_gen(), client_close_handler_callable=on_disconnect)
+
+@app.post("/chat/batch")
+async def chat_batch(batch: BatchChatRequest):
+    """Run many turns with concurrency bounded by llama-server's slots.
+
+    Streams one NDJSON line per request, in completion order; `index` refers to
+    the position in `requests`.
+    """
+    items = []
+    missing = []
+    for index, req in enumerate(batch.requests):
+        try:
+            items.append((index, profiles.read_profile(CHROMA_PERSIST_ROOT, req.agent_id).model_dump(), req))
+        except FileNotFoundError as exc:
+            missing.append({"index": index, "agent_id": req.agent_id, "ok": False, "error": str(exc)})
+
+    async def ndjson_gen() -> AsyncGenerator[str, None]:
+        for result in missing:
+            yield json.dumps(result) + "\n"
+        async for result in run_batch(items, batch.max_concurrency):
+            yield json.dumps(result) + "\n"
+    return StreamingResponse(ndjson_gen(), media_type="application/x-ndjson")
+
+@app.websocket("/ws")
+async def chat_ws(ws: WebSocket, encoding: str = "json"):
+    """Many agent sessions multiplexed over one connection.
+
+    Client frames are JSON text: {"op": "chat", "id": ..., <ChatRequest fields>}
+    starts a turn, {"op": "cancel", "id": ...} cancels it. Server frames carry the
+    session `id` and a `type` of token/tool/done/error/cancelled; connect with
+    `?encoding=binary` for the binary layout in streaming.py.
+
+    At most WS_BUFFER_EVENTS frames wait for a slow client; sessions then pause
+    until the writer catches up, and the writer merges the tokens that queued.
+    """
+    await ws.accept()
+    binary = encoding == "binary"
+    outgoing: asyncio.Queue = asyncio.Queue(maxsize=WS_BUFFER_EVENTS)
+    sessions: Dict[str, asyncio.Task] = {}
+
+    async def run_session(sid: str, req: ChatRequest) -> None:
+        try:
+            prof = profiles.read_profile(CHROMA_PERSIST_ROOT, req.agent_id)
+            turn = run_turn(prof.model_dump(), req.user, allow_tools=req.tool_calls_allowed,
+                            stream=req.stream, profile_stacks=req.profile,
+                            temperature=req.temperature, seed=req.seed)
+            async with aclosing(turn):
+                async for ev in turn:
+                    await outgoing.put({"id": sid, **ev})
+        except asyncio.CancelledError:
+            try:
+                outgoing.put_nowait({"id": sid, "type": "cancelled"})
+            except asyncio.QueueFull:
+                pass  # the client is not reading anyway
+            raise
+        except Exception as exc:
+            await outgoing.put({"id": sid, "type": "error", "error": str(exc)})
+
+    def forget(sid: str, task: asyncio.Task) -> None:
+        if sessions.get(sid) is task:
+            del sessions[sid]
+
+    async def writer() -> None:
+        loop = asyncio.get_running_loop()
+        window = WS_COALESCE_MS / 1000
+        last_flush = 0.0
+        while True:
+            first = await outgoing.get()
+            # Keep at least `window` between flushes; whatever queues up meanwhile
+            # goes out together
+            wait = last_flush + window - loop.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            for ev in coalesce_events([first] + drain(outgoing)):
+                if binary:
+                    await ws.send_bytes(encode_binary_frame(ev))
+                else:
+                    await ws.send_text(json.dumps(ev, ensure_ascii=False))
+            last_flush = loop.time()
+
+    writer_task = asyncio.create_task(writer())
+    try:
+        while True:
+            try:
+                msg = json.loads(await ws.receive_text())
+            except ValueError:
+                await outgoing.put({"id": "", "type": "error", "error": "frames must be JSON text"})
+                continue
+            op, sid = msg.get("op"), str(msg.get("id", ""))
+            if op == "chat":
+                if sid in sessions:
+                    await outgoing.put({"id": sid, "type": "error", "error": "session id already running"})
+                    continue
+                try:
+                    req = ChatRequest(**{k: v for k, v in msg.items() if k not in ("op", "id")})
+                except ValidationError as exc:
+                    await outgoing.put({"id": sid, "type": "error", "error": str(exc)})
+                    continue
+                task = sessions[sid] = asyncio.create_task(run_session(sid, req))
+                # A callback, not run_session's finally: a task cancelled before
+                # it first runs never executes its body
+                task.add_done_callback(lambda t, sid=sid: forget(sid, t))
+            elif op == "cancel":
+                task = sessions.get(sid)
+                if task is not None:
+                    task.cancel()
+            else:
+                await outgoing.put({"id": sid, "type": "error", "error": f"unknown op {op!r}"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        pending = list(sessions.values())
+        for task in pending:
+            task.cancel()
+        writer_task.cancel()
+        await asyncio.gather(writer_task, *pending, return_exceptions=True)
 
 # ------- Optional: REST wrappers around memory tools --------
 # These are convenience endpoints for non-LLM callers (scripts, admin panels).
 # The LLM itself calls memory via the TOOL_CALL convention, not these routes.
+# Plain `def`: FastAPI runs them in its threadpool, so concurrent requests
+# reach the embedding batcher together instead of one at a time.
 
 @app.post("/tools/memory/insert")
-async def t_mem_insert(agent_id: str, items: list[MemoryItem]):
+def t_mem_insert(agent_id: str, items: list[MemoryItem]):
     ids = chroma_store.upsert_memories(agent_id, CHROMA_PERSIST_ROOT, [i.model_dump() for i in items])
     return {"ok": True, "ids": ids}
 
 @app.post("/tools/memory/retrieve")
-async def t_mem_retrieve(q: RetrieveQuery):
+def t_mem_retrieve(q: RetrieveQuery):
     res = chroma_store.query_memories(q.agent_id, CHROMA_PERSIST_ROOT, q.query, q.k)
     return {"ok": True, "results": res}
 
 @app.post("/tools/memory/update")
-async def t_mem_update(agent_id: str, memory_id: str, patch: dict):
+def t_mem_update(agent_id: str, memory_id: str, patch: dict):
     ok = chroma_store.update_memory(agent_id, CHROMA_PERSIST_ROOT, memory_id, patch)
     return {"ok": ok}
 
 @app.post("/tools/memory/delete")
-async def t_mem_delete(agent_id: str, memory_id: str):
+def t_mem_delete(agent_id: str, memory_id: str):
     chroma_store.delete_memory(agent_id, CHROMA_PERSIST_ROOT, memory_id)
     return {"ok": True}
 
 @app.get("/agents/{agent_id}/history")
-async def get_history(agent_id: str):
-    records = history_store.load_all_turns(CHROMA_PERSIST_ROOT, agent_id)
-    return {
-        "ok": True,
-        "history": [ChatMessage(**rec).model_dump() for rec in records],
-    }
+async def get_history(
+    agent_id: str,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    since: Optional[int] = Query(None, ge=0),
+    format: str = "json",
+    if_none_match: Optional[str] = Header(None),
+):
+    """History, optionally paginated by message_id cursors or limited to changes.
+
+    `before`/`after`/`limit` page through the records; `since=<seq>` returns only
+    records changed after that sequence number plus the ids deleted since. Each
+    response carries `seq` to pass as the next `since`, and an ETag so an
+    unchanged poll costs a 304. `format=ndjson` streams one record per line and
+    ends with a line holding the cursor fields.
+    """
+    query = json.dumps([before, after, limit, since, format])
+    state = history_store.state_token(CHROMA_PERSIST_ROOT, agent_id)
+    etag = 'W/"' + hashlib.sha1(f"{state}|{query}".encode()).hexdigest()[:20] + '"'
+    if if_none_match is not None and etag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+    seq = history_store.current_seq(CHROMA_PERSIST_ROOT, agent_id)
+    cursor: Dict[str, Any] = {"seq": seq}
+    if since is not None:
+        records, deleted = history_store.changes_since(CHROMA_PERSIST_ROOT, agent_id, since)
+        cursor["deleted"] = deleted
+    else:
+        try:
+            records, has_more = history_store.load_page(
+                CHROMA_PERSIST_ROOT, agent_id, before=before, after=after, limit=limit
+            )
+        except KeyError as exc:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND,
+                                detail=f"message_id not found: {exc.args[0]}") from exc
+        cursor["has_more"] = has_more
+    history = jsonable_encoder([ChatMessage(**rec).model_dump() for rec in records])
+
+    if format == "ndjson":
+        async def ndjson_gen() -> AsyncGenerator[str, None]:
+            for message in history:
+                yield json.dumps(message) + "\n"
+            yield json.dumps({"end": True, **cursor}) + "\n"
+        return StreamingResponse(ndjson_gen(), media_type="application/x-ndjson", headers={"ETag": etag})
+    return JSONResponse({"ok": True, "history": history, **cursor}, headers={"ETag": etag})
+
+@app.get("/agents/{agent_id}/history/search")
+async def search_history(
+    agent_id: str,
+    q: str,
+    k: int = Query(10, ge=1, le=100),
+    role: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None,
+):
+    """Ranked full-text search; `since`/`until` are ISO dates or timestamps (until exclusive)."""
+    # The first search of an agent builds its index; keep that off the event loop
+    results = await asyncio.to_thread(history_store.search, CHROMA_PERSIST_ROOT, agent_id, q,
+                                      k=k, role=role, since=since, until=until)
+    return {"ok": True, "results": results}
 
 @app.put("/agents/{agent_id}/history/{message_id}")
 async def update_history(agent_id: str, message_id: str, patch: ChatMessagePatch):
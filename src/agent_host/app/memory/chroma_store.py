@@ -1,8 +1,15 @@
 # src/agent_host/app/memory/chroma_store.py
-import os, uuid
-import chromadb
-from chromadb.config import Settings
-from typing import List, Dict, Any, Optional
+import os, uuid, hashlib, shutil, threading
+from typing import TYPE_CHECKING, List, Dict, Any, Optional, Set, Tuple
+
+from .. import config
+from ..clients.embeddings import RemoteEmbeddingFunction
+from . import numpy_store
+from .embedding import EmbeddingBatcher, check_embedder
+
+# chromadb takes most of a second to import; it is loaded on the first memory operation
+if TYPE_CHECKING:
+    from chromadb.api.models.Collection import Collection
 
 ALLOWED_META_KEYS = {"type", "date", "time", "tag", "memory_id", "salience", "created_at", "last_seen_at"}
 
@@ -29,14 +36,293 @@ def _normalize_where(where: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]
     # Multiple fields: wrap into $and
     return {"$and": [{k: v} for k, v in where.items()]}
 
-def get_collection_for_agent(agent_id: str, persist_root: str) -> chromadb.api.models.Collection.Collection:
-    path = os.path.join(persist_root, agent_id, "memory")
-    os.makedirs(path, exist_ok=True)
-    client = chromadb.PersistentClient(path, settings=Settings(anonymized_telemetry=False))
-    return client.get_or_create_collection(
-        name="memories",
-        metadata={"hnsw:space":"cosine"},
-    )
+# ===== Storage layouts (config.CHROMA_LAYOUT) =====
+# per_agent:  <root>/<agent_id>/memory, one PersistentClient and DB per agent
+# collection: <root>/_chroma, one client, one collection per agent
+# shared:     <root>/_chroma, one client, one "memories" collection; each record
+#             carries an agent_id metadata field that every read filters on and
+#             its id is prefixed with the agent id
+LAYOUTS = ("per_agent", "collection", "shared")
+SHARED_DIR = "_chroma"
+
+_clients: Dict[str, Any] = {}
+_collections: Dict[Tuple[str, str], Any] = {}
+_lock = threading.Lock()
+
+_remote_embedding = None
+
+def embedding_function():
+    """Embedding function for new collections; None means Chroma's default model."""
+    global _remote_embedding
+    if config.EMBEDDING_BACKEND == "remote":
+        if _remote_embedding is None:
+            _remote_embedding = RemoteEmbeddingFunction()
+        return _remote_embedding
+    return None
+
+def embedder_name() -> str:
+    """Identifies the configured embedding model. Stores record it with their
+    vectors, and are refused (EmbedderMismatch) once it changes."""
+    embed = embedding_function()
+    if embed is None:
+        return "default"  # Chroma's bundled all-MiniLM-L6-v2
+    name = embed.name() if hasattr(embed, "name") else type(embed).__name__
+    model = getattr(embed, "model", None)
+    return f"{name}:{model}" if model else name
+
+_batchers: Optional[Tuple[EmbeddingBatcher, EmbeddingBatcher]] = None
+
+def batchers() -> Tuple[EmbeddingBatcher, EmbeddingBatcher]:
+    """(documents, queries) batchers around the embedding function. Memories are
+    embedded here rather than inside Chroma so that concurrent callers share
+    model calls."""
+    global _batchers
+    with _lock:
+        if _batchers is None:
+            embed = embedding_function()
+            if embed is None:
+                from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+                embed = DefaultEmbeddingFunction()
+            options = dict(max_batch=config.EMBED_BATCH_MAX, max_wait=config.EMBED_BATCH_WAIT_MS / 1000,
+                           processes=config.EMBED_PROCESSES)
+            documents = EmbeddingBatcher(embed, name="documents", **options)
+            embed_query = getattr(embed, "embed_query", None)
+            queries = EmbeddingBatcher(embed_query, name="queries", **options) if embed_query else documents
+            _batchers = (documents, queries)
+        return _batchers
+
+def _client(path: str):
+    with _lock:
+        client = _clients.get(path)
+        if client is None:
+            import chromadb
+            from chromadb.config import Settings
+
+            os.makedirs(path, exist_ok=True)
+            client = _clients[path] = chromadb.PersistentClient(path, settings=Settings(anonymized_telemetry=False))
+        return client
+
+def _collection(path: str, name: str, metadata: Dict[str, Any]):
+    key = (path, name)
+    col = _collections.get(key)
+    if col is None:
+        # Only a new collection takes this metadata; an existing one keeps its own
+        kwargs: Dict[str, Any] = {"name": name, "metadata": {**metadata, "embedder": embedder_name()}}
+        embed = embedding_function()
+        if embed is not None:
+            kwargs["embedding_function"] = embed
+        col = _client(path).get_or_create_collection(**kwargs)
+        with _lock:
+            _collections[key] = col
+    return col
+
+def reset_clients() -> None:
+    """Forget cached clients, collections, stores and batchers (e.g. after data
+    directories were removed or embedding_function was replaced)."""
+    global _batchers
+    with _lock:
+        _batchers = None
+        _clients.clear()
+        _collections.clear()
+        _numpy_stores.clear()
+        _chroma_agents.clear()
+
+def collection_name(agent_id: str) -> str:
+    # Chroma names allow only [a-zA-Z0-9._-]; agent ids may not fit, so hash them
+    return "agent-" + hashlib.sha1(agent_id.encode("utf-8")).hexdigest()[:24]
+
+def per_agent_path(agent_id: str, persist_root: str) -> str:
+    return os.path.join(persist_root, agent_id, "memory")
+
+def get_collection_for_agent(agent_id: str, persist_root: str) -> "Collection":
+    """The collection holding `agent_id`'s memories under the configured layout.
+
+    In the shared layout this collection also holds other agents' memories; go
+    through ChromaBackend (as the functions below do) to stay within one agent.
+    """
+    layout = config.CHROMA_LAYOUT
+    if layout == "per_agent":
+        return _collection(per_agent_path(agent_id, persist_root), "memories", {"hnsw:space":"cosine"})
+    path = os.path.join(persist_root, SHARED_DIR)
+    if layout == "collection":
+        return _collection(path, collection_name(agent_id), {"hnsw:space":"cosine", "agent_id": agent_id})
+    if layout == "shared":
+        return _collection(path, "memories", {"hnsw:space":"cosine"})
+    raise ValueError(f"unknown CHROMA_LAYOUT {layout!r}; expected one of {LAYOUTS}")
+
+
+# ===== Backends =====
+# Each agent's memories live in one backend, which provides
+#   upsert(ids, documents, metadatas, embeddings=None), query(text, k, where),
+#   get(memory_id) -> (document, metadata) | None, delete(ids), count()
+# ChromaBackend wraps a collection under CHROMA_LAYOUT; numpy_store.NumpyStore
+# keeps small agents in a memory-mapped array when VECTOR_BACKEND=numpy.
+
+class ChromaBackend:
+    """One agent's view of its collection: id prefixing and agent_id filtering
+    in the shared layout, pass-through otherwise."""
+
+    __slots__ = ("col", "agent_id", "owner")
+
+    def __init__(self, agent_id: str, persist_root: str):
+        self.col = get_collection_for_agent(agent_id, persist_root)
+        self.agent_id = agent_id if config.CHROMA_LAYOUT == "shared" else None
+        self.owner = agent_id
+
+    def check_embedder(self, dim: int) -> None:
+        """Refuse vectors of another embedder than the collection recorded; the
+        first write to a collection created with an embedder name adds its dimension."""
+        meta = self.col.metadata or {}
+        name = embedder_name()
+        check_embedder(f"{self.owner}'s Chroma collection", meta.get("embedder"), meta.get("embedding_dim"),
+                       name, dim)
+        if meta.get("embedder") == name and "embedding_dim" not in meta:
+            # hnsw:* keys cannot be passed to modify(); the collection keeps its distance
+            kept = {k: v for k, v in meta.items() if not k.startswith("hnsw:")}
+            self.col.modify(metadata={**kept, "embedding_dim": dim})
+
+    def store_id(self, memory_id: str) -> str:
+        return memory_id if self.agent_id is None else f"{self.agent_id}/{memory_id}"
+
+    def memory_id(self, store_id: str) -> str:
+        return store_id if self.agent_id is None else store_id[len(self.agent_id) + 1:]
+
+    def meta_in(self, meta: Dict[str, Any]) -> Dict[str, Any]:
+        return meta if self.agent_id is None else {**meta, "agent_id": self.agent_id}
+
+    def meta_out(self, meta: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        meta = dict(meta or {})
+        if self.agent_id is not None:
+            meta.pop("agent_id", None)
+        return meta
+
+    def where(self, where: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+        if self.agent_id is None:
+            return where
+        own = {"agent_id": self.agent_id}
+        if not where:
+            return own
+        if "$and" in where and len(where) == 1:
+            return {"$and": [own, *where["$and"]]}
+        return {"$and": [own, where]}
+
+    def count(self) -> int:
+        if self.agent_id is None:
+            return self.col.count()
+        return len(self.col.get(where=self.where(None), include=[])["ids"])
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+               embeddings: Optional[List[List[float]]] = None) -> None:
+        if embeddings is None:
+            embeddings = batchers()[0].embed(documents)
+        if len(embeddings):
+            self.check_embedder(len(embeddings[0]))
+        self.col.upsert(ids=[self.store_id(i) for i in ids], documents=documents,
+                        metadatas=[self.meta_in(m) for m in metadatas], embeddings=embeddings)
+
+    def query(self, text: str, k: int, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        query = batchers()[1].embed([text])
+        self.check_embedder(len(query[0]))
+        # Pass through Chroma metadata filter
+        res = self.col.query(
+            query_embeddings=query,
+            n_results=k,
+            include=["documents","metadatas","distances"],
+            where=self.where(where) or None
+        )
+        out = []
+        ids = res.get("ids", [[]])[0]
+        docs = res.get("documents", [[]])[0]
+        metas = res.get("metadatas", [[]])[0]
+        dists = res.get("distances", [[]])[0]
+        for i, mid in enumerate(ids):
+            out.append({
+                "memory_id": self.memory_id(mid),
+                "text": docs[i],
+                "metadata": self.meta_out(metas[i]),
+                "distance": dists[i],
+            })
+        return out
+
+    def get(self, memory_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        recs = self.col.get(ids=[self.store_id(memory_id)], include=["documents","metadatas"])
+        if not recs["ids"]:
+            return None
+        return recs["documents"][0], self.meta_out(recs["metadatas"][0])
+
+    def delete(self, ids: List[str]) -> None:
+        self.col.delete(ids=[self.store_id(i) for i in ids])
+
+
+_numpy_stores: Dict[str, numpy_store.NumpyStore] = {}
+_chroma_agents: Set[Tuple[str, str, str]] = set()  # (layout, root, agent) known to have Chroma data
+
+def _numpy_store(agent_id: str, persist_root: str) -> numpy_store.NumpyStore:
+    path = numpy_store.store_path(persist_root, agent_id)
+    with _lock:
+        store = _numpy_stores.get(path)
+    if store is None:
+        documents, queries = batchers()
+        store = numpy_store.NumpyStore(path, documents.embed, queries.embed, dtype=config.NUMPY_STORE_DTYPE,
+                                       embedder=embedder_name())
+        with _lock:
+            store = _numpy_stores.setdefault(path, store)
+    return store
+
+def _in_chroma(agent_id: str, persist_root: str) -> bool:
+    layout = config.CHROMA_LAYOUT
+    key = (layout, persist_root, agent_id)
+    if key in _chroma_agents:
+        return True
+    if layout == "per_agent":
+        found = os.path.isdir(per_agent_path(agent_id, persist_root))
+    elif layout == "collection":
+        try:
+            _client(os.path.join(persist_root, SHARED_DIR)).get_collection(collection_name(agent_id))
+            found = True
+        except Exception:
+            found = False
+    else:
+        found = ChromaBackend(agent_id, persist_root).count() > 0
+    if found:
+        _chroma_agents.add(key)
+    return found
+
+def backend_for(agent_id: str, persist_root: str):
+    """The backend holding `agent_id`'s memories.
+
+    With VECTOR_BACKEND=numpy, agents without Chroma data start in a NumpyStore
+    and stay there until they pass VECTOR_PROMOTE_AT memories.
+    """
+    if os.path.isdir(numpy_store.store_path(persist_root, agent_id)):
+        return _numpy_store(agent_id, persist_root)
+    if config.VECTOR_BACKEND == "numpy" and not _in_chroma(agent_id, persist_root):
+        return _numpy_store(agent_id, persist_root)
+    return ChromaBackend(agent_id, persist_root)
+
+_agent_locks: Dict[Tuple[str, str], threading.RLock] = {}
+
+def _agent_lock(agent_id: str, persist_root: str) -> threading.RLock:
+    """Serializes writes to one agent's memories, so none lands in a NumpyStore
+    that promote() has already exported and is about to remove."""
+    with _lock:
+        return _agent_locks.setdefault((persist_root, agent_id), threading.RLock())
+
+def promote(agent_id: str, persist_root: str) -> int:
+    """Move an agent's NumpyStore into Chroma (stored embeddings are reused)."""
+    with _agent_lock(agent_id, persist_root):
+        store = _numpy_store(agent_id, persist_root)
+        ids, docs, metas, embeddings = store.export()
+        backend = ChromaBackend(agent_id, persist_root)
+        for start in range(0, len(ids), 500):
+            end = start + 500
+            backend.upsert(ids[start:end], docs[start:end], metas[start:end], embeddings[start:end])
+        _chroma_agents.add((config.CHROMA_LAYOUT, persist_root, agent_id))
+        with _lock:
+            _numpy_stores.pop(store.path, None)
+        shutil.rmtree(store.path, ignore_errors=True)
+    print(f"Promoted {agent_id}'s {len(ids)} memories to Chroma")
+    return len(ids)
 
 def _flat_meta_only(meta: Dict[str, Any]) -> Dict[str, Any]:
     # Keep only allowed keys; coerce to primitives Chroma accepts
@@ -53,7 +339,11 @@ def _flat_meta_only(meta: Dict[str, Any]) -> Dict[str, Any]:
     return clean
 
 def upsert_memories(agent_id: str, persist_root: str, items: List[Dict[str, Any]]):
-    col = get_collection_for_agent(agent_id, persist_root)
+    with _agent_lock(agent_id, persist_root):
+        return _upsert_memories(agent_id, persist_root, items)
+
+def _upsert_memories(agent_id: str, persist_root: str, items: List[Dict[str, Any]]):
+    backend = backend_for(agent_id, persist_root)
     ids, docs, metas = [], [], []
     for it in items:
         _id = it.get("memory_id") or str(uuid.uuid4())
@@ -69,49 +359,33 @@ def upsert_memories(agent_id: str, persist_root: str, items: List[Dict[str, Any]
         ids.append(_id)
         docs.append(it["text"])
         metas.append(meta)
-    col.upsert(ids=ids, documents=docs, metadatas=metas)
+    backend.upsert(ids, docs, metas)
+    if isinstance(backend, numpy_store.NumpyStore) and backend.count() > config.VECTOR_PROMOTE_AT:
+        promote(agent_id, persist_root)
     return [it["memory_id"] for it in items]
 
 def query_memories(agent_id: str, persist_root: str, query: str, k: int = 6,
                    where: Optional[Dict[str, Any]] = None):
-    col = get_collection_for_agent(agent_id, persist_root)
-    normalized = _normalize_where(where)
-    # Pass through Chroma metadata filter
-    res = col.query(
-        query_texts=[query],
-        n_results=k,
-        include=["documents","metadatas","distances"],
-        where=normalized or None
-    )
-    out = []
-    ids = res.get("ids", [[]])[0]
-    docs = res.get("documents", [[]])[0]
-    metas = res.get("metadatas", [[]])[0]
-    dists = res.get("distances", [[]])[0]
-    for i, mid in enumerate(ids):
-        out.append({
-            "memory_id": mid,
-            "text": docs[i],
-            "metadata": metas[i],
-            "distance": dists[i],
-        })
-    return out
+    return backend_for(agent_id, persist_root).query(query, k, _normalize_where(where))
 
 def delete_memory(agent_id: str, persist_root: str, memory_id: str):
-    col = get_collection_for_agent(agent_id, persist_root)
-    col.delete(ids=[memory_id])
+    with _agent_lock(agent_id, persist_root):
+        backend_for(agent_id, persist_root).delete([memory_id])
 
 def update_memory(agent_id: str, persist_root: str, memory_id: str, patch: Dict[str, Any]):
-    col = get_collection_for_agent(agent_id, persist_root)
-    recs = col.get(ids=[memory_id], include=["documents","metadatas"])
-    if not recs["ids"]:
+    with _agent_lock(agent_id, persist_root):
+        return _update_memory(agent_id, persist_root, memory_id, patch)
+
+def _update_memory(agent_id: str, persist_root: str, memory_id: str, patch: Dict[str, Any]):
+    backend = backend_for(agent_id, persist_root)
+    rec = backend.get(memory_id)
+    if rec is None:
         return False
-    doc = recs["documents"][0]
-    meta = recs["metadatas"][0] or {}
+    doc, meta = rec
     if "text" in patch:
         doc = patch["text"]
     # merge and flatten only allowed metadata
     merged = {**meta, **{k: v for k, v in patch.items() if k != "text"}}
     meta = _flat_meta_only(merged)
-    col.upsert(ids=[memory_id], documents=[doc], metadatas=[meta])
+    backend.upsert([memory_id], [doc], [meta])
     return True
@@ -0,0 +1,149 @@
+"""Cross-request micro-batching for the embedding model.
+
+Each memory insert or lookup embeds only a handful of texts, and concurrent
+sessions used to call the model separately. An EmbeddingBatcher puts requests
+from every caller in one queue. A collector thread waits up to
+EMBED_BATCH_WAIT_MS (or until EMBED_BATCH_MAX texts are pending), embeds the
+lot in one call, and resolves each caller's future with its own rows.
+
+With EMBED_PROCESSES > 0 batches run in a process pool, so the model no longer
+competes with the API for the GIL. Several batches can be in flight at once.
+The embedding function must then be picklable.
+
+Callers block on `embed()` (from threads) or await `aembed()`.
+
+Stores record which embedder wrote their vectors (name and dimension);
+`check_embedder` refuses to mix vectors from different models.
+"""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Any, Callable, List, Optional, Tuple
+
+from ..metrics import EMBED_BATCH_SIZE, EMBED_QUEUE_WAIT_SECONDS, EMBED_SECONDS
+
+EmbedFn = Callable[[List[str]], Any]
+
+_worker_fn: Optional[EmbedFn] = None
+
+REEMBED_HINT = "re-embed it with `python -m agent_host.app.memory.migrate --reembed`"
+
+
+class EmbedderMismatch(ValueError):
+    """A store's vectors came from another embedding model than the configured one."""
+
+
+def check_embedder(store: str, stored_name: Optional[str], stored_dim: Optional[int],
+                   name: str, dim: int) -> None:
+    """Raise EmbedderMismatch unless (name, dim) agrees with what `store` recorded.
+    Stores written before this was recorded leave both None and always pass."""
+    if (stored_name is not None and stored_name != name) or (stored_dim is not None and stored_dim != dim):
+        source = f"embedder {stored_name!r}" if stored_name is not None else "an unrecorded embedder"
+        size = f"{stored_dim}-dimensional " if stored_dim is not None else ""
+        raise EmbedderMismatch(
+            f"{store} holds {size}vectors from {source}, but the configured embedder "
+            f"{name!r} produces {dim} dimensions; {REEMBED_HINT}"
+        )
+
+
+def _init_worker(fn: EmbedFn) -> None:
+    global _worker_fn
+    _worker_fn = fn
+
+
+def _worker_embed(texts: List[str]) -> List[List[float]]:
+    return [list(map(float, v)) for v in _worker_fn(texts)]
+
+
+class EmbeddingBatcher:
+    def __init__(self, fn: EmbedFn, max_batch: int = 64, max_wait: float = 0.005,
+                 processes: int = 0, name: str = "embed"):
+        self.fn = fn
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait)
+        self.name = name
+        self._queue: "queue.Queue[Tuple[List[str], Future, float]]" = queue.Queue()
+        self._pool = (
+            ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(fn,)) if processes > 0 else None
+        )
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+
+    def submit(self, texts: List[str]) -> Future:
+        future: Future = Future()
+        if not texts:
+            future.set_result([])
+            return future
+        self._ensure_thread()
+        self._queue.put((list(texts), future, time.perf_counter()))
+        return future
+
+    def embed(self, texts: List[str]) -> List[Any]:
+        return self.submit(texts).result()
+
+    async def aembed(self, texts: List[str]) -> List[Any]:
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._collect, name=f"{self.name}-batcher", daemon=True)
+                self._thread.start()
+
+    def _collect(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            pending = len(batch[0][0])
+            deadline = time.perf_counter() + self.max_wait
+            while pending < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.append(item)
+                pending += len(item[0])
+            self._dispatch(batch)
+
+    def _dispatch(self, batch: List[Tuple[List[str], Future, float]]) -> None:
+        started = time.perf_counter()
+        texts = [t for item in batch for t in item[0]]
+        EMBED_BATCH_SIZE.observe(len(texts), embedder=self.name)
+        for _, _, enqueued in batch:
+            EMBED_QUEUE_WAIT_SECONDS.observe(started - enqueued, embedder=self.name)
+        if self._pool is None:
+            try:
+                vectors = self.fn(texts)
+            except BaseException as exc:
+                self._fail(batch, exc)
+                return
+            self._resolve(batch, vectors, started)
+            return
+        job = self._pool.submit(_worker_embed, texts)
+
+        def done(job: Future) -> None:
+            exc = job.exception()
+            if exc is not None:
+                self._fail(batch, exc)
+            else:
+                self._resolve(batch, job.result(), started)
+
+        job.add_done_callback(done)
+
+    def _resolve(self, batch: List[Tuple[List[str], Future, float]], vectors: Any, started: float) -> None:
+        EMBED_SECONDS.observe(time.perf_counter() - started, embedder=self.name)
+        offset = 0
+        for texts, future, _ in batch:
+            future.set_result(list(vectors[offset:offset + len(texts)]))
+            offset += len(texts)
+
+    @staticmethod
+    def _fail(batch: List[Tuple[List[str], Future, float]], exc: BaseException) -> None:
+        for _, future, _ in batch:
+            future.set_exception(exc)
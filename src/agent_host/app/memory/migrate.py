@@ -0,0 +1,198 @@
+"""Copy memories from the per-agent Chroma layout into a shared one, or
+re-embed them after the embedding model changed.
+
+    python -m agent_host.app.memory.migrate --layout shared [--root ./data/agents] [--remove-old]
+    python -m agent_host.app.memory.migrate --reembed [--root ./data/agents] [--agent ID]
+
+--layout reads <root>/<agent_id>/memory for every agent, then writes documents,
+metadata and the stored embeddings into the target layout. Nothing is
+re-embedded. The old directories stay unless --remove-old is given. Set
+CHROMA_LAYOUT to the target layout before starting the server on the migrated data.
+
+--reembed embeds every stored document again with the configured embedder
+(EMBEDDING_BACKEND / EMBEDDING_MODEL), in every layout and in NumPy stores.
+Stores refuse queries once the embedder changes (EmbedderMismatch) until this
+has run. Each Chroma collection is rebuilt next to the old one and swapped in
+when complete; the shared collection always holds, and rebuilds, every agent.
+"""
+import argparse
+import os
+import shutil
+from typing import Dict, List, Optional, Tuple
+
+import chromadb
+from chromadb.config import Settings
+from chromadb.errors import NotFoundError
+
+from .. import config
+from . import chroma_store, numpy_store
+
+BATCH = 500
+
+
+def agents_with_memory(root: str) -> List[str]:
+    if not os.path.isdir(root):
+        return []
+    return [
+        agent_id for agent_id in sorted(os.listdir(root))
+        if os.path.isdir(chroma_store.per_agent_path(agent_id, root))
+    ]
+
+
+# migrate_agent outcomes; only a verified "copied" or "empty" store may be removed
+COPIED, EMPTY, ABSENT, FAILED = "copied", "empty", "absent", "failed"
+
+
+def migrate_agent(root: str, agent_id: str, layout: str) -> Tuple[str, int]:
+    """Copy one agent's memories. Returns (status, count): COPIED or EMPTY once
+    every source id was found in the target, ABSENT when the agent has no
+    collection, FAILED (with the count copied so far) when the copy did not verify.
+    Other errors, such as a store that cannot be opened, propagate."""
+    source = chromadb.PersistentClient(
+        chroma_store.per_agent_path(agent_id, root), settings=Settings(anonymized_telemetry=False)
+    )
+    try:
+        old = source.get_collection("memories")
+    except NotFoundError:
+        return ABSENT, 0
+    previous, config.CHROMA_LAYOUT = config.CHROMA_LAYOUT, layout
+    try:
+        scope = chroma_store.ChromaBackend(agent_id, root)
+        copied = 0
+        while True:
+            batch = old.get(limit=BATCH, offset=copied, include=["documents", "metadatas", "embeddings"])
+            if not batch["ids"]:
+                break
+            scope.upsert(batch["ids"], batch["documents"], [m or {} for m in batch["metadatas"]],
+                         batch["embeddings"])
+            copied += len(batch["ids"])
+        verified = _verify(old, scope)
+    finally:
+        config.CHROMA_LAYOUT = previous
+    if not verified:
+        return FAILED, copied
+    return (COPIED if copied else EMPTY), copied
+
+
+def _verify(old, scope: "chroma_store.ChromaBackend") -> bool:
+    """Every id of the source collection is in the target, and the counts agree."""
+    total = old.count()
+    for offset in range(0, total, BATCH):
+        ids = old.get(limit=BATCH, offset=offset, include=[])["ids"]
+        found = scope.col.get(ids=[scope.store_id(i) for i in ids], include=[])["ids"]
+        if len(found) != len(ids):
+            return False
+    return scope.count() == total
+
+
+def migrate(root: str, layout: str, agents: Optional[List[str]] = None,
+            remove_old: bool = False) -> Dict[str, Tuple[str, int]]:
+    """Migrate agents; returns (status, count) per agent (see migrate_agent).
+    With `remove_old`, only stores whose copy verified are deleted."""
+    if layout not in ("collection", "shared"):
+        raise ValueError("migrate to 'collection' or 'shared'")
+    results: Dict[str, Tuple[str, int]] = {}
+    for agent_id in agents if agents is not None else agents_with_memory(root):
+        try:
+            results[agent_id] = migrate_agent(root, agent_id, layout)
+        except Exception as exc:
+            print(f"{agent_id}: migration failed: {exc}")
+            results[agent_id] = (FAILED, 0)
+        status, count = results[agent_id]
+        print(f"{agent_id}: {count} memories ({status})")
+        if remove_old and status in (COPIED, EMPTY):
+            shutil.rmtree(chroma_store.per_agent_path(agent_id, root), ignore_errors=True)
+    return results
+
+
+def reembed_collection(path: str, name: str) -> int:
+    """Rebuild one Chroma collection with the configured embedder; returns its size."""
+    client = chroma_store._client(path)
+    old = client.get_collection(name)
+    metadata = {k: v for k, v in (old.metadata or {}).items() if k not in ("embedder", "embedding_dim")}
+    metadata = {**metadata, "hnsw:space": "cosine", "embedder": chroma_store.embedder_name()}
+    staging = f"{name}-reembed"
+    try:
+        client.delete_collection(staging)  # left over from an interrupted run
+    except Exception:
+        pass
+    kwargs = {}
+    embed = chroma_store.embedding_function()
+    if embed is not None:
+        kwargs["embedding_function"] = embed
+    new = client.create_collection(staging, metadata=metadata, **kwargs)
+    documents = chroma_store.batchers()[0]
+    copied, dim = 0, None
+    while True:
+        batch = old.get(limit=BATCH, offset=copied, include=["documents", "metadatas"])
+        if not batch["ids"]:
+            break
+        embeddings = documents.embed(batch["documents"])
+        dim = len(embeddings[0])
+        new.upsert(ids=batch["ids"], documents=batch["documents"],
+                   metadatas=[m or {} for m in batch["metadatas"]], embeddings=embeddings)
+        copied += len(batch["ids"])
+    if dim is not None:
+        kept = {k: v for k, v in metadata.items() if not k.startswith("hnsw:")}
+        new.modify(metadata={**kept, "embedding_dim": dim})
+    client.delete_collection(name)
+    new.modify(name=name)
+    return copied
+
+
+def reembed(root: str, agents: Optional[List[str]] = None) -> Dict[str, int]:
+    """Re-embed the memories of `agents` (default: every store under `root`).
+    The shared collection is always rebuilt whole. Returns counts per store."""
+    counts: Dict[str, int] = {}
+    shared_path = os.path.join(root, chroma_store.SHARED_DIR)
+    shared: List[str] = []
+    if os.path.isdir(shared_path):
+        shared = sorted(c.name for c in chroma_store._client(shared_path).list_collections()
+                        if not c.name.endswith("-reembed"))
+    if agents is None:
+        agents = [a for a in sorted(os.listdir(root)) if a != chroma_store.SHARED_DIR] if os.path.isdir(root) else []
+    else:
+        # Only the named agents' collections (plus the shared one, which cannot be split)
+        wanted = {chroma_store.collection_name(a) for a in agents} | {"memories"}
+        shared = [name for name in shared if name in wanted]
+    for agent_id in agents:
+        if os.path.isdir(numpy_store.store_path(root, agent_id)):
+            counts[f"{agent_id} (numpy)"] = chroma_store._numpy_store(agent_id, root).reembed()
+        if os.path.isdir(chroma_store.per_agent_path(agent_id, root)):
+            counts[f"{agent_id} (per_agent)"] = reembed_collection(chroma_store.per_agent_path(agent_id, root),
+                                                                   "memories")
+    for name in shared:
+        counts[f"{chroma_store.SHARED_DIR}/{name}"] = reembed_collection(shared_path, name)
+    # Cached handles point at the collections that were just replaced
+    chroma_store.reset_clients()
+    for store, count in counts.items():
+        print(f"{store}: {count} memories re-embedded")
+    return counts
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Migrate per-agent Chroma stores to a shared layout, "
+                                                 "or re-embed memories with the configured embedder")
+    parser.add_argument("--root", default=config.CHROMA_PERSIST_ROOT)
+    action = parser.add_mutually_exclusive_group(required=True)
+    action.add_argument("--layout", choices=["collection", "shared"])
+    action.add_argument("--reembed", action="store_true",
+                        help="embed stored memories again after EMBEDDING_BACKEND/EMBEDDING_MODEL changed")
+    parser.add_argument("--agent", action="append", dest="agents", help="only these agents (repeatable)")
+    parser.add_argument("--remove-old", action="store_true", help="delete each per-agent store once copied")
+    args = parser.parse_args()
+    if args.reembed:
+        counts = reembed(args.root, args.agents)
+        print(f"re-embedded {sum(counts.values())} memories in {len(counts)} stores")
+        return
+    results = migrate(args.root, args.layout, args.agents, args.remove_old)
+    failed = sorted(agent_id for agent_id, (status, _) in results.items() if status == FAILED)
+    print(f"migrated {sum(count for status, count in results.values() if status != FAILED)} memories "
+          f"from {len(results) - len(failed)} agents")
+    if failed:
+        print("failed (old stores kept):", ", ".join(failed))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
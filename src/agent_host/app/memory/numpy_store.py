@@ -0,0 +1,280 @@
+"""Compact in-process vector store for agents with few memories.
+
+One directory per agent (<root>/<agent_id>/memory_np) holds:
+
+- vectors.npy: unit-normalised embeddings as float16, or int8 with a per-row
+  scale in scales.npy. These are memory-mapped on read.
+- records.json: ids, documents and flat metadata, row-aligned with the vectors,
+  plus the name and dimension of the embedder that produced them. Queries and
+  writes with a different embedder raise EmbedderMismatch; `reembed()` rebuilds
+  the vectors after a model change.
+
+A query embeds the text, applies the metadata filter to the sidecar, and takes
+the dot product against the surviving rows. Distances are cosine distances, as
+in a Chroma collection created with hnsw:space=cosine. Writes rewrite both files
+through a temp file and a rename. That is fine at the few thousand rows this
+backend is meant for; chroma_store promotes larger agents to Chroma.
+"""
+import json
+import os
+import tempfile
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .embedding import check_embedder
+
+DTYPES = ("float16", "int8")
+_OPS = {
+    "$eq": lambda a, b: a == b,
+    "$ne": lambda a, b: a != b,
+    "$gt": lambda a, b: a is not None and a > b,
+    "$gte": lambda a, b: a is not None and a >= b,
+    "$lt": lambda a, b: a is not None and a < b,
+    "$lte": lambda a, b: a is not None and a <= b,
+    "$in": lambda a, b: a in b,
+    "$nin": lambda a, b: a not in b,
+}
+
+
+def store_path(root: str, agent_id: str) -> str:
+    return os.path.join(root, agent_id, "memory_np")
+
+
+def matches(meta: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Evaluate a Chroma-style metadata filter against one record."""
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(matches(meta, sub) for sub in cond):
+                return False
+        elif key == "$or":
+            if not any(matches(meta, sub) for sub in cond):
+                return False
+        elif isinstance(cond, dict):
+            value = meta.get(key)
+            for op, operand in cond.items():
+                if op not in _OPS:
+                    raise ValueError(f"unsupported where operator {op!r}")
+                try:
+                    if not _OPS[op](value, operand):
+                        return False
+                except TypeError:
+                    return False
+        elif meta.get(key) != cond:
+            return False
+    return True
+
+
+def _normalise(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyStore:
+    """One agent's memories; thread-safe within the process."""
+
+    def __init__(self, path: str, embed: Callable[[List[str]], Any],
+                 embed_query: Optional[Callable[[List[str]], Any]] = None, dtype: str = "float16",
+                 embedder: Optional[str] = None):
+        if dtype not in DTYPES:
+            raise ValueError(f"dtype must be one of {DTYPES}")
+        self.path = path
+        self.dtype = dtype
+        self.embedder = embedder
+        self._stored_embedder: Optional[str] = None
+        self._embed = embed
+        self._embed_query = embed_query or embed
+        self._lock = threading.Lock()
+        self._loaded_sig: Optional[Tuple[int, int]] = None
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._vectors: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+
+    # ----- persistence -----
+
+    def _records_file(self) -> str:
+        return os.path.join(self.path, "records.json")
+
+    def _load(self) -> None:
+        try:
+            st = os.stat(self._records_file())
+        except FileNotFoundError:
+            self._ids, self._documents, self._metadatas = [], [], []
+            self._vectors = self._scales = None
+            self._stored_embedder = None
+            self._loaded_sig = None
+            return
+        sig = (st.st_mtime_ns, st.st_size)
+        if sig == self._loaded_sig:
+            return
+        with open(self._records_file(), "r", encoding="utf-8") as f:
+            records = json.load(f)
+        self.dtype = records.get("dtype", self.dtype)
+        self._stored_embedder = records.get("embedder")
+        self._ids = records["ids"]
+        self._documents = records["documents"]
+        self._metadatas = records["metadatas"]
+        self._vectors = np.load(os.path.join(self.path, "vectors.npy"), mmap_mode="r")
+        scales = os.path.join(self.path, "scales.npy")
+        self._scales = np.load(scales, mmap_mode="r") if self.dtype == "int8" else None
+        self._loaded_sig = sig
+
+    def _save(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+              vectors: np.ndarray, embedder: Optional[str]) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        if self.dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            stored = np.round(vectors / scales[:, None]).astype(np.int8)
+            self._write(os.path.join(self.path, "scales.npy"),
+                        lambda f: np.save(f, scales.astype(np.float32)))
+        else:
+            stored = vectors.astype(np.float16)
+        self._write(os.path.join(self.path, "vectors.npy"), lambda f: np.save(f, stored))
+        records = {"dtype": self.dtype, "embedder": embedder, "embedding_dim": int(vectors.shape[1]),
+                   "ids": ids, "documents": documents, "metadatas": metadatas}
+        # records.json goes last: readers key their reload on it
+        self._write(self._records_file(),
+                    lambda f: f.write(json.dumps(records, ensure_ascii=False).encode("utf-8")))
+        self._loaded_sig = None
+        self._load()
+
+    def _write(self, path: str, dump: Callable[[Any], None]) -> None:
+        fd, tmp_path = tempfile.mkstemp(prefix=".np.", suffix=".tmp", dir=self.path)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                dump(f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _check(self, dim: int) -> None:
+        """Refuse vectors of another embedder than the stored ones (call under the lock)."""
+        if not self._ids or self._vectors is None:
+            return
+        stored = self._stored_embedder if self.embedder is not None else None
+        check_embedder(self.path, stored, int(self._vectors.shape[1]), self.embedder or "", dim)
+
+    def _dense(self) -> np.ndarray:
+        """All stored vectors as float32 (dequantised)."""
+        if self._vectors is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        vectors = np.asarray(self._vectors, dtype=np.float32)
+        if self._scales is not None:
+            vectors = vectors * np.asarray(self._scales)[:, None]
+        return vectors
+
+    # ----- store interface -----
+
+    def count(self) -> int:
+        with self._lock:
+            self._load()
+            return len(self._ids)
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+               embeddings: Optional[List[List[float]]] = None) -> None:
+        new = _normalise(np.asarray(
+            embeddings if embeddings is not None else self._embed(documents), dtype=np.float32
+        ))
+        with self._lock:
+            self._load()
+            self._check(new.shape[1])
+            # An empty store takes on the current embedder; older stores keep what they recorded
+            embedder = self._stored_embedder if self._ids else self.embedder
+            all_ids = list(self._ids)
+            all_docs = list(self._documents)
+            all_metas = list(self._metadatas)
+            vectors = self._dense()
+            if vectors.size == 0:
+                vectors = np.zeros((0, new.shape[1]), dtype=np.float32)
+            else:
+                vectors = np.array(vectors)
+            position = {mid: i for i, mid in enumerate(all_ids)}
+            appended = []
+            for row, mid in enumerate(ids):
+                if mid in position:
+                    i = position[mid]
+                    all_docs[i], all_metas[i] = documents[row], metadatas[row]
+                    vectors[i] = new[row]
+                else:
+                    position[mid] = len(all_ids)
+                    all_ids.append(mid)
+                    all_docs.append(documents[row])
+                    all_metas.append(metadatas[row])
+                    appended.append(row)
+            if appended:
+                vectors = np.vstack([vectors, new[appended]])
+            self._save(all_ids, all_docs, all_metas, vectors, embedder)
+
+    def get(self, memory_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        with self._lock:
+            self._load()
+            try:
+                i = self._ids.index(memory_id)
+            except ValueError:
+                return None
+            return self._documents[i], dict(self._metadatas[i])
+
+    def delete(self, ids: List[str]) -> None:
+        drop = set(ids)
+        with self._lock:
+            self._load()
+            keep = [i for i, mid in enumerate(self._ids) if mid not in drop]
+            if len(keep) == len(self._ids):
+                return
+            vectors = self._dense()[keep] if keep else np.zeros((0, self._dense().shape[1]), dtype=np.float32)
+            self._save([self._ids[i] for i in keep], [self._documents[i] for i in keep],
+                       [self._metadatas[i] for i in keep], vectors, self._stored_embedder)
+
+    def query(self, text: str, k: int, where: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+        query = _normalise(np.asarray(self._embed_query([text]), dtype=np.float32))[0]
+        with self._lock:
+            self._load()
+            if not self._ids:
+                return []
+            self._check(query.shape[0])
+            rows = np.array([i for i, meta in enumerate(self._metadatas) if matches(meta, where)], dtype=np.int64)
+            if rows.size == 0:
+                return []
+            scores = np.asarray(self._vectors[rows], dtype=np.float32) @ query
+            if self._scales is not None:
+                scores *= np.asarray(self._scales[rows])
+            k = min(k, rows.size)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [
+                {
+                    "memory_id": self._ids[rows[j]],
+                    "text": self._documents[rows[j]],
+                    "metadata": dict(self._metadatas[rows[j]]),
+                    "distance": float(1.0 - scores[j]),
+                }
+                for j in top
+            ]
+
+    def reembed(self) -> int:
+        """Embed every stored document again with this store's embedder, e.g. after
+        EMBEDDING_BACKEND or EMBEDDING_MODEL changed. Returns the number of rows."""
+        with self._lock:
+            self._load()
+            if not self._ids:
+                return 0
+            vectors = _normalise(np.asarray(self._embed(self._documents), dtype=np.float32))
+            self._save(list(self._ids), list(self._documents), list(self._metadatas), vectors, self.embedder)
+            return len(self._ids)
+
+    def export(self) -> Tuple[List[str], List[str], List[Dict[str, Any]], List[List[float]]]:
+        """Everything stored, with dequantised embeddings (for promotion to Chroma)."""
+        with self._lock:
+            self._load()
+            return list(self._ids), list(self._documents), [dict(m) for m in self._metadatas], self._dense().tolist()
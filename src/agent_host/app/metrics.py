@@ -0,0 +1,271 @@
+"""Process metrics in the Prometheus text exposition format.
+
+A deliberately small implementation (counters, gauges, histograms with labels)
+so the API process does not need prometheus_client. `render()` produces the
+/metrics body; llama-server's own /metrics are scraped on demand and
+re-exported under the `agent_host_llamacpp_` prefix with a `backend` label.
+"""
+import asyncio
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import httpx
+
+from .config import LLAMACPP_BASE_URL, LLAMACPP_BASE_URLS
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300)
+
+_REGISTRY: List["_Metric"] = []
+
+
+def _fmt_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional[List["_Metric"]] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        # Rendered by /metrics unless a private registry is given (e.g. in tests)
+        (_REGISTRY if registry is None else registry).append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _samples(self) -> Iterator[str]:
+        """Sample lines; a metric without recorded values has none."""
+        return iter(())
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f"{self.name}{_fmt_labels(self.labelnames, key)} {_fmt_value(value)}"
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1.0, **labels: str) -> None:
+        self.inc(-amount, **labels)
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS, registry: Optional[List[_Metric]] = None):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+        # key -> (per-bucket counts, sum, count)
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], float, int]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            counts, total, n = self._values.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[key] = (counts, total + value, n + 1)
+
+    @contextmanager
+    def time(self, **labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> Iterator[str]:
+        with self._lock:
+            items = [(k, (list(c), s, n)) for k, (c, s, n) in self._values.items()]
+        for key, (counts, total, n) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{_fmt_value(bound)}"'
+                yield f"{self.name}_bucket{_fmt_labels(self.labelnames, key, le)} {cumulative}"
+            yield f"{self.name}_sum{_fmt_labels(self.labelnames, key)} {_fmt_value(total)}"
+            yield f"{self.name}_count{_fmt_labels(self.labelnames, key)} {n}"
+
+
+# ===== Turn pipeline =====
+
+SESSIONS_IN_FLIGHT = Gauge("agent_host_sessions_in_flight", "Chat turns currently being processed.")
+TURN_SECONDS = Histogram("agent_host_turn_seconds", "Wall time of a whole chat turn.")
+PROMPT_BUILD_SECONDS = Histogram("agent_host_prompt_build_seconds", "Time to build the system prompt.")
+HISTORY_SECONDS = Histogram(
+    "agent_host_history_seconds", "Chat history file I/O per operation.", ("op",)
+)
+LLM_REQUESTS_IN_FLIGHT = Gauge(
+    "agent_host_llm_requests_in_flight", "Requests sent to llama-server and not yet finished."
+)
+LLM_TTFT_SECONDS = Histogram(
+    "agent_host_llm_ttft_seconds", "Time from request to first streamed token (prefill)."
+)
+LLM_DECODE_TOKENS_PER_SECOND = Histogram(
+    "agent_host_llm_decode_tokens_per_second", "Streamed decode rate after the first token.",
+    buckets=RATE_BUCKETS,
+)
+TOOL_SECONDS = Histogram("agent_host_tool_seconds", "Tool handler latency.", ("tool",))
+FOLLOWUP_SECONDS = Histogram(
+    "agent_host_followup_seconds", "Latency of the post-tool follow-up generation."
+)
+LLM_BACKEND_OUTSTANDING = Gauge(
+    "agent_host_llm_backend_outstanding", "Requests in flight per llama-server backend.", ("backend",)
+)
+LLM_BACKEND_UP = Gauge("agent_host_llm_backend_up", "Backend health as last polled (1 healthy).", ("backend",))
+LLM_FAILOVERS = Counter(
+    "agent_host_llm_failovers_total", "Requests retried on another backend before any output.", ("backend",)
+)
+EMBED_BATCH_SIZE = Histogram(
+    "agent_host_embed_batch_size", "Texts per embedding model call.", ("embedder",),
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512),
+)
+EMBED_QUEUE_WAIT_SECONDS = Histogram(
+    "agent_host_embed_queue_wait_seconds", "Time an embedding request waited for its batch.", ("embedder",)
+)
+EMBED_SECONDS = Histogram("agent_host_embed_seconds", "Embedding model time per batch.", ("embedder",))
+HISTORY_CACHE_REQUESTS = Counter(
+    "agent_host_history_cache_requests_total", "History window reads by cache result.", ("result",)
+)
+COMPLETION_CACHE_REQUESTS = Counter(
+    "agent_host_completion_cache_requests_total", "Cacheable completions by cache result.", ("result",)
+)
+TURNS_CANCELLED = Counter(
+    "agent_host_turns_cancelled_total", "Turns cancelled before completion (client disconnect or cancel)."
+)
+SCHEDULER_QUEUE_DEPTH = Gauge(
+    "agent_host_scheduler_queue_depth", "Turns waiting for a free llama-server slot."
+)
+SCHEDULER_SLOTS_BUSY = Gauge("agent_host_scheduler_slots_busy", "llama-server slots held by scheduled turns.")
+SLOW_TURNS = Counter(
+    "agent_host_slow_turns_total", "Turns that exceeded SLOW_TURN_SECONDS and had stacks captured."
+)
+
+
+# ===== llama-server re-export =====
+
+_LINE = re.compile(r"^(# (?:HELP|TYPE) )?([a-zA-Z_:][a-zA-Z0-9_:]*)(\{[^}]*\})?(.*)$")
+
+
+def relabel_llamacpp(text: str, backend: str) -> str:
+    """Rename `llamacpp:*` series to `agent_host_llamacpp_*` and add a backend label."""
+    out = []
+    backend_label = f'backend="{_escape(backend)}"'
+    for line in text.splitlines():
+        m = _LINE.match(line)
+        if not m:
+            continue
+        comment, name, labels, rest = m.groups()
+        name = "agent_host_llamacpp_" + name.split(":", 1)[-1].replace(":", "_")
+        if comment:
+            out.append(f"{comment}{name}{rest}")
+            continue
+        labels = "{" + (labels[1:-1] + "," if labels and labels != "{}" else "") + backend_label + "}"
+        out.append(f"{name}{labels}{rest}")
+    return "\n".join(out)
+
+
+async def scrape_llamacpp(base_url: str = LLAMACPP_BASE_URL) -> str:
+    up = (
+        "# TYPE agent_host_llamacpp_up gauge\n"
+        f'agent_host_llamacpp_up{{backend="{_escape(base_url)}"}}'
+    )
+    try:
+        async with httpx.AsyncClient(timeout=2.0) as client:
+            r = await client.get(f"{base_url}/metrics")
+            r.raise_for_status()
+    except Exception:
+        return f"{up} 0"
+    return relabel_llamacpp(r.text, base_url) + f"\n{up} 1"
+
+
+_SAMPLE_SUFFIXES = ("_bucket", "_sum", "_count")
+
+
+def merge_families(bodies: Iterable[str]) -> str:
+    """Merge several exposition bodies so every family appears once: its # HELP
+    and # TYPE lines, then the samples of all bodies together (the text format
+    requires a family's samples to be contiguous)."""
+    families: Dict[str, Dict[str, Any]] = {}
+
+    def family(name: str) -> Dict[str, Any]:
+        return families.setdefault(name, {"comments": [], "samples": []})
+
+    for body in bodies:
+        for line in body.splitlines():
+            m = _LINE.match(line)
+            if not m:
+                continue
+            comment, name, _, _ = m.groups()
+            if comment:
+                entry = family(name)
+                if line not in entry["comments"]:
+                    entry["comments"].append(line)
+                continue
+            if name not in families:
+                # Histogram/summary samples belong to the family their TYPE line named
+                for suffix in _SAMPLE_SUFFIXES:
+                    if name.endswith(suffix) and name[:-len(suffix)] in families:
+                        name = name[:-len(suffix)]
+                        break
+            family(name)["samples"].append(line)
+    return "\n".join(line for entry in families.values() for line in entry["comments"] + entry["samples"])
+
+
+async def scrape_all_llamacpp(base_urls: Iterable[str] = LLAMACPP_BASE_URLS) -> str:
+    """Scrape every backend concurrently and merge the families (see merge_families)."""
+    bodies = await asyncio.gather(*(scrape_llamacpp(url) for url in base_urls))
+    return merge_families(bodies)
+
+
+def render() -> str:
+    return "\n".join(m.render() for m in _REGISTRY) + "\n"
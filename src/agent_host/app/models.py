@@ -8,6 +8,14 @@ class ChatRequest(BaseModel):
     stream: bool = True
     tools: Optional[List[str]] = None  # which tools allowed this turn
     tool_calls_allowed: bool = True
+    profile: bool = False  # sample this turn's stacks and return a collapsed-stack file
+    # Sampling overrides; temperature 0 or a fixed seed makes the turn cacheable (COMPLETION_CACHE)
+    temperature: Optional[float] = None
+    seed: Optional[int] = None
+
+class BatchChatRequest(BaseModel):
+    requests: List[ChatRequest]
+    max_concurrency: Optional[int] = None  # capped at LLAMACPP_SLOTS
 
 class ChatChunk(BaseModel):
     token: str
@@ -22,6 +30,8 @@ class ChatMessage(BaseModel):
     content: str
     created_at: datetime
     updated_at: datetime
+    truncated: bool = False  # generation was cut off (client disconnected)
+    seq: int = 0  # change sequence number; 0 for records older than sequencing
 
 class ChatMessagePatch(BaseModel):
     role: Optional[str] = None
@@ -0,0 +1,41 @@
+"""Constraints that make llama.cpp emit only well-formed tool calls.
+
+The schema accepts exactly the `{"name": ..., "payload": ...}` objects of the
+TOOL_CALL convention, one branch per registered tool, so both the tool name and
+its payload are checked during sampling. llama-server compiles it to a GBNF
+grammar itself; here it is only rebuilt when the registry changes.
+"""
+from typing import Any, Dict, Optional, Tuple
+
+from . import tools as tool_registry
+
+TOOL_CALL_MARKER = "TOOL_CALL:"
+
+_schema_cache: Optional[Tuple[int, Dict[str, Any]]] = None
+
+
+def tool_call_schema() -> Dict[str, Any]:
+    """JSON schema matching any valid call to a registered tool (cached per registry version)."""
+    global _schema_cache
+    version = tool_registry.registry_version()
+    if _schema_cache is not None and _schema_cache[0] == version:
+        return _schema_cache[1]
+    branches = []
+    for spec in tool_registry.TOOLS.values():
+        branches.append({
+            "type": "object",
+            "properties": {
+                "name": {"const": spec.name},
+                "payload": spec.schema,
+            },
+            "required": ["name", "payload"],
+            "additionalProperties": False,
+        })
+    schema = {"oneOf": branches}
+    _schema_cache = (version, schema)
+    return schema
+
+
+def tool_call_response_format() -> Dict[str, Any]:
+    """`response_format` for /v1/chat/completions that constrains output to one tool call."""
+    return {"type": "json_schema", "json_schema": {"name": "tool_call", "schema": tool_call_schema()}}
@@ -1,13 +1,30 @@
 import os
 import json
+import tempfile
+import threading
+from collections import OrderedDict, deque
 from datetime import datetime
-from typing import Any, Dict, List
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
 from uuid import uuid4
 
+from ..config import HISTORY_CACHE_AGENTS, HISTORY_CACHE_WINDOW
+from ..metrics import HISTORY_CACHE_REQUESTS
+from . import history_index
+
+def _hist_file(root: str, agent_id: str) -> str:
+    return os.path.join(root, agent_id, "chat_history.jsonl")
+
 def _hist_path(root: str, agent_id: str) -> str:
-    base = os.path.join(root, agent_id)
-    os.makedirs(base, exist_ok=True)
-    return os.path.join(base, "chat_history.jsonl")
+    os.makedirs(os.path.join(root, agent_id), exist_ok=True)
+    return _hist_file(root, agent_id)
+
+# Sidecar files: the last change sequence number handed out, and the ids of
+# deleted records with the sequence number of their deletion
+def _seq_file(root: str, agent_id: str) -> str:
+    return os.path.join(root, agent_id, "chat_history.seq")
+
+def _tombstone_file(root: str, agent_id: str) -> str:
+    return os.path.join(root, agent_id, "chat_history.tombstones.jsonl")
 
 def _now_ts() -> str:
     return datetime.utcnow().isoformat() + "Z"
@@ -28,33 +45,270 @@ def _normalize_record(raw: Dict[str, Any]) -> Dict[str, Any]:
     return record
 
 def _read_records(path: str) -> List[Dict[str, Any]]:
+    if not os.path.exists(path):
+        return []
+    with open(path, "r", encoding="utf-8") as f:
+        return _parse_lines(f)
+
+def _parse_offsets(f, offset: int = 0) -> Iterator[Tuple[int, Dict[str, Any]]]:
+    """(byte offset, record) for each complete line of a binary file handle from
+    `offset` on; a trailing line still being written is left unread."""
+    f.seek(offset)
+    while True:
+        line = f.readline()
+        if not line.endswith(b"\n"):
+            f.seek(offset)
+            return
+        start, offset = offset, offset + len(line)
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = _normalize_record(json.loads(line))
+        except Exception:
+            continue
+        yield start, record
+
+def _parse_lines(lines) -> List[Dict[str, Any]]:
     records: List[Dict[str, Any]] = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+            record = _normalize_record(obj)
+        except Exception:
+            continue
+        records.append(record)
+    return records
+
+# ===== Recent-window cache =====
+# The last HISTORY_CACHE_WINDOW records per (root, agent_id), LRU-bounded to
+# HISTORY_CACHE_AGENTS agents. Each window keeps the stat signature of the file it
+# mirrors; append_turn extends it in place, anything else that changes the file
+# makes the next read reload it.
+
+class _Turn:
+    __slots__ = ("message_id", "role", "content", "created_at", "updated_at", "extra")
+
+    def __init__(self, record: Dict[str, Any]):
+        self.message_id = record["message_id"]
+        self.role = record["role"]
+        self.content = record["content"]
+        self.created_at = record["created_at"]
+        self.updated_at = record["updated_at"]
+        extra = {k: v for k, v in record.items() if k not in _Turn.__slots__}
+        self.extra = extra or None
+
+    def as_dict(self) -> Dict[str, Any]:
+        record = {
+            "message_id": self.message_id,
+            "role": self.role,
+            "content": self.content,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+        if self.extra:
+            record.update(self.extra)
+        return record
+
+
+class _Window:
+    __slots__ = ("signature", "turns")
+
+    def __init__(self, signature: Tuple[int, int, int], turns: Deque[_Turn]):
+        self.signature = signature
+        self.turns = turns
+
+
+_WINDOWS: "OrderedDict[Tuple[str, str], _Window]" = OrderedDict()
+_windows_lock = threading.Lock()
+
+def _signature(st: os.stat_result) -> Tuple[int, int, int]:
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+def _remember(key: Tuple[str, str], window: _Window) -> None:
+    with _windows_lock:
+        _WINDOWS[key] = window
+        _WINDOWS.move_to_end(key)
+        while len(_WINDOWS) > max(0, HISTORY_CACHE_AGENTS):
+            _WINDOWS.popitem(last=False)
+
+def _forget(root: str, agent_id: str) -> None:
+    with _windows_lock:
+        _WINDOWS.pop((root, agent_id), None)
+
+def invalidate(root: Optional[str] = None) -> None:
+    """Drop cached windows (for one root, or everything)."""
+    with _windows_lock:
+        if root is None:
+            _WINDOWS.clear()
+            return
+        for key in [k for k in _WINDOWS if k[0] == root]:
+            del _WINDOWS[key]
+
+def _recent(root: str, agent_id: str, count: int) -> Optional[List[Dict[str, Any]]]:
+    """The last `count` records from the cached window, reloading it if the file
+    changed. None when the window is too small to answer."""
+    if count > HISTORY_CACHE_WINDOW or HISTORY_CACHE_AGENTS <= 0:
+        return None
+    key = (root, agent_id)
+    path = _hist_file(root, agent_id)
+    try:
+        sig = _signature(os.stat(path))
+    except FileNotFoundError:
+        _forget(root, agent_id)
+        return []
+    with _windows_lock:
+        window = _WINDOWS.get(key)
+        if window is not None and window.signature == sig:
+            _WINDOWS.move_to_end(key)
+            turns = list(window.turns)[-count:] if count > 0 else []
+            HISTORY_CACHE_REQUESTS.inc(result="hit")
+            return [t.as_dict() for t in turns]
+    HISTORY_CACHE_REQUESTS.inc(result="miss")
+    with open(path, "r", encoding="utf-8") as f:
+        sig = _signature(os.fstat(f.fileno()))
+        records = _parse_lines(f)
+    window = _Window(sig, deque((_Turn(r) for r in records), maxlen=HISTORY_CACHE_WINDOW))
+    _remember(key, window)
+    return records[-count:] if count > 0 else []
+
+# ===== Change sequence =====
+# Every append, update and delete made through this module takes the next
+# per-agent sequence number, so clients can ask for what changed since the last
+# number they saw. Records written before sequencing existed count as seq 0.
+
+_seq_lock = threading.Lock()
+
+def _read_tombstones(root: str, agent_id: str) -> List[Dict[str, Any]]:
+    path = _tombstone_file(root, agent_id)
     if not os.path.exists(path):
-        return records
+        return []
+    tombstones = []
     with open(path, "r", encoding="utf-8") as f:
         for line in f:
-            line = line.strip()
-            if not line:
-                continue
             try:
-                obj = json.loads(line)
-                record = _normalize_record(obj)
-            except Exception:
+                tombstones.append(json.loads(line))
+            except ValueError:
                 continue
-            records.append(record)
-    return records
+    return tombstones
+
+def current_seq(root: str, agent_id: str) -> int:
+    try:
+        with open(_seq_file(root, agent_id), "r", encoding="utf-8") as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        pass
+    # No usable counter (missing, empty or garbled): start from whatever the
+    # files already carry, so numbers are never handed out twice
+    seqs = [int(r.get("seq") or 0) for r in _read_records(_hist_file(root, agent_id))]
+    seqs += [int(t.get("seq") or 0) for t in _read_tombstones(root, agent_id)]
+    return max(seqs, default=0)
+
+def _next_seq(root: str, agent_id: str) -> int:
+    # _seq_lock assumes one process writes an agent's history; the rename
+    # keeps readers from ever seeing a truncated counter
+    with _seq_lock:
+        seq = current_seq(root, agent_id) + 1
+        path = _seq_file(root, agent_id)
+        fd, tmp_path = tempfile.mkstemp(prefix=".seq.", suffix=".tmp", dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(str(seq))
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+    return seq
+
+def _add_tombstones(root: str, agent_id: str, message_ids: List[str], seq: int) -> None:
+    if not message_ids:
+        return
+    with open(_tombstone_file(root, agent_id), "a", encoding="utf-8") as f:
+        for message_id in message_ids:
+            f.write(json.dumps({"message_id": message_id, "seq": seq, "deleted_at": _now_ts()}) + "\n")
+
+def state_token(root: str, agent_id: str) -> str:
+    """Changes whenever the history, its counter or its tombstones change; for ETags."""
+    parts = []
+    for path in (_hist_file(root, agent_id), _seq_file(root, agent_id), _tombstone_file(root, agent_id)):
+        try:
+            parts.append("%x.%x.%x" % _signature(os.stat(path)))
+        except FileNotFoundError:
+            parts.append("-")
+    return "-".join(parts)
+
+def load_page(root: str, agent_id: str, before: Optional[str] = None, after: Optional[str] = None,
+              limit: Optional[int] = None) -> Tuple[List[Dict[str, Any]], bool]:
+    """A slice of the history in file order, plus whether more records lie beyond it.
+
+    `before`/`after` are message_id cursors (exclusive); without either the
+    newest `limit` records are returned. Raises KeyError for an unknown cursor.
+    """
+    if before is None and after is None and limit is not None:
+        recent = _recent(root, agent_id, limit + 1)
+        if recent is not None:
+            return recent[-limit:], len(recent) > limit
+    records = load_all_turns(root, agent_id)
+    if after is not None:
+        index = _index_of(records, after)
+        page = records[index + 1:]
+        if limit is not None and len(page) > limit:
+            return page[:limit], True
+        return page, False
+    if before is not None:
+        records = records[:_index_of(records, before)]
+    if limit is not None and len(records) > limit:
+        return records[-limit:], True
+    return records, False
+
+def _index_of(records: List[Dict[str, Any]], message_id: str) -> int:
+    for index, rec in enumerate(records):
+        if rec["message_id"] == message_id:
+            return index
+    raise KeyError(message_id)
+
+def changes_since(root: str, agent_id: str, since: int) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """Records appended or updated after `since`, and ids deleted after it."""
+    if since >= current_seq(root, agent_id):
+        return [], []
+    changed = [r for r in load_all_turns(root, agent_id) if int(r.get("seq") or 0) > since]
+    deleted = [t["message_id"] for t in _read_tombstones(root, agent_id) if int(t.get("seq") or 0) > since]
+    return changed, deleted
 
 def load_all_turns(root: str, agent_id: str) -> List[Dict[str, Any]]:
     path = _hist_path(root, agent_id)
     return _read_records(path)
 
 def load_history(root: str, agent_id: str, max_pairs: int = 20) -> List[Dict[str, Any]]:
+    recent = _recent(root, agent_id, 2 * max_pairs)
+    if recent is not None:
+        return recent
     records = load_all_turns(root, agent_id)
     if len(records) > 2 * max_pairs:
         records = records[-2 * max_pairs:]
     return records
 
-def append_turn(root: str, agent_id: str, role: str, content: str, *, message_id: str | None = None) -> Dict[str, Any]:
+def recently_active(root: str, limit: int) -> List[str]:
+    """Agents with chat history, most recently written first."""
+    if not os.path.isdir(root):
+        return []
+    active: List[Tuple[int, str]] = []
+    for agent_id in os.listdir(root):
+        try:
+            active.append((os.stat(_hist_file(root, agent_id)).st_mtime_ns, agent_id))
+        except OSError:
+            continue
+    active.sort(reverse=True)
+    return [agent_id for _, agent_id in active[:limit]]
+
+def append_turn(root: str, agent_id: str, role: str, content: str, *, message_id: str | None = None,
+                **fields: Any) -> Dict[str, Any]:
     path = _hist_path(root, agent_id)
     ts = _now_ts()
     record = {
@@ -63,20 +317,80 @@ def append_turn(root: str, agent_id: str, role: str, content: str, *, message_id
         "content": content,
         "created_at": ts,
         "updated_at": ts,
+        "seq": _next_seq(root, agent_id),
+        **fields,
     }
+    key = (root, agent_id)
     with open(path, "a", encoding="utf-8") as f:
+        before = _signature(os.fstat(f.fileno()))
         f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        f.flush()
+        after = _signature(os.fstat(f.fileno()))
+    with _windows_lock:
+        window = _WINDOWS.get(key)
+        if window is not None:
+            if window.signature == before:
+                # Only our own append happened since the window was read
+                window.turns.append(_Turn(record))
+                window.signature = after
+            else:
+                del _WINDOWS[key]
+    # Appended at the old end of the file
+    _sync_index(root, agent_id, before, after, lambda index: index.add(record, before[1]))
     return record
 
-def write_all(root: str, agent_id: str, msgs: List[Dict[str, Any]]):
-    path = _hist_path(root, agent_id)
-    with open(path, "w", encoding="utf-8") as f:
+def _sync_index(root: str, agent_id: str, before: Tuple[int, int, int], after: Tuple[int, int, int],
+                apply: Callable[[history_index.HistoryIndex], None]) -> None:
+    """Apply our own change to a built search index, or drop it if the file had
+    changed under it."""
+    index = history_index.cached(root, agent_id)
+    if index is None:
+        return
+    if index.signature == before:
+        apply(index)
+        index.signature = after
+    else:
+        history_index.drop(root, agent_id)
+
+def _write_records(path: str, msgs: List[Dict[str, Any]]) -> Dict[str, int]:
+    """Write the whole file; returns each record's byte offset by message_id."""
+    offsets: Dict[str, int] = {}
+    offset = 0
+    with open(path, "wb") as f:
         for m in msgs:
             record = _normalize_record(m)
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+            f.write(line)
+            offsets[record["message_id"]] = offset
+            offset += len(line)
+    return offsets
+
+def write_all(root: str, agent_id: str, msgs: List[Dict[str, Any]]):
+    path = _hist_path(root, agent_id)
+    _forget(root, agent_id)
+    history_index.drop(root, agent_id)
+    _write_records(path, msgs)
+
+def _rewrite(root: str, agent_id: str, path: str, records: List[Dict[str, Any]], before: Tuple[int, int, int],
+             apply: Callable[[history_index.HistoryIndex, Dict[str, int]], None]) -> None:
+    _forget(root, agent_id)
+    offsets = _write_records(path, records)
+
+    def rewritten(index: history_index.HistoryIndex) -> None:
+        apply(index, offsets)
+        index.relocate(offsets)
+
+    _sync_index(root, agent_id, before, _signature(os.stat(path)), rewritten)
+
+def _stat_or_none(path: str) -> Optional[Tuple[int, int, int]]:
+    try:
+        return _signature(os.stat(path))
+    except FileNotFoundError:
+        return None
 
 def update_turn(root: str, agent_id: str, message_id: str, patch: Dict[str, Any]) -> bool:
     path = _hist_path(root, agent_id)
+    before = _stat_or_none(path)
     records = _read_records(path)
     updated = False
     for rec in records:
@@ -86,21 +400,71 @@ def update_turn(root: str, agent_id: str, message_id: str, patch: Dict[str, Any]
                     continue
                 rec[key] = value
             rec["updated_at"] = _now_ts()
+            rec["seq"] = _next_seq(root, agent_id)
             updated = True
             break
     if updated:
-        write_all(root, agent_id, records)
+        changed = next(rec for rec in records if rec["message_id"] == message_id)
+        _rewrite(root, agent_id, path, records, before,
+                 lambda index, offsets: index.add(changed, offsets[message_id]))
     return updated
 
 def delete_turn(root: str, agent_id: str, message_id: str) -> bool:
     path = _hist_path(root, agent_id)
+    before = _stat_or_none(path)
     records = _read_records(path)
     new_records = [rec for rec in records if rec["message_id"] != message_id]
     if len(new_records) == len(records):
         return False
-    write_all(root, agent_id, new_records)
+    _rewrite(root, agent_id, path, new_records, before, lambda index, offsets: index.remove(message_id))
+    _add_tombstones(root, agent_id, [message_id], _next_seq(root, agent_id))
     return True
 
 def clear_history(root: str, agent_id: str):
     path = _hist_path(root, agent_id)
+    cleared = [rec["message_id"] for rec in _read_records(path)]
+    _forget(root, agent_id)
+    history_index.drop(root, agent_id)
     open(path, "w", encoding="utf-8").close()
+    if cleared:
+        _add_tombstones(root, agent_id, cleared, _next_seq(root, agent_id))
+
+def search(root: str, agent_id: str, query: str, k: int = 10, role: Optional[str] = None,
+           since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Ranked full-text search over an agent's history (see history_index)."""
+    path = _hist_file(root, agent_id)
+    sig = _stat_or_none(path)
+    if sig is None:
+        return []
+    index = history_index.cached(root, agent_id)
+    if index is None or index.signature != sig:
+        # One build per agent at a time; concurrent searches wait for it
+        with _build_lock(root, agent_id):
+            index = history_index.cached(root, agent_id)
+            if index is None or index.signature != _stat_or_none(path):
+                index = _build_index(root, agent_id, path)
+    else:
+        history_index.touch(root, agent_id)
+    return index.search(query, k=k, role=role, since=since, until=until)
+
+_build_locks: Dict[Tuple[str, str], threading.Lock] = {}
+
+def _build_lock(root: str, agent_id: str) -> threading.Lock:
+    with _windows_lock:
+        return _build_locks.setdefault((root, agent_id), threading.Lock())
+
+def _build_index(root: str, agent_id: str, path: str) -> history_index.HistoryIndex:
+    """Index the whole file. Turns appended while it is read are picked up
+    before the index is published, so a busy agent does not rebuild forever."""
+    with open(path, "rb") as f:
+        index = history_index.HistoryIndex(path=path)
+        end = 0
+        for _ in range(3):
+            for offset, record in _parse_offsets(f, end):
+                index.add(record, offset)
+            end = f.tell()
+            index.signature = _signature(os.fstat(f.fileno()))
+            if index.signature[1] == end:
+                break
+    history_index.store(root, agent_id, index)
+    return index
@@ -0,0 +1,244 @@
+"""In-memory inverted index over an agent's chat history.
+
+Built from chat_history.jsonl the first time an agent is searched, then kept up
+to date by history.py as turns are appended, updated and deleted. Like the
+recent-history window, each index remembers the stat signature of the file it
+mirrors, so an edit made outside history.py triggers a rebuild on the next search.
+
+Only postings and each message's byte offset in the file are held in memory;
+result snippets are read back from the file. Removed messages leave their
+postings behind until they make up a quarter of the index, then the postings
+are compacted.
+
+Ranking is BM25. Terms found in a large share of the history (HISTORY_INDEX_COMMON)
+only add to the score of documents matched by rarer terms, and at most
+HISTORY_INDEX_CANDIDATES documents (newest postings first) are scored, so a
+query stays in the millisecond range even at millions of messages.
+"""
+import heapq
+import json
+import math
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from ..config import HISTORY_INDEX_AGENTS
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+K1 = 1.2
+B = 0.75
+HISTORY_INDEX_COMMON = 0.05  # share of documents above which a term is not used to find candidates
+HISTORY_INDEX_CANDIDATES = 2000  # documents scored per query at most
+SNIPPET_CHARS = 160
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class _Doc:
+    __slots__ = ("message_id", "role", "created_at", "offset", "length")
+
+    def __init__(self, message_id: str, role: str, created_at: str, offset: int, length: int):
+        self.message_id = message_id
+        self.role = role
+        self.created_at = created_at
+        self.offset = offset
+        self.length = length
+
+
+class HistoryIndex:
+    def __init__(self, signature: Optional[Tuple[int, int, int]] = None, path: Optional[str] = None):
+        self.signature = signature
+        self.path = path  # the JSONL file offsets point into; snippets are read from it
+        self._docs: Dict[int, _Doc] = {}
+        self._by_message: Dict[str, int] = {}
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._total_length = 0
+        self._next_doc = 0
+        self._stale = 0  # removed documents still present in postings
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, record: Dict[str, Any], offset: int) -> None:
+        """Index `record`, whose line starts at byte `offset` of the file."""
+        terms = tokenize(record.get("content") or "")
+        with self._lock:
+            self._remove(record["message_id"])
+            doc_id = self._next_doc
+            self._next_doc += 1
+            self._docs[doc_id] = _Doc(record["message_id"], record.get("role", ""),
+                                      record.get("created_at", ""), offset, len(terms))
+            self._by_message[record["message_id"]] = doc_id
+            self._total_length += len(terms)
+            for term in terms:
+                postings = self._postings.get(term)
+                if postings is None:
+                    postings = self._postings[term] = {}
+                postings[doc_id] = postings.get(doc_id, 0) + 1
+
+    def remove(self, message_id: str) -> None:
+        with self._lock:
+            self._remove(message_id)
+
+    def relocate(self, offsets: Dict[str, int]) -> None:
+        """New byte offsets by message_id, after the file was rewritten."""
+        with self._lock:
+            for message_id, offset in offsets.items():
+                doc_id = self._by_message.get(message_id)
+                if doc_id is not None:
+                    self._docs[doc_id].offset = offset
+
+    def _remove(self, message_id: str) -> None:
+        doc_id = self._by_message.pop(message_id, None)
+        if doc_id is None:
+            return
+        doc = self._docs.pop(doc_id)
+        self._total_length -= doc.length
+        self._stale += 1
+        if self._stale > 64 and self._stale * 4 > len(self._docs):
+            self._compact()
+
+    def _compact(self) -> None:
+        live = self._docs
+        for term in list(self._postings):
+            kept = {doc_id: tf for doc_id, tf in self._postings[term].items() if doc_id in live}
+            if kept:
+                self._postings[term] = kept
+            else:
+                del self._postings[term]
+        self._stale = 0
+
+    def search(self, query: str, k: int = 10, role: Optional[str] = None,
+               since: Optional[str] = None, until: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Top `k` messages for `query`, best first.
+
+        `since`/`until` are ISO timestamps or dates compared against created_at
+        (`since` inclusive, `until` exclusive); `role` keeps one speaker.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            n_docs = len(self._docs)
+            if not terms or not n_docs:
+                return []
+            lists = sorted(
+                ((term, self._postings[term]) for term in terms if term in self._postings),
+                key=lambda item: len(item[1]),
+            )
+            if not lists:
+                return []
+            avg_length = self._total_length / n_docs
+            idf = {
+                term: math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+                for term, postings in lists
+            }
+            # Candidates come from the rarer terms (the rarest one always counts),
+            # newest postings first, until HISTORY_INDEX_CANDIDATES are found
+            common = max(1, int(n_docs * HISTORY_INDEX_COMMON))
+            candidates: Dict[int, _Doc] = {}
+            for position, (_, postings) in enumerate(lists):
+                if position and len(postings) > common:
+                    break
+                for doc_id in reversed(postings):
+                    doc = self._docs.get(doc_id)
+                    if doc is not None:
+                        candidates[doc_id] = doc
+                        if len(candidates) >= HISTORY_INDEX_CANDIDATES:
+                            break
+                if len(candidates) >= HISTORY_INDEX_CANDIDATES:
+                    break
+
+            scored = []
+            for doc_id, doc in candidates.items():
+                if role is not None and doc.role != role:
+                    continue
+                if since is not None and doc.created_at < since:
+                    continue
+                if until is not None and doc.created_at >= until:
+                    continue
+                norm = K1 * (1 - B + B * doc.length / avg_length)
+                score = 0.0
+                for term, postings in lists:
+                    tf = postings.get(doc_id)
+                    if tf:
+                        score += idf[term] * tf * (K1 + 1) / (tf + norm)
+                scored.append((score, doc_id))
+            top = heapq.nlargest(k, scored)
+            docs = [(score, self._docs[doc_id]) for score, doc_id in top]
+        contents = self._read_contents([doc.offset for _, doc in docs])
+        return [
+            {
+                "message_id": doc.message_id,
+                "role": doc.role,
+                "created_at": doc.created_at,
+                "score": round(score, 4),
+                "snippet": snippet(content, terms),
+            }
+            for (score, doc), content in zip(docs, contents)
+        ]
+
+    def _read_contents(self, offsets: List[int]) -> List[str]:
+        """Message contents read back from the file ("" where a line is unreadable)."""
+        if self.path is None or not offsets:
+            return ["" for _ in offsets]
+        contents = []
+        try:
+            with open(self.path, "rb") as f:
+                for offset in offsets:
+                    f.seek(offset)
+                    try:
+                        contents.append(str(json.loads(f.readline()).get("content") or ""))
+                    except (ValueError, AttributeError):
+                        contents.append("")
+        except OSError:
+            return ["" for _ in offsets]
+        return contents
+
+
+def snippet(content: str, terms: List[str], width: int = SNIPPET_CHARS) -> str:
+    """A window of `content` around the first query term, with ellipses where cut."""
+    if len(content) <= width:
+        return content
+    pattern = re.compile(r"\b(" + "|".join(re.escape(t) for t in terms) + r")\b", re.IGNORECASE)
+    match = pattern.search(content)
+    center = match.start() if match else 0
+    start = max(0, min(center - width // 3, len(content) - width))
+    end = start + width
+    return ("…" if start > 0 else "") + content[start:end].strip() + ("…" if end < len(content) else "")
+
+
+# Indexes keyed by (root, agent_id), least recently searched evicted first
+_INDEXES: "OrderedDict[Tuple[str, str], HistoryIndex]" = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def cached(root: str, agent_id: str) -> Optional[HistoryIndex]:
+    with _indexes_lock:
+        return _INDEXES.get((root, agent_id))
+
+
+def store(root: str, agent_id: str, index: HistoryIndex) -> None:
+    with _indexes_lock:
+        _INDEXES[(root, agent_id)] = index
+        _INDEXES.move_to_end((root, agent_id))
+        while len(_INDEXES) > max(0, HISTORY_INDEX_AGENTS):
+            _INDEXES.popitem(last=False)
+
+
+def touch(root: str, agent_id: str) -> None:
+    with _indexes_lock:
+        if (root, agent_id) in _INDEXES:
+            _INDEXES.move_to_end((root, agent_id))
+
+
+def drop(root: str, agent_id: str) -> None:
+    with _indexes_lock:
+        _INDEXES.pop((root, agent_id), None)
+
+
+def invalidate() -> None:
+    with _indexes_lock:
+        _INDEXES.clear()
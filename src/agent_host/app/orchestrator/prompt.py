@@ -0,0 +1,128 @@
+"""System prompt compiler.
+
+The system prompt is split into sections that change at very different rates:
+
+- character: the profile's character and notes, re-rendered only when they change
+- tools: the tool-calling convention and catalog, rendered once per registry version
+- volatile: date/time, the only part that differs from turn to turn
+
+Static sections come first so consecutive turns share the longest possible
+prompt prefix, which is what llama.cpp's ``cache_prompt`` can reuse.
+"""
+import json
+import math
+from dataclasses import dataclass
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from . import tools as tool_registry
+from ..clients.llamacpp import tokenize
+
+CHARACTER_HEADER = """{character}.
+System-managed notes: {notes}\n"""
+TOOL_HEADER = """TOOL CALLING CONVENTION:
+- To call ANY tool, emit ONE line exactly:
+  TOOL_CALL: {{"name":"<toolname>","payload":{{ ... JSON matching schema ... }}}}
+- After tool results arrive (as a tool message), continue your answer.
+- If no tool is helpful, continue normally.
+
+AVAILABLE TOOLS:
+"""
+VOLATILE_HEADER = """Current date: {current_date}
+Current time: {current_time}\n"""
+
+# Exact token counts per section text, filled lazily from llama-server's /tokenize.
+_TOKEN_COUNTS: Dict[str, int] = {}
+_catalog_cache: Optional[Tuple[int, str]] = None
+
+
+def canonical_json(obj: Any) -> str:
+    """Compact JSON with sorted keys, so equal schemas always render identically."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) for budgeting without a round-trip."""
+    return math.ceil(len(text) / 4)
+
+
+@dataclass(frozen=True)
+class CompiledPrompt:
+    character: str
+    tools: str
+    volatile: str
+
+    @property
+    def text(self) -> str:
+        return "\n".join(part for part in (self.character, self.tools, self.volatile) if part)
+
+    @property
+    def static_prefix(self) -> str:
+        """Everything except the volatile section; stable across turns of one agent."""
+        return "\n".join(part for part in (self.character, self.tools) if part)
+
+    def sections(self) -> Dict[str, str]:
+        return {"character": self.character, "tools": self.tools, "volatile": self.volatile}
+
+    def token_lengths(self) -> Dict[str, int]:
+        """Per-section token counts: exact where already known, estimated otherwise."""
+        return {
+            name: _TOKEN_COUNTS.get(text, estimate_tokens(text))
+            for name, text in self.sections().items()
+        }
+
+    async def exact_token_lengths(self) -> Dict[str, int]:
+        """Per-section token counts from the model's tokenizer.
+
+        Static sections are tokenized once per distinct text; if llama-server is
+        unreachable the estimate is returned instead.
+        """
+        out: Dict[str, int] = {}
+        for name, text in self.sections().items():
+            count = _TOKEN_COUNTS.get(text)
+            if count is None:
+                try:
+                    count = len(await tokenize(text))
+                except Exception:
+                    count = estimate_tokens(text)
+                else:
+                    if name != "volatile":
+                        _TOKEN_COUNTS[text] = count
+            out[name] = count
+        return out
+
+
+def render_tool_catalog() -> str:
+    """Tool convention plus catalog, re-rendered only when the registry changes."""
+    global _catalog_cache
+    version = tool_registry.registry_version()
+    if _catalog_cache is not None and _catalog_cache[0] == version:
+        return _catalog_cache[1]
+    lines = [TOOL_HEADER]
+    for t in tool_registry.list_tools_for_prompt():
+        lines.append(
+            f"- {t['name']}\n  When: {t['description']}\n"
+            f"  Input JSON schema: {canonical_json(t['input_schema'])}"
+        )
+    rendered = "\n".join(lines)
+    _catalog_cache = (version, rendered)
+    return rendered
+
+
+@lru_cache(maxsize=1024)
+def render_character(character: str, notes: str) -> str:
+    return CHARACTER_HEADER.format(character=character, notes=notes)
+
+
+def compile_prompt(profile: Dict[str, Any], include_tools: bool = True,
+                   now: Optional[datetime] = None) -> CompiledPrompt:
+    now = now or datetime.now()
+    return CompiledPrompt(
+        character=render_character(profile["character"], profile["notes"]),
+        tools=render_tool_catalog() if include_tools else "",
+        volatile=VOLATILE_HEADER.format(
+            current_date=now.strftime("%Y-%m-%d"),
+            current_time=now.strftime("%H:%M:%S"),
+        ),
+    )
@@ -0,0 +1,169 @@
+"""Slot scheduler and batch turns.
+
+llama-server decodes at most `-np` sequences at once; anything beyond that
+waits in its own queue with no notion of which requests share a prompt. The
+scheduler hands out slot ids instead: at most LLAMACPP_SLOTS scheduled turns
+run at a time, and each is pinned (`id_slot`) to a slot, preferring the one
+that last served the same static prompt prefix so llama.cpp can reuse that
+slot's KV cache.
+
+`run_batch` runs many chat turns through the scheduler and yields each result
+as soon as it completes.
+"""
+import asyncio
+import hashlib
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Tuple
+
+from ..config import LLAMACPP_SLOTS
+from ..metrics import SCHEDULER_QUEUE_DEPTH, SCHEDULER_SLOTS_BUSY
+from .prompt import compile_prompt
+from .session import run_turn
+
+
+def prefix_key(profile: Dict[str, Any], include_tools: bool = True) -> str:
+    """Hash of the cacheable part of an agent's system prompt."""
+    static = compile_prompt(profile, include_tools=include_tools).static_prefix
+    return hashlib.sha1(static.encode("utf-8")).hexdigest()
+
+
+class SlotScheduler:
+    def __init__(self, slots: int = LLAMACPP_SLOTS):
+        self.slots = slots
+        self._free: List[int] = list(range(slots))
+        # (future resolved with the slot id, prefix key), in arrival order
+        self._waiters: Deque[Tuple[asyncio.Future, Optional[str]]] = deque()
+        # slot -> (prefix key it last served, when it was released)
+        self._last: Dict[int, Tuple[Optional[str], float]] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _pick(self, key: Optional[str]) -> int:
+        """A free slot that last held `key`, else the least recently used one."""
+        best = None
+        for slot in self._free:
+            last_key, last_used = self._last.get(slot, (None, 0.0))
+            if key is not None and last_key == key:
+                best = slot
+                break
+            if best is None or last_used < self._last.get(best, (None, 0.0))[1]:
+                best = slot
+        self._free.remove(best)
+        return best
+
+    async def acquire(self, key: Optional[str] = None) -> int:
+        """A slot id. Callers are served in arrival order: a freed slot goes to
+        the longest waiter, which then prefers a slot that last held its key."""
+        if self._free and not self._waiters:
+            SCHEDULER_SLOTS_BUSY.inc()
+            return self._pick(key)
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (waiter, key)
+        self._waiters.append(entry)
+        SCHEDULER_QUEUE_DEPTH.inc()
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._give_back(waiter.result())  # pass on the slot we were handed
+            raise
+        finally:
+            SCHEDULER_QUEUE_DEPTH.dec()
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+
+    def release(self, slot: int, key: Optional[str] = None) -> None:
+        self._last[slot] = (key, time.monotonic())
+        self._give_back(slot)
+
+    def _give_back(self, slot: int) -> None:
+        self._free.append(slot)
+        SCHEDULER_SLOTS_BUSY.dec()
+        self._wake_next()
+
+    def _wake_next(self) -> None:
+        while self._waiters and self._free:
+            waiter, key = self._waiters.popleft()
+            if not waiter.done():
+                SCHEDULER_SLOTS_BUSY.inc()
+                waiter.set_result(self._pick(key))
+
+    @asynccontextmanager
+    async def slot(self, key: Optional[str] = None) -> AsyncIterator[int]:
+        slot = await self.acquire(key)
+        try:
+            yield slot
+        finally:
+            self.release(slot, key)
+
+
+SCHEDULER = SlotScheduler()
+
+
+async def _run_one(index: int, profile: Dict[str, Any], req, key: str, scheduler: SlotScheduler,
+                   limit: asyncio.Semaphore, after: Optional[asyncio.Event], done: asyncio.Event) -> Dict[str, Any]:
+    try:
+        # Wait for the agent's previous turn before taking a slot
+        if after is not None:
+            await after.wait()
+        return await _run_turn(index, profile, req, key, scheduler, limit)
+    finally:
+        done.set()
+
+
+async def _run_turn(index: int, profile: Dict[str, Any], req, key: str,
+                    scheduler: SlotScheduler, limit: asyncio.Semaphore) -> Dict[str, Any]:
+    result: Dict[str, Any] = {"index": index, "agent_id": profile["agent_id"]}
+    async with limit, scheduler.slot(key) as slot:
+        started = time.perf_counter()
+        text = ""
+        tools: List[Dict[str, Any]] = []
+        try:
+            async for ev in run_turn(profile, req.user, allow_tools=req.tool_calls_allowed,
+                                     stream=False, slot_id=slot, temperature=req.temperature, seed=req.seed):
+                if ev["type"] == "token":
+                    text += ev["data"]
+                elif ev["type"] == "tool":
+                    tools.append(ev["data"])
+                elif ev["type"] == "done":
+                    result["done"] = ev["data"]
+        except Exception as exc:
+            print(f"Batch turn {index} for {profile['agent_id']} failed:", exc)
+            result.update(ok=False, error=f"{type(exc).__name__}: {exc}")
+            return result
+        result.update(ok=True, text=text, tools=tools, slot=slot,
+                      seconds=round(time.perf_counter() - started, 3))
+    return result
+
+
+async def run_batch(items: List[Tuple[int, Dict[str, Any], Any]], max_concurrency: Optional[int] = None,
+                    scheduler: SlotScheduler = SCHEDULER) -> AsyncIterator[Dict[str, Any]]:
+    """Run (index, profile, ChatRequest) items; yield results in completion order.
+
+    Items are started grouped by prompt prefix so turns that can share a slot's
+    KV cache run back to back on it. Turns for the same agent run one after
+    another in request order, since each reads the history the previous wrote.
+    """
+    limit = asyncio.Semaphore(max(1, min(max_concurrency or scheduler.slots, scheduler.slots)))
+    keyed = [(prefix_key(profile, include_tools=req.tool_calls_allowed), index, profile, req)
+             for index, profile, req in items]
+    # Chain each agent's turns in request order: (turn it waits for, its own completion)
+    last: Dict[str, asyncio.Event] = {}
+    chain: Dict[int, Tuple[Optional[asyncio.Event], asyncio.Event]] = {}
+    for index, profile, _ in items:
+        done = asyncio.Event()
+        chain[index] = (last.get(profile["agent_id"]), done)
+        last[profile["agent_id"]] = done
+    keyed.sort(key=lambda item: item[0])
+    tasks = [asyncio.create_task(_run_one(index, profile, req, key, scheduler, limit, *chain[index]))
+             for key, index, profile, req in keyed]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -1,106 +1,325 @@
-from datetime import datetime
-from typing import List, Dict, Any, AsyncGenerator
-from ..clients.llamacpp import stream_chat, nonstream_chat
-from .tools import TOOLS, list_tools_for_prompt
-from ..config import CHROMA_PERSIST_ROOT
+import asyncio
+import json
+from contextlib import aclosing, nullcontext
+from typing import List, Dict, Any, AsyncGenerator, Iterable, Iterator, Optional, Tuple
+from ..clients.llamacpp import stream_chat, nonstream_chat, native_tools_supported, NativeToolsUnsupported
+from .tools import TOOLS, bind_payload, list_tools_native, resolve_native_tool_name
+from .prompt import compile_prompt
+from .grammar import TOOL_CALL_MARKER, tool_call_response_format
+from .speculative import SpeculativePool
+from ..metrics import (
+    FOLLOWUP_SECONDS,
+    HISTORY_SECONDS,
+    PROMPT_BUILD_SECONDS,
+    SESSIONS_IN_FLIGHT,
+    TOOL_SECONDS,
+    TURNS_CANCELLED,
+    TURN_SECONDS,
+)
+from ..config import (
+    CHROMA_PERSIST_ROOT,
+    CONSTRAIN_TOOL_CALLS,
+    SPECULATIVE_PREFETCH,
+    SPECULATIVE_TOOLS,
+    TOOL_CALL_MODE,
+)
+from ..tracing import Span, Trace, record as record_trace
+from ..profiling import WATCHDOG, StackSampler, save_collapsed
 from . import history as H
 
 MAX_TURNS = 20  # pairs
+# Appended to an assistant reply that was cut off, so later turns (and the model) can tell
+TRUNCATED_MARKER = "\n[response interrupted]"
 
-SYS_HEADER = """{character}.
-System-managed notes: {notes}
-Current date: {current_date}
-Current time: {current_time}\n"""
-TOOL_HEADER = """TOOL CALLING CONVENTION:
-- To call ANY tool, emit ONE line exactly:
-  TOOL_CALL: {{"name":"<toolname>","payload":{{ ... JSON matching schema ... }}}}
-- After tool results arrive (as a tool message), continue your answer.
-- If no tool is helpful, continue normally.
-
-AVAILABLE TOOLS:
-"""
-
-def build_system_prompt(profile: Dict[str, Any]) -> str:
-    now = datetime.now()
-    head = SYS_HEADER.format(
-        character=profile["character"],
-        notes=profile["notes"],
-        current_date=now.strftime("%Y-%m-%d"),
-        current_time=now.strftime("%H:%M:%S"),
-    ) + TOOL_HEADER
-    lines = [head]
-    for t in list_tools_for_prompt():
-        lines.append(f"- {t['name']}\n  When: {t['description']}\n  Input JSON schema: {t['input_schema']}")
-    return "\n".join(lines)
-
-# Given a system output, handle all tool calls found within it. Returns list of tool names and tool messages.
-def run_tool(assistant_output: str) -> List[tuple[str, str]]:
-    import json
+def build_system_prompt(profile: Dict[str, Any], include_tools: bool = True) -> str:
+    return compile_prompt(profile, include_tools=include_tools).text
 
+def parse_tool_calls(assistant_output: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Yield (name, payload) for each TOOL_CALL in the text; raises on malformed JSON."""
+    matches = assistant_output.split(TOOL_CALL_MARKER)[1:]
+    for match in matches:
+        end = match.rfind('}')
+        match = match[:end+1] if end != -1 else None
+        spec = json.loads(match.strip())
+        yield spec["name"], spec.get("payload", {})
+
+def parse_native_tool_calls(tool_calls: List[Dict[str, Any]]) -> Iterator[Tuple[Optional[str], str, Dict[str, Any]]]:
+    """Yield (call_id, name, payload) for structured tool calls; raises on malformed arguments."""
+    for call in tool_calls:
+        fn = call.get("function") or {}
+        arguments = fn.get("arguments") or "{}"
+        payload = json.loads(arguments) if isinstance(arguments, str) else arguments
+        yield call.get("id"), resolve_native_tool_name(fn.get("name", "")), payload
+
+async def run_tools(calls: Iterable[Tuple[Optional[str], str, Dict[str, Any]]],
+                    pool: Optional[SpeculativePool] = None,
+                    trace: Optional[Trace] = None,
+                    agent_id: Optional[str] = None) -> List[tuple[Optional[str], str, str]]:
+    """Execute parsed tool calls in order. Returns (call_id, tool name, result) triples.
+
+    Calls run on behalf of `agent_id`, the session's agent (see tools.bind_payload).
+
+    A malformed call stops processing; results of the calls before it are kept.
+    """
     outputs = []
 
     try:
-        matches = assistant_output.split("TOOL_CALL:")[1:]
-        for match in matches:
-            print("current match: ", match, "\n\n")
-            end = match.rfind('}')
-            match = match[:end+1] if end != -1 else None
-            # Attempt to parse the JSON payload
-            spec = json.loads(match.strip())
-            name = spec["name"]
-            payload = spec.get("payload", {})
+        for call_id, name, payload in calls:
             if name in TOOLS:
-                result = TOOLS[name].handler(payload)
-                outputs.append((name, str(result)))
+                payload = bind_payload(name, payload, agent_id)
+                span = trace.span("tool", tool=name) if trace is not None else nullcontext()
+                with span, TOOL_SECONDS.time(tool=name):
+                    if pool is not None:
+                        result = await pool.call(name, payload)
+                    else:
+                        # Off the event loop, so concurrent sessions overlap (and share embedding batches)
+                        result = await asyncio.to_thread(TOOLS[name].handler, payload)
+                outputs.append((call_id, name, str(result)))
     except Exception as e:
         print("Error processing tool call:", e)
 
     return outputs
 
-async def run_turn(profile: Dict[str, Any], user_text: str, allow_tools=True, stream=True) -> AsyncGenerator[Dict[str, Any], None]:
+def _llm_attributes(span: Span, stats: Dict[str, Any]) -> None:
+    """Copy llama.cpp's prompt/cached/generated token counts onto an LLM span."""
+    timings = stats.get("timings") or {}
+    usage = stats.get("usage") or {}
+    counts = {
+        "prompt_tokens": timings.get("prompt_n", usage.get("prompt_tokens")),
+        "cached_tokens": timings.get("cache_n"),
+        "generated_tokens": timings.get("predicted_n", usage.get("completion_tokens")),
+        "prompt_ms": timings.get("prompt_ms"),
+        "decode_ms": timings.get("predicted_ms"),
+    }
+    span.attributes.update({k: v for k, v in counts.items() if v is not None})
+
+async def _constrained_tool_call(messages: List[Dict[str, Any]], prefix: str, trace: Trace,
+                                 **llm_options: Any) -> str:
+    """Complete the TOOL_CALL that `prefix` ends with, sampling only schema-valid calls."""
+    with trace.span("llm", phase="tool_call") as span:
+        stats: Dict[str, Any] = {}
+        out = await nonstream_chat(
+            messages + [{"role":"assistant","content":prefix}],
+            cache_prompt=True,
+            max_tokens=512,
+            response_format=tool_call_response_format(),
+            stats=stats,
+            **llm_options,
+        )
+        _llm_attributes(span, stats)
+    return out["text"]
+
+def _parses(assistant_output: str) -> bool:
+    try:
+        list(parse_tool_calls(assistant_output))
+    except Exception:
+        return False
+    return True
+
+async def _assistant_reply(messages: List[Dict[str, Any]], stream: bool,
+                           tool_calls: Optional[List[Dict[str, Any]]],
+                           constrain: bool, trace: Trace, **llm_options: Any) -> AsyncGenerator[str, None]:
+    """Generate one assistant message.
+
+    Passing `tool_calls` enables native tool calling. With `constrain`, a text-mode
+    TOOL_CALL is finished under the tool-call JSON schema instead of free sampling.
+    `llm_options` are passed through to every llama-server request (e.g. affinity, id_slot).
+    """
+    kwargs: Dict[str, Any] = dict(llm_options)
+    if tool_calls is not None:
+        kwargs["tools"] = list_tools_native()
+        constrain = False
+    stats: Dict[str, Any] = {}
+    with trace.span("llm", phase="reply", stream=stream) as span:
+        try:
+            if stream:
+                buffer = ""
+                toks = stream_chat(messages, cache_prompt=True, tool_calls=tool_calls, stats=stats, **kwargs)
+                async with aclosing(toks):
+                    async for tok in toks:
+                        if constrain:
+                            buffer += tok
+                            idx = buffer.find(TOOL_CALL_MARKER)
+                            if idx != -1:
+                                # Stop free generation right after the marker (closing the
+                                # upstream stream) and let the constrained request write the JSON.
+                                cut = idx + len(TOOL_CALL_MARKER)
+                                head = tok[:len(tok) - (len(buffer) - cut)]
+                                if head:
+                                    yield head
+                                yield await _constrained_tool_call(messages, buffer[:cut], trace, **llm_options)
+                                return
+                        yield tok
+            else:
+                out = await nonstream_chat(messages, cache_prompt=True, stats=stats, **kwargs)
+                if tool_calls is not None:
+                    tool_calls.extend(out["tool_calls"])
+                text = out["text"]
+                if constrain and TOOL_CALL_MARKER in text and not _parses(text):
+                    cut = text.index(TOOL_CALL_MARKER) + len(TOOL_CALL_MARKER)
+                    text = text[:cut] + await _constrained_tool_call(messages, text[:cut], trace, **llm_options)
+                yield text
+        finally:
+            _llm_attributes(span, stats)
+
+def _append(agent_id: str, role: str, content: str, trace: Trace, **fields: Any) -> None:
+    with trace.span("history.append", role=role), HISTORY_SECONDS.time(op="append"):
+        H.append_turn(CHROMA_PERSIST_ROOT, agent_id, role, content, **fields)
+
+async def prime_prompt(profile: Dict[str, Any], allow_tools: bool = True,
+                       slot_id: Optional[int] = None) -> Dict[str, Any]:
+    """Prefill the prompt an agent's next turn starts with (system + history)
+    without generating, so llama-server keeps it in a slot's KV cache."""
+    agent_id = profile.get("agent_id", "default")
+    native = allow_tools and TOOL_CALL_MODE == "native" and native_tools_supported()
+    messages: List[Dict[str, Any]] = [
+        {"role":"system","content":build_system_prompt(profile, include_tools=not native)}
+    ]
+    messages.extend({"role": m["role"], "content": m["content"]}
+                    for m in H.load_history(CHROMA_PERSIST_ROOT, agent_id, max_pairs=MAX_TURNS))
+    kwargs: Dict[str, Any] = {"affinity": agent_id}
+    if slot_id is not None:
+        kwargs["id_slot"] = slot_id
+    if native:
+        kwargs["tools"] = list_tools_native()
+    stats: Dict[str, Any] = {}
+    await nonstream_chat(messages, max_tokens=0, n_predict=0, cache_prompt=True, stats=stats, **kwargs)
+    return stats
+
+async def run_turn(profile: Dict[str, Any], user_text: str, allow_tools=True, stream=True,
+                   profile_stacks=False, slot_id: Optional[int] = None, temperature: Optional[float] = None,
+                   seed: Optional[int] = None) -> AsyncGenerator[Dict[str, Any], None]:
+    trace = Trace("turn", agent_id=profile.get("agent_id", "default"), stream=stream)
+    # profile_stacks samples this turn explicitly; the watchdog only starts once it runs long
+    sampler = StackSampler().start() if profile_stacks else None
+    watched = WATCHDOG.begin(trace.trace_id)
+    SESSIONS_IN_FLIGHT.inc()
+    try:
+        with TURN_SECONDS.time():
+            # aclosing: if we are closed or cancelled, the inner turn (and its
+            # upstream llama-server stream) is closed right away, not at GC time
+            async with aclosing(_run_turn(profile, user_text, allow_tools, stream, trace, slot_id,
+                                             temperature, seed)) as events:
+                async for ev in events:
+                    if ev["type"] == "done" and sampler is not None:
+                        sampler.stop()
+                        path = save_collapsed(sampler.collapsed(), f"turn-{trace.trace_id}")
+                        ev["data"]["profile"] = {"path": path, "samples": sampler.samples}
+                    yield ev
+    except (asyncio.CancelledError, GeneratorExit):
+        TURNS_CANCELLED.inc()
+        trace.root.attributes["cancelled"] = True
+        trace.finish()
+        record_trace(trace)
+        raise
+    finally:
+        SESSIONS_IN_FLIGHT.dec()
+        if sampler is not None:
+            sampler.stop()
+        WATCHDOG.end(watched)
+
+async def _run_turn(profile: Dict[str, Any], user_text: str, allow_tools: bool, stream: bool,
+                    trace: Trace, slot_id: Optional[int] = None, temperature: Optional[float] = None,
+                    seed: Optional[int] = None) -> AsyncGenerator[Dict[str, Any], None]:
     agent_id = profile.get("agent_id", "default")
-    system_prompt = build_system_prompt(profile)
+    # Keep the agent on one backend, and the turn on the scheduler's slot, so KV cache is reused
+    llm_options: Dict[str, Any] = {"affinity": agent_id}
+    if slot_id is not None:
+        llm_options["id_slot"] = slot_id
+    if temperature is not None:
+        llm_options["temperature"] = temperature
+    if seed is not None:
+        llm_options["seed"] = seed
+    native = allow_tools and TOOL_CALL_MODE == "native" and native_tools_supported()
+    constrain = allow_tools and CONSTRAIN_TOOL_CALLS
+    pool = None
+    if allow_tools and SPECULATIVE_PREFETCH and user_text != "<none>":
+        pool = SpeculativePool(agent_id, user_text, SPECULATIVE_TOOLS)
+    with trace.span("prompt_build", native_tools=native), PROMPT_BUILD_SECONDS.time():
+        system_prompt = build_system_prompt(profile, include_tools=not native)
 
-    # Reload history from disk so external edits are respected
-    hist_records = H.load_history(CHROMA_PERSIST_ROOT, agent_id, max_pairs=MAX_TURNS)
+    # Served from the in-memory window; a stat still catches external edits
+    with trace.span("history.load") as span, HISTORY_SECONDS.time(op="load"):
+        hist_records = H.load_history(CHROMA_PERSIST_ROOT, agent_id, max_pairs=MAX_TURNS)
+        span.attributes["records"] = len(hist_records)
 
     # Build messages for the model: system + (disk history + this user)
-    messages: List[Dict[str, str]] = [{"role":"system","content":system_prompt}]
+    messages: List[Dict[str, Any]] = [{"role":"system","content":system_prompt}]
     messages.extend({"role": m["role"], "content": m["content"]} for m in hist_records)
     if user_text != "<none>":
         messages.append({"role":"user","content":user_text})
-        H.append_turn(CHROMA_PERSIST_ROOT, agent_id, "user", user_text)
+        _append(agent_id, "user", user_text, trace)
 
     # === Assistant response phase ===
+    done_data: Dict[str, Any] = {}
     assist_buffer = ""
-    if stream:
-        async for tok in stream_chat(messages, cache_prompt=True):  # see §3
-            # Try to split by lines to detect TOOL_CALL; keep residual
-            assist_buffer += tok
-            yield {"type":"token","data":tok}
-    else:
-        out = await nonstream_chat(messages, cache_prompt=True)
-        assist_buffer = out["text"]
-        yield {"type":"token","data":assist_buffer}
-
-    H.append_turn(CHROMA_PERSIST_ROOT, agent_id, "assistant", assist_buffer)
-    messages.append({"role":"assistant","content":assist_buffer})
+    native_calls: List[Dict[str, Any]] = []
+    try:
+        try:
+            reply = _assistant_reply(messages, stream, native_calls if native else None, constrain, trace,
+                                     **llm_options)
+            async with aclosing(reply):
+                async for tok in reply:
+                    assist_buffer += tok
+                    yield {"type":"token","data":tok}
+        except NativeToolsUnsupported:
+            # Rejected before any token was produced: redo the turn with the text convention
+            native = False
+            messages[0] = {"role":"system","content":build_system_prompt(profile)}
+            reply = _assistant_reply(messages, stream, None, constrain, trace, **llm_options)
+            async with aclosing(reply):
+                async for tok in reply:
+                    assist_buffer += tok
+                    yield {"type":"token","data":tok}
+    except (asyncio.CancelledError, GeneratorExit):
+        # The client went away mid-reply. Closing the reply above already closed the
+        # llama-server stream (freeing its slot); keep what was generated, marked as
+        # cut off, and skip the tool and follow-up phases.
+        _append(agent_id, "assistant", assist_buffer + TRUNCATED_MARKER, trace, truncated=True)
+        if pool is not None:
+            pool.close()
+        raise
+
+    _append(agent_id, "assistant", assist_buffer, trace)
+    assistant_msg: Dict[str, Any] = {"role":"assistant","content":assist_buffer}
+    if native_calls:
+        assistant_msg["tool_calls"] = native_calls
+    messages.append(assistant_msg)
 
     # === Tool handling phase ===
     if allow_tools:
-        tool_outputs = run_tool(assist_buffer)
+        if native:
+            calls = parse_native_tool_calls(native_calls)
+        else:
+            calls = ((None, name, payload) for name, payload in parse_tool_calls(assist_buffer))
+        try:
+            tool_outputs = await run_tools(calls, pool, trace, agent_id)
+        finally:
+            if pool is not None:
+                pool.close()
+        if pool is not None:
+            done_data["speculative"] = pool.summary()
         if tool_outputs:
-            for name, result in tool_outputs:
-                H.append_turn(CHROMA_PERSIST_ROOT, agent_id, "tool", f"{name} -> {result}")
-                messages.append({"role":"tool", "content":f"{name} -> {result}"})
+            for call_id, name, result in tool_outputs:
+                _append(agent_id, "tool", f"{name} -> {result}", trace)
+                if call_id is not None:
+                    messages.append({"role":"tool", "tool_call_id":call_id, "content":result})
+                else:
+                    messages.append({"role":"tool", "content":f"{name} -> {result}"})
                 yield {"type":"tool","data": {"Tool name": name, "Tool result": result}}
             # After tool calls, we could have the assistant continue
-            followup_out = await nonstream_chat(
-                messages,
-                cache_prompt=True
-            )
+            with trace.span("llm", phase="followup") as span, FOLLOWUP_SECONDS.time():
+                stats: Dict[str, Any] = {}
+                followup_out = await nonstream_chat(
+                    messages,
+                    cache_prompt=True,
+                    stats=stats,
+                    **llm_options,
+                    **({"tools": list_tools_native()} if native else {})
+                )
+                _llm_attributes(span, stats)
             followup_text = followup_out["text"]
-            H.append_turn(CHROMA_PERSIST_ROOT, agent_id, "assistant", followup_text)
+            _append(agent_id, "assistant", followup_text, trace)
             messages.append({"role":"assistant","content":followup_text})
             yield {"type":"token","data":followup_text}
 
@@ -128,6 +347,9 @@ async def run_turn(profile: Dict[str, Any], user_text: str, allow_tools=True, st
     #         except Exception:
     #             pass
 
-    yield {"type":"done","data":{}}
+    trace.finish()
+    done_data["trace"] = trace.summary()
+    record_trace(trace)
+    yield {"type":"done","data":done_data}
 
     
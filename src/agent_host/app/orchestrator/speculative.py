@@ -0,0 +1,89 @@
+"""Speculative tool prefetching.
+
+While the first generation of a turn is streaming, likely tool calls are
+started in worker threads using the user's own text as the query. If the model
+then asks for a call with an equivalent payload, the already running (or
+finished) result is used instead of starting from scratch. Whatever the model
+did not ask for is cancelled at the end of the turn.
+
+Cancellation only drops the pending result: a handler already running in a
+worker thread finishes in the background.
+"""
+import asyncio
+from typing import Any, Callable, Dict, List, Tuple
+
+from .prompt import canonical_json
+from .tools import TOOLS, bind_payload
+
+# How to guess each tool's payload from the user's text. Payloads are bound to
+# the session's agent like the model's own calls, so both sides key the same.
+# memory.retrieve only applies when a tool by that name is registered.
+PREFETCHERS: Dict[str, Callable[[str], Dict[str, Any]]] = {
+    "memory.retrieve": lambda text: {"query": text},
+    "duckduckgo.search": lambda text: {"query": text},
+}
+
+# Process-wide counters, exported alongside each turn's own figures
+STATS: Dict[str, int] = {"prefetched": 0, "hits": 0, "misses": 0, "cancelled": 0}
+
+
+def _key(name: str, payload: Dict[str, Any]) -> Tuple[str, str]:
+    """Identity of a call: schema defaults filled in, strings case/space-normalized."""
+    spec = TOOLS.get(name)
+    props = (spec.schema.get("properties") or {}) if spec else {}
+    merged = {k: v["default"] for k, v in props.items() if isinstance(v, dict) and "default" in v}
+    merged.update(payload)
+    norm = {k: " ".join(v.lower().split()) if isinstance(v, str) else v for k, v in merged.items()}
+    return name, canonical_json(norm)
+
+
+def hit_rate() -> float:
+    asked = STATS["hits"] + STATS["misses"]
+    return STATS["hits"] / asked if asked else 0.0
+
+
+class SpeculativePool:
+    def __init__(self, agent_id: str, user_text: str, tool_names: List[str]):
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.cancelled = 0
+        for name in tool_names:
+            if name not in TOOLS or name not in PREFETCHERS:
+                continue
+            payload = bind_payload(name, PREFETCHERS[name](user_text), agent_id)
+            self._tasks[_key(name, payload)] = asyncio.create_task(
+                asyncio.to_thread(TOOLS[name].handler, payload)
+            )
+        STATS["prefetched"] += len(self._tasks)
+
+    async def call(self, name: str, payload: Dict[str, Any]) -> Any:
+        """Run a call whose payload was already bound to the session's agent."""
+        task = self._tasks.pop(_key(name, payload), None)
+        if task is not None:
+            self.hits += 1
+            STATS["hits"] += 1
+            return await task
+        self.misses += 1
+        STATS["misses"] += 1
+        return await asyncio.to_thread(TOOLS[name].handler, payload)
+
+    def close(self) -> None:
+        """Cancel prefetches the model never asked for."""
+        for task in self._tasks.values():
+            if task.done():
+                if not task.cancelled():
+                    task.exception()  # mark retrieved; the result is simply unused
+            else:
+                task.cancel()
+            self.cancelled += 1
+        STATS["cancelled"] += len(self._tasks)
+        self._tasks.clear()
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "cancelled": self.cancelled,
+            "hit_rate": hit_rate(),
+        }
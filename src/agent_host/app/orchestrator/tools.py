@@ -1,22 +1,64 @@
-from typing import Dict, Any, Callable, List
+from typing import Dict, Any, Callable, List, Optional, Union
+import importlib
 import json
 
 # ===== Unified Tool Registry =====
 
+Handler = Callable[[Dict[str, Any]], Dict[str, Any]]
+
+def resolve_handler(ref: str) -> Handler:
+    """Import a "module:function" handler; relative modules resolve against this package."""
+    module, _, attr = ref.partition(":")
+    return getattr(importlib.import_module(module, __package__), attr)
+
 class ToolSpec:
+    """A tool the LLM can call. `handler` may be a "module:function" string,
+    imported on the first call, so a tool's dependencies load only when used.
+    An `agent_scoped` tool always runs with the calling session's agent_id,
+    which is not part of its schema, so the model cannot pick another agent."""
+
     def __init__(self, name: str, description: str, schema: Dict[str, Any],
-                 handler: Callable[[Dict[str, Any]], Dict[str, Any]]):
+                 handler: Union[Handler, str], agent_scoped: bool = False):
         self.name = name
         self.description = description
         self.schema = schema
-        self.handler = handler
+        self._handler = handler
+        self.agent_scoped = agent_scoped
+
+    @property
+    def handler(self) -> Handler:
+        if isinstance(self._handler, str):
+            self._handler = resolve_handler(self._handler)
+        return self._handler
 
 TOOLS: Dict[str, ToolSpec] = {}
+_REGISTRY_VERSION = 0
 
 def register(tool: ToolSpec):
+    global _REGISTRY_VERSION
     TOOLS[tool.name] = tool
+    _REGISTRY_VERSION += 1
     return tool
 
+def bind_payload(name: str, payload: Dict[str, Any], agent_id: Optional[str]) -> Dict[str, Any]:
+    """The payload a call runs with in `agent_id`'s session: an agent-scoped
+    tool always gets the session's agent, and a tool taking an agent_id gets
+    it when the model leaves it out."""
+    spec = TOOLS.get(name)
+    if spec is None or agent_id is None:
+        return payload
+    if getattr(spec, "agent_scoped", False):
+        return {**payload, "agent_id": agent_id}
+    if "agent_id" in payload:
+        return payload
+    if "agent_id" not in (spec.schema.get("properties") or {}):
+        return payload
+    return {**payload, "agent_id": agent_id}
+
+def registry_version() -> int:
+    """Monotonic counter bumped on every registration; keys caches derived from TOOLS."""
+    return _REGISTRY_VERSION
+
 def list_tools_for_prompt() -> List[Dict[str, Any]]:
     """Return minimal metadata to show the LLM what exists and how to call it."""
     out = []
@@ -28,6 +70,30 @@ def list_tools_for_prompt() -> List[Dict[str, Any]]:
         })
     return out
 
+def native_tool_name(name: str) -> str:
+    """OpenAI-style function names only allow [a-zA-Z0-9_-]; map our dotted names."""
+    return name.replace(".", "__")
+
+def resolve_native_tool_name(native_name: str) -> str:
+    for name in TOOLS:
+        if native_tool_name(name) == native_name:
+            return name
+    return native_name
+
+def list_tools_native() -> List[Dict[str, Any]]:
+    """Tool catalog in the `tools` format of /v1/chat/completions."""
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": native_tool_name(t.name),
+                "description": t.description,
+                "parameters": t.schema,
+            },
+        }
+        for t in TOOLS.values()
+    ]
+
 from ..config import CHROMA_PERSIST_ROOT
 
 # ===== Internal: Agent profile updates =====
@@ -36,10 +102,8 @@ from ..agents import profiles as agent_profiles
 
 def _agent_update_notes(payload: Dict[str, Any]) -> Dict[str, Any]:
     agent_id = payload.get("agent_id", "default")
-    prof = agent_profiles.read_profile(CHROMA_PERSIST_ROOT, agent_id)
-    if "notes" in payload:
-        prof.notes = payload["notes"]
-    agent_profiles.write_profile(CHROMA_PERSIST_ROOT, prof)
+    patch = {"notes": payload["notes"]} if "notes" in payload else {}
+    agent_profiles.update_profile(CHROMA_PERSIST_ROOT, agent_id, patch)
     return {"ok": True}
 
 register(ToolSpec(
@@ -56,33 +120,38 @@ register(ToolSpec(
     handler=_agent_update_notes
 ))
 
-# ===== External: DuckDuckGo MCP adapters =====
-
-from ..clients import duckduckgo
+# ===== Internal: Chat history search =====
 
+from . import history as history_store
 
-def _ddg_search(payload: Dict[str, Any]) -> Dict[str, Any]:
-    query = payload["query"]
-    max_results = int(payload.get("k", 5))
-    try:
-        results = duckduckgo.client.search(query, max_results)
-        formatted = duckduckgo.client.format_results_for_llm(results)
-        return {
-            "query": query,
-            "results": [r.__dict__ for r in results],
-            "formatted": formatted,
-        }
-    except Exception as exc:
-        return {"error": str(exc), "query": query}
+def _history_search(payload: Dict[str, Any]) -> Dict[str, Any]:
+    agent_id = payload.get("agent_id", "default")
+    results = history_store.search(
+        CHROMA_PERSIST_ROOT, agent_id, payload["query"], k=int(payload.get("k", 5)),
+        role=payload.get("role"), since=payload.get("since"), until=payload.get("until"),
+    )
+    return {"ok": True, "results": results}
 
+register(ToolSpec(
+    name="history.search",
+    description="Search earlier messages of this conversation by keywords. Returns ranked snippets.",
+    schema={
+        "type":"object",
+        "properties":{
+            "query":{"type":"string"},
+            "k":{"type":"integer","default":5},
+            "role":{"type":"string","enum":["user","assistant"]},
+            "since":{"type":"string","description":"ISO date, inclusive"},
+            "until":{"type":"string","description":"ISO date, exclusive"}
+        },
+        "required":["query"]
+    },
+    handler=_history_search,
+    agent_scoped=True
+))
 
-def _ddg_fetch(payload: Dict[str, Any]) -> Dict[str, Any]:
-    url = payload["url"]
-    try:
-        content = duckduckgo.client.fetch_content(url)
-        return {"url": url, "content": content}
-    except Exception as exc:
-        return {"error": str(exc), "url": url}
+# ===== External: DuckDuckGo MCP adapters =====
+# Implemented in web_tools.py; BeautifulSoup and the client load on the first call
 
 register(ToolSpec(
     name="duckduckgo.search",
@@ -95,7 +164,7 @@ register(ToolSpec(
         },
         "required":["query"]
     },
-    handler=_ddg_search
+    handler=".web_tools:search"
 ))
 
 register(ToolSpec(
@@ -106,12 +175,10 @@ register(ToolSpec(
         "properties":{"url":{"type":"string"}},
         "required":["url"]
     },
-    handler=_ddg_fetch
+    handler=".web_tools:fetch_content"
 ))
 # ===== Internal: Memory (Chroma) tools =====
 
-from ..memory import chroma_store
-
 # def _mem_insert(payload: Dict[str, Any]) -> Dict[str, Any]:
 #     agent_id = payload.get("agent_id", "default")
 #     items = payload["items"]
@@ -0,0 +1,28 @@
+"""DuckDuckGo tool handlers, imported by the registry on their first call."""
+from typing import Any, Dict
+
+from ..clients import duckduckgo
+
+
+def search(payload: Dict[str, Any]) -> Dict[str, Any]:
+    query = payload["query"]
+    max_results = int(payload.get("k", 5))
+    try:
+        results = duckduckgo.client.search(query, max_results)
+        formatted = duckduckgo.client.format_results_for_llm(results)
+        return {
+            "query": query,
+            "results": [r.__dict__ for r in results],
+            "formatted": formatted,
+        }
+    except Exception as exc:
+        return {"error": str(exc), "query": query}
+
+
+def fetch_content(payload: Dict[str, Any]) -> Dict[str, Any]:
+    url = payload["url"]
+    try:
+        content = duckduckgo.client.fetch_content(url)
+        return {"url": url, "content": content}
+    except Exception as exc:
+        return {"error": str(exc), "url": url}
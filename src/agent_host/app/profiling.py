@@ -0,0 +1,175 @@
+"""Sampling stack profiler for live turns.
+
+A background thread snapshots every Python thread's stack with
+`sys._current_frames()` at a fixed interval and folds the samples into the
+collapsed-stack format (`frame;frame;frame count`) read by flamegraph.pl,
+speedscope and inferno. The profiled code is not instrumented, so the cost is
+one stack walk per thread per interval.
+
+- `StackSampler` captures an explicit window: one chat turn sent with
+  `profile=true`, or POST /admin/profile.
+- `WATCHDOG` is always on: turns register when they start, and once a turn has
+  run longer than SLOW_TURN_SECONDS its stacks are sampled until it ends and
+  saved to STACK_PROFILE_DIR.
+
+The event loop is shared, so a window also shows whatever other requests ran
+on it at the same time.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Set
+
+from . import config
+from .metrics import SLOW_TURNS
+
+PROFILE_SUFFIX = ".folded"
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", os.path.basename(code.co_filename))
+    return f"{module}:{code.co_name}".replace(";", ":")
+
+
+def sample_stacks(exclude: Set[int]) -> List[str]:
+    """One collapsed stack (root first, thread name as the root) per live thread."""
+    names = {t.ident: t.name for t in threading.enumerate()}
+    stacks = []
+    for ident, frame in sys._current_frames().items():
+        if ident in exclude:
+            continue
+        labels = []
+        while frame is not None:
+            labels.append(_frame_label(frame))
+            frame = frame.f_back
+        labels.append(names.get(ident, f"thread-{ident}").replace(";", ":"))
+        stacks.append(";".join(reversed(labels)))
+    return stacks
+
+
+def collapse(counts: Counter) -> str:
+    return "".join(f"{stack} {n}\n" for stack, n in sorted(counts.items()))
+
+
+class StackSampler:
+    def __init__(self, interval: Optional[float] = None):
+        self.interval = interval or config.STACK_SAMPLE_INTERVAL
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> "StackSampler":
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.counts.update(sample_stacks({me}))
+            self.samples += 1
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def collapsed(self) -> str:
+        return collapse(self.counts)
+
+    def __enter__(self) -> "StackSampler":
+        return self.start()
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+# ===== Saved profiles =====
+
+def save_collapsed(text: str, name: str, directory: Optional[str] = None) -> str:
+    directory = directory or config.STACK_PROFILE_DIR
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, name + PROFILE_SUFFIX)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    return path
+
+
+def list_saved(directory: Optional[str] = None) -> List[str]:
+    directory = directory or config.STACK_PROFILE_DIR
+    if not os.path.isdir(directory):
+        return []
+    return sorted(n for n in os.listdir(directory) if n.endswith(PROFILE_SUFFIX))
+
+
+def read_saved(name: str, directory: Optional[str] = None) -> str:
+    if os.path.basename(name) != name or not name.endswith(PROFILE_SUFFIX):
+        raise FileNotFoundError(name)
+    with open(os.path.join(directory or config.STACK_PROFILE_DIR, name), "r", encoding="utf-8") as f:
+        return f.read()
+
+
+# ===== Slow-turn watchdog =====
+
+class _WatchedTurn:
+    __slots__ = ("label", "started", "counts")
+
+    def __init__(self, label: str):
+        self.label = label
+        self.started = time.monotonic()
+        self.counts: Counter = Counter()
+
+
+class SlowTurnWatchdog:
+    def __init__(self, threshold: float, interval: Optional[float] = None):
+        self.threshold = threshold
+        self.interval = interval or config.STACK_SAMPLE_INTERVAL
+        self._turns: Dict[int, _WatchedTurn] = {}
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def begin(self, label: str) -> Optional[_WatchedTurn]:
+        if self.threshold <= 0:
+            return None
+        turn = _WatchedTurn(label)
+        with self._lock:
+            self._turns[id(turn)] = turn
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-turn-watchdog", daemon=True)
+                self._thread.start()
+        return turn
+
+    def end(self, turn: Optional[_WatchedTurn]) -> Optional[str]:
+        """Stop watching a turn; returns the saved profile path if it was slow."""
+        if turn is None:
+            return None
+        with self._lock:
+            self._turns.pop(id(turn), None)
+        if not turn.counts:
+            return None
+        elapsed = time.monotonic() - turn.started
+        path = save_collapsed(collapse(turn.counts), f"slow-{turn.label}")
+        SLOW_TURNS.inc()
+        print(f"Slow turn {turn.label} took {elapsed:.1f}s; stacks saved to {path}")
+        return path
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while True:
+            now = time.monotonic()
+            with self._lock:
+                slow = [t for t in self._turns.values() if now - t.started >= self.threshold]
+            if not slow:
+                time.sleep(min(0.1, self.threshold / 4))
+                continue
+            stacks = sample_stacks({me})
+            for turn in slow:
+                turn.counts.update(stacks)
+            time.sleep(self.interval)
+
+
+WATCHDOG = SlowTurnWatchdog(config.SLOW_TURN_SECONDS)
@@ -0,0 +1,204 @@
+"""Helpers shared by the streaming transports (SSE and WebSocket).
+
+Turn events are dicts like `{"type": "token", "data": "..."}`. Under load the
+transport falls behind the model and events pile up in its outgoing queue;
+`coalesce_events` merges runs of adjacent tokens so each frame carries many
+tokens instead of one.
+
+`EventBuffer` sits between a turn and a slow client: it holds at most
+`maxsize` events and applies a policy when full (coalesce tokens and then wait,
+defer tokens until the end, or abort the turn), and hands the writer batches
+flushed on a time window or byte threshold.
+
+Binary WebSocket frames are `kind (1 byte) | id length (1 byte) | id | payload`.
+Token payloads are raw UTF-8 text, every other kind is UTF-8 JSON.
+"""
+import asyncio
+import json
+import logging
+from collections import deque
+from contextlib import aclosing
+from typing import Any, AsyncGenerator, AsyncIterator, Deque, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+SLOW_CONSUMER_POLICIES = ("coalesce", "drop", "abort")
+FRAME_KINDS = ("token", "tool", "done", "error", "cancelled")
+_KIND_CODES = {kind: code for code, kind in enumerate(FRAME_KINDS)}
+
+
+def drain(queue: "asyncio.Queue[Any]", limit: Optional[int] = None) -> List[Any]:
+    """Everything already waiting in `queue`, without blocking."""
+    items = []
+    while not queue.empty() and (limit is None or len(items) < limit):
+        items.append(queue.get_nowait())
+    return items
+
+
+def coalesce_events(events: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Merge adjacent token events of the same session (`id`) into one."""
+    out: List[Dict[str, Any]] = []
+    for ev in events:
+        prev = out[-1] if out else None
+        if (prev is not None and ev["type"] == "token" and prev["type"] == "token"
+                and prev.get("id") == ev.get("id")):
+            out[-1] = {**prev, "data": prev["data"] + ev["data"]}
+        else:
+            out.append(ev)
+    return out
+
+
+def encode_binary_frame(event: Dict[str, Any]) -> bytes:
+    sid = str(event.get("id", "")).encode("utf-8")
+    if len(sid) > 255:
+        raise ValueError("session id longer than 255 bytes")
+    kind = event["type"]
+    if kind == "token":
+        payload = event["data"].encode("utf-8")
+    else:
+        body = {k: v for k, v in event.items() if k not in ("type", "id")}
+        payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+    return bytes((_KIND_CODES[kind], len(sid))) + sid + payload
+
+
+def decode_binary_frame(frame: bytes) -> Dict[str, Any]:
+    kind = FRAME_KINDS[frame[0]]
+    sid_end = 2 + frame[1]
+    event: Dict[str, Any] = {"type": kind, "id": frame[2:sid_end].decode("utf-8")}
+    payload = frame[sid_end:].decode("utf-8")
+    if kind == "token":
+        event["data"] = payload
+    else:
+        event.update(json.loads(payload))
+    return event
+
+
+# ===== Bounded buffer between a turn and its client =====
+
+class SlowConsumer(RuntimeError):
+    """The client fell `maxsize` events behind under the abort policy."""
+
+
+def _token_bytes(events) -> int:
+    return sum(len(ev["data"]) for ev in events if ev["type"] == "token")
+
+
+class EventBuffer:
+    def __init__(self, maxsize: int = 256, policy: str = "coalesce"):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"unknown slow-consumer policy {policy!r}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.deferred = 0  # tokens held back under the drop policy
+        self._items: Deque[Dict[str, Any]] = deque()
+        self._held = ""
+        self._closed = False
+        self._readable = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+
+    def _append(self, ev: Dict[str, Any]) -> None:
+        self._items.append(ev)
+        self._readable.set()
+
+    async def put(self, ev: Dict[str, Any]) -> None:
+        if self.deferred:
+            if ev["type"] == "token":
+                self._held += ev["data"]
+                self.deferred += 1
+                return
+            # Release everything held back in one chunk before the next event
+            if self._held:
+                self._append({"type": "token", "data": self._held})
+                self._held = ""
+            if ev["type"] == "done":
+                ev = {**ev, "data": {**ev["data"], "deferred_tokens": self.deferred}}
+        while len(self._items) >= self.maxsize:
+            if self.policy == "abort":
+                raise SlowConsumer(f"client fell {self.maxsize} events behind")
+            if self.policy == "drop":
+                kept = [e for e in self._items if e["type"] != "token"]
+                self._held = "".join(e["data"] for e in self._items if e["type"] == "token")
+                self.deferred = len(self._items) - len(kept)
+                self._items = deque(kept)
+                if len(kept) < self.maxsize:
+                    await self.put(ev)
+                    return
+            else:
+                merged = coalesce_events(list(self._items))
+                if len(merged) < len(self._items):
+                    self._items = deque(merged)
+                    continue
+            self._writable.clear()
+            await self._writable.wait()
+        self._append(ev)
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def close(self, final: Optional[Dict[str, Any]] = None) -> None:
+        """Mark the end of the stream, optionally with one last event past the bound."""
+        if final is not None:
+            self._items.append(final)
+        self._closed = True
+        self._readable.set()
+
+    async def _wait_readable(self, timeout: Optional[float] = None) -> None:
+        self._readable.clear()
+        if timeout is None:
+            await self._readable.wait()
+        else:
+            await asyncio.wait_for(self._readable.wait(), timeout)
+
+    async def batches(self, window: float, max_bytes: int) -> AsyncIterator[List[Dict[str, Any]]]:
+        """Yield coalesced batches of events until the buffer is closed and empty.
+
+        The first batch goes out immediately (time to first token); after that a
+        run of tokens is held for up to `window` seconds or until it reaches
+        `max_bytes`, and any non-token event flushes at once.
+        """
+        loop = asyncio.get_running_loop()
+        first = True
+        while True:
+            while not self._items:
+                if self._closed:
+                    return
+                await self._wait_readable()
+            if not first and window > 0:
+                deadline = loop.time() + window
+                while (not self._closed and _token_bytes(self._items) < max_bytes
+                       and all(ev["type"] == "token" for ev in self._items)):
+                    remaining = deadline - loop.time()
+                    if remaining <= 0:
+                        break
+                    try:
+                        await self._wait_readable(remaining)
+                    except asyncio.TimeoutError:
+                        break
+            batch = coalesce_events(list(self._items))
+            self._items.clear()
+            self._writable.set()
+            first = False
+            yield batch
+
+
+async def pump(events: AsyncGenerator[Dict[str, Any], None], buffer: EventBuffer) -> None:
+    """Feed a turn's events into `buffer`; the abort policy closes the turn early.
+
+    The buffer is always closed, so the reader finishes. A failing turn ends
+    with an error event and its exception is re-raised to whoever awaits this.
+    """
+    try:
+        async with aclosing(events):
+            async for ev in events:
+                await buffer.put(ev)
+    except SlowConsumer as exc:
+        logger.warning("Aborting turn for slow client: %s", exc)
+        buffer.close({"type": "error", "data": str(exc)})
+    except Exception as exc:
+        buffer.close({"type": "error", "data": str(exc)})
+        raise
+    finally:
+        if not buffer.closed:
+            buffer.close()
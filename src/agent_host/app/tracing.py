@@ -0,0 +1,170 @@
+"""Per-turn trace spans.
+
+Each chat turn owns a `Trace`: a small tree of timed spans (prompt build,
+history I/O, every LLM call with llama.cpp token counts, every tool call).
+Spans are opened explicitly on the trace object rather than through context
+variables, because a turn is an async generator that is suspended between
+tokens while other requests run.
+
+Finished traces can be appended to a rolling JSONL log (TRACE_LOG_PATH) and
+exported as OTLP/HTTP JSON to any OpenTelemetry collector
+(OTEL_EXPORTER_OTLP_ENDPOINT).
+"""
+import asyncio
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Set
+
+import httpx
+
+from .config import OTEL_EXPORTER_OTLP_ENDPOINT, OTEL_SERVICE_NAME, TRACE_LOG_MAX_BYTES, TRACE_LOG_PATH
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent", "start_ns", "end_ns", "attributes", "children")
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes: Any):
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent = parent
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes)
+        self.children: List["Span"] = []
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def to_dict(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"name": self.name, "duration_ms": round(self.duration_ms, 3)}
+        if self.attributes:
+            out["attributes"] = self.attributes
+        if self.children:
+            out["children"] = [c.to_dict() for c in self.children]
+        return out
+
+    def walk(self) -> Iterator["Span"]:
+        yield self
+        for child in self.children:
+            yield from child.walk()
+
+
+class Trace:
+    def __init__(self, name: str, **attributes: Any):
+        self.trace_id = secrets.token_hex(16)
+        self.root = Span(name, **attributes)
+        self._stack: List[Span] = [self.root]
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        parent = self._stack[-1]
+        span = Span(name, parent, **attributes)
+        parent.children.append(span)
+        self._stack.append(span)
+        try:
+            yield span
+        except BaseException as exc:
+            span.attributes["error"] = type(exc).__name__
+            raise
+        finally:
+            span.end()
+            self._stack.remove(span)
+
+    def finish(self) -> None:
+        for span in self.root.walk():
+            span.end()
+
+    def summary(self) -> Dict[str, Any]:
+        return {"trace_id": self.trace_id, **self.root.to_dict()}
+
+
+# ===== Sinks =====
+
+_log_lock = threading.Lock()
+# Keep references to in-flight exports so they are not garbage-collected mid-request
+_pending_exports: Set["asyncio.Task[bool]"] = set()
+
+
+def append_trace_log(trace: Trace, path: str = TRACE_LOG_PATH, max_bytes: int = TRACE_LOG_MAX_BYTES) -> None:
+    """Append one JSON line per turn; the file is rotated to `<path>.1` past max_bytes."""
+    line = json.dumps({"ts": trace.root.start_ns / 1e9, **trace.summary()}, ensure_ascii=False)
+    with _log_lock:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        try:
+            if os.path.getsize(path) + len(line) > max_bytes:
+                os.replace(path, path + ".1")
+        except FileNotFoundError:
+            pass
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _otlp_value(value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def to_otlp(trace: Trace, service_name: str = OTEL_SERVICE_NAME) -> Dict[str, Any]:
+    """OTLP/HTTP JSON (ExportTraceServiceRequest) body for one trace."""
+    spans = []
+    for span in trace.root.walk():
+        item: Dict[str, Any] = {
+            "traceId": trace.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,  # SPAN_KIND_INTERNAL
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or time.time_ns()),
+            "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+        }
+        if span.parent is not None:
+            item["parentSpanId"] = span.parent.span_id
+        if "error" in span.attributes:
+            item["status"] = {"code": 2}  # STATUS_CODE_ERROR
+        spans.append(item)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": "agent_host"}, "spans": spans}],
+        }]
+    }
+
+
+async def export_otlp(trace: Trace, endpoint: str = OTEL_EXPORTER_OTLP_ENDPOINT,
+                      transport: Optional[httpx.AsyncBaseTransport] = None) -> bool:
+    try:
+        async with httpx.AsyncClient(timeout=5.0, transport=transport) as client:
+            r = await client.post(f"{endpoint.rstrip('/')}/v1/traces", json=to_otlp(trace))
+            r.raise_for_status()
+    except Exception as exc:
+        print("OTLP export failed:", exc)
+        return False
+    return True
+
+
+def record(trace: Trace) -> None:
+    """Send a finished trace to the configured sinks without delaying the turn."""
+    if TRACE_LOG_PATH:
+        try:
+            append_trace_log(trace, TRACE_LOG_PATH, TRACE_LOG_MAX_BYTES)
+        except OSError as exc:
+            print("Trace log write failed:", exc)
+    if OTEL_EXPORTER_OTLP_ENDPOINT:
+        task = asyncio.get_running_loop().create_task(export_otlp(trace, OTEL_EXPORTER_OTLP_ENDPOINT))
+        _pending_exports.add(task)
+        task.add_done_callback(_pending_exports.discard)
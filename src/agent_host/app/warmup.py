@@ -0,0 +1,137 @@
+"""Startup warmup, so the first chat after a deploy does not pay for cold caches.
+
+`run()` is started in the background by the startup hook. Until it finishes,
+or WARMUP_TIMEOUT passes, /healthz answers 503 and load balancers keep traffic
+away. The steps are:
+
+- imports: import WARMUP_IMPORTS (by default the modules the configured backends load)
+- stores: open the vector stores of the WARMUP_AGENTS most recently active agents
+- embedding: embed one text, which loads the model or connects to the embedding server
+- prefill: send each of those agents' prompt with n_predict=0, so llama-server
+  holds the system prompt and history in a slot's KV cache
+
+A failing step is logged and recorded in `/healthz`. It never keeps the
+server from becoming ready.
+"""
+import asyncio
+import importlib
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from . import config
+from .agents import profiles
+from .memory import chroma_store
+from .orchestrator import history
+from .orchestrator.scheduler import SCHEDULER, prefix_key
+from .orchestrator.session import prime_prompt
+
+
+class Warmup:
+    __slots__ = ("enabled", "done", "timed_out", "agents", "steps", "started_at", "finished_at")
+
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self.done = False
+        self.timed_out = False
+        self.agents: List[str] = []
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return not self.enabled or self.done
+
+    def status(self) -> Dict[str, Any]:
+        out: Dict[str, Any] = {"ready": self.ready, "agents": self.agents, "steps": self.steps}
+        if self.timed_out:
+            out["timed_out"] = True
+        if self.started_at is not None:
+            end = self.finished_at if self.finished_at is not None else time.monotonic()
+            out["seconds"] = round(end - self.started_at, 3)
+        return out
+
+
+STATE = Warmup(config.WARMUP)
+
+
+def _import_modules(names: List[str]) -> Dict[str, Any]:
+    imported, missing = [], []
+    for name in names:
+        try:
+            importlib.import_module(name)
+            imported.append(name)
+        except ImportError:
+            missing.append(name)
+    return {"imported": imported, "missing": missing}
+
+
+def _open_stores(root: str, agents: List[str]) -> Dict[str, Any]:
+    memories = 0
+    for agent_id in agents:
+        memories += chroma_store.backend_for(agent_id, root).count()
+    return {"memories": memories}
+
+
+async def _embed() -> Dict[str, Any]:
+    _, queries = await asyncio.to_thread(chroma_store.batchers)
+    await queries.aembed(["warmup"])
+    return {}
+
+
+async def _prefill(root: str, agents: List[str]) -> Dict[str, Any]:
+    # More agents than slots would only evict each other
+    agents = agents[:max(1, config.LLAMACPP_SLOTS) * len(config.LLAMACPP_BASE_URLS)]
+
+    async def one(agent_id: str) -> int:
+        profile = (await asyncio.to_thread(profiles.read_profile, root, agent_id)).model_dump()
+        async with SCHEDULER.slot(prefix_key(profile)) as slot:
+            stats = await prime_prompt(profile, slot_id=slot)
+        return int((stats.get("usage") or {}).get("prompt_tokens") or 0)
+
+    results = await asyncio.gather(*(one(a) for a in agents), return_exceptions=True)
+    failed = {a: f"{type(r).__name__}: {r}" for a, r in zip(agents, results) if isinstance(r, BaseException)}
+    for agent_id, error in failed.items():
+        print(f"Warmup prefill for {agent_id} failed:", error)
+    out: Dict[str, Any] = {
+        "agents": len(agents) - len(failed),
+        "prompt_tokens": sum(r for r in results if isinstance(r, int)),
+    }
+    if failed:
+        out["failed"] = failed
+    return out
+
+
+async def _step(state: Warmup, name: str, fn: Callable[[], Awaitable[Dict[str, Any]]]) -> None:
+    started = time.perf_counter()
+    try:
+        detail = await fn()
+        state.steps[name] = {"ok": True, **detail}
+    except Exception as exc:
+        print(f"Warmup step {name} failed:", exc)
+        state.steps[name] = {"ok": False, "error": f"{type(exc).__name__}: {exc}"}
+    state.steps[name]["seconds"] = round(time.perf_counter() - started, 3)
+
+
+async def _run(state: Warmup, root: str) -> None:
+    await _step(state, "imports", lambda: asyncio.to_thread(_import_modules, config.WARMUP_IMPORTS))
+    state.agents = await asyncio.to_thread(history.recently_active, root, config.WARMUP_AGENTS)
+    await _step(state, "stores", lambda: asyncio.to_thread(_open_stores, root, state.agents))
+    await _step(state, "embedding", _embed)
+    if state.agents:
+        await _step(state, "prefill", lambda: _prefill(root, state.agents))
+
+
+async def run(root: str = config.CHROMA_PERSIST_ROOT, state: Optional[Warmup] = None) -> Warmup:
+    state = state or STATE
+    state.started_at = time.monotonic()
+    try:
+        await asyncio.wait_for(_run(state, root), config.WARMUP_TIMEOUT)
+    except asyncio.TimeoutError:
+        state.timed_out = True
+        print(f"Warmup did not finish within {config.WARMUP_TIMEOUT}s; serving anyway")
+    finally:
+        state.finished_at = time.monotonic()
+        state.done = True
+    print(f"Warmup finished in {state.finished_at - state.started_at:.2f}s:", state.steps)
+    return state
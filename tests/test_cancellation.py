@@ -0,0 +1,89 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.orchestrator import history as H
+from agent_host.app.orchestrator import scheduler, session
+from agent_host.app.streaming import EventBuffer, pump
+
+PROFILE = {"agent_id": "agent-c", "character": "Tester", "notes": "none"}
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture()
+def hanging_llm(tmp_path, monkeypatch):
+    """An upstream stream that sends two tokens and then hangs until closed."""
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", str(tmp_path))
+    state = {"closed": False, "followups": 0}
+
+    async def fake_stream_chat(messages, **kwargs):
+        try:
+            yield "Hel"
+            yield "lo TOOL_CALL: "
+            await asyncio.Event().wait()
+        finally:
+            state["closed"] = True
+
+    async def fake_nonstream_chat(messages, **kwargs):
+        state["followups"] += 1
+        return {"text": "", "tool_calls": [], "raw": {}}
+
+    monkeypatch.setattr(session, "stream_chat", fake_stream_chat)
+    monkeypatch.setattr(session, "nonstream_chat", fake_nonstream_chat)
+    return state
+
+
+def _assert_truncated(tmp_path, state):
+    records = H.load_all_turns(str(tmp_path), PROFILE["agent_id"])
+    assert [r["role"] for r in records] == ["user", "assistant"]
+    assert records[-1]["content"] == "Hello TOOL_CALL: " + session.TRUNCATED_MARKER
+    assert records[-1]["truncated"] is True
+    assert state["closed"] is True
+    assert state["followups"] == 0
+
+
+@pytest.mark.anyio
+async def test_cancelling_producer_closes_upstream_and_saves_truncated_reply(tmp_path, hanging_llm):
+    buffer = EventBuffer()
+    producer = asyncio.create_task(pump(session.run_turn(PROFILE, "hi"), buffer))
+    await asyncio.sleep(0.05)  # both tokens buffered, upstream now hanging
+
+    producer.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await producer
+    _assert_truncated(tmp_path, hanging_llm)
+
+
+@pytest.mark.anyio
+async def test_closing_turn_generator_saves_truncated_reply(tmp_path, hanging_llm):
+    turn = session.run_turn(PROFILE, "hi")
+    assert (await turn.__anext__())["data"] == "Hel"
+    assert (await turn.__anext__())["data"] == "lo TOOL_CALL: "
+    await turn.aclose()
+    _assert_truncated(tmp_path, hanging_llm)
+
+
+@pytest.mark.anyio
+async def test_cancelled_holder_hands_slot_to_queued_turn():
+    sched = scheduler.SlotScheduler(slots=1)
+
+    async def hold():
+        async with sched.slot("k"):
+            await asyncio.Event().wait()
+
+    holder = asyncio.create_task(hold())
+    await asyncio.sleep(0)
+    waiter = asyncio.create_task(sched.acquire("k"))
+    await asyncio.sleep(0)
+    assert sched.queue_depth == 1
+
+    holder.cancel()
+    assert await asyncio.wait_for(waiter, 1) == 0
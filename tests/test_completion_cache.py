@@ -0,0 +1,128 @@
+import json
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app import config
+from agent_host.app.clients import completion_cache, llamacpp
+
+MESSAGES = [{"role": "system", "content": "Be brief"}, {"role": "user", "content": "hi"}]
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture()
+def server(tmp_path, monkeypatch):
+    """Fake llama-server behind httpx.MockTransport; records every request body."""
+    monkeypatch.setattr(config, "COMPLETION_CACHE", True)
+    monkeypatch.setattr(config, "COMPLETION_CACHE_DIR", str(tmp_path / "cache"))
+    completion_cache.clear()
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content)
+        requests.append(body)
+        timings = {"prompt_n": 5, "predicted_n": 2}
+        if body["stream"]:
+            chunks = [{"choices": [{"delta": {"content": tok}}]} for tok in ("Hel", "lo")]
+            chunks.append({"choices": [{"delta": {}, "finish_reason": "stop"}], "timings": timings})
+            text = "".join(f"data: {json.dumps(c)}\n\n" for c in chunks) + "data: [DONE]\n\n"
+            return httpx.Response(200, text=text, headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={
+            "choices": [{"message": {"role": "assistant", "content": "Hello"}}],
+            "timings": timings,
+        })
+
+    real_client = httpx.AsyncClient
+    monkeypatch.setattr(llamacpp.httpx, "AsyncClient",
+                        lambda **kwargs: real_client(transport=httpx.MockTransport(handler), **kwargs))
+    yield requests
+    completion_cache.clear()
+
+
+@pytest.mark.anyio
+async def test_deterministic_stream_is_replayed(server):
+    first = [t async for t in llamacpp.stream_chat(MESSAGES, temperature=0)]
+    stats = {}
+    second = [t async for t in llamacpp.stream_chat(MESSAGES, temperature=0, stats=stats, id_slot=1)]
+
+    assert first == second == ["Hel", "lo"]
+    assert len(server) == 1
+    assert stats["timings"]["predicted_n"] == 2
+
+    # A streamed entry also answers the same request made without streaming
+    out = await llamacpp.nonstream_chat(MESSAGES, temperature=0)
+    assert out["text"] == "Hello"
+    assert len(server) == 1
+
+
+@pytest.mark.anyio
+async def test_sampling_params_and_randomness_bypass_or_split_the_cache(server):
+    await llamacpp.nonstream_chat(MESSAGES, temperature=0.7)
+    await llamacpp.nonstream_chat(MESSAGES, temperature=0.7)
+    assert len(server) == 2  # random sampling is never cached
+
+    await llamacpp.nonstream_chat(MESSAGES, temperature=0.7, seed=42)
+    await llamacpp.nonstream_chat(MESSAGES, temperature=0.7, seed=42)
+    await llamacpp.nonstream_chat(MESSAGES, temperature=0.7, seed=43)
+    assert len(server) == 4
+
+
+@pytest.mark.anyio
+async def test_entries_survive_restart_via_disk(server):
+    await llamacpp.nonstream_chat(MESSAGES, temperature=0)
+    completion_cache.clear()  # drop the in-memory LRU, as after a restart
+
+    out = await llamacpp.nonstream_chat(MESSAGES, temperature=0)
+    assert out["text"] == "Hello"
+    assert len(server) == 1
+
+
+def test_chat_endpoint_hits_cache_across_turns(server, tmp_path, monkeypatch):
+    import agent_host.app.main as main_module
+    from datetime import datetime
+    from fastapi.testclient import TestClient
+    from agent_host.app.agents import profiles
+    from agent_host.app.models import AgentProfile
+    from agent_host.app.orchestrator import prompt, session
+
+    root = str(tmp_path / "agents")
+    monkeypatch.setattr(main_module, "CHROMA_PERSIST_ROOT", root)
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", root)
+    for agent_id in ("twin1", "twin2", "twin3", "twin4"):
+        profiles.write_profile(root, AgentProfile(agent_id=agent_id, character="Tester", notes=""))
+    client = TestClient(main_module.app)
+    body = {"user": "hi", "stream": False, "tool_calls_allowed": False, "temperature": 0}
+
+    def chats():
+        return [r for r in server if r.get("messages")]
+
+    def at(when):
+        monkeypatch.setattr(session, "compile_prompt", lambda profile, include_tools=True, now=None:
+                            prompt.compile_prompt(profile, include_tools, when))
+
+    at(datetime(2030, 1, 1, 9, 0))
+    client.post("/chat", json={**body, "agent_id": "twin1"})
+    assert len(chats()) == 1 and chats()[0]["temperature"] == 0
+
+    # Same conversation later that day: the clock moved but the turn is still a hit
+    at(datetime(2030, 1, 1, 17, 30))
+    resp = client.post("/chat", json={**body, "agent_id": "twin2"})
+    assert resp.status_code == 200 and "Hello" in resp.text
+    assert len(chats()) == 1
+
+    # The next day the prompt's date differs, so the model is asked again
+    at(datetime(2030, 1, 2, 9, 0))
+    client.post("/chat", json={**body, "agent_id": "twin3"})
+    assert len(chats()) == 2
+
+    # Unseeded, non-zero temperature still reaches the server
+    client.post("/chat", json={**body, "agent_id": "twin4", "temperature": 0.7})
+    assert len(chats()) == 3
@@ -0,0 +1,69 @@
+import asyncio
+import sys
+import threading
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.memory.embedding import EmbeddingBatcher
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+class CountingEmbed:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(t)), 1.0] for t in texts]
+
+
+def test_concurrent_callers_share_one_model_call():
+    embed = CountingEmbed()
+    batcher = EmbeddingBatcher(embed, max_batch=64, max_wait=0.05)
+    results = {}
+    start = threading.Barrier(8)
+
+    def caller(i):
+        start.wait()
+        results[i] = batcher.embed(["x" * i, "y"])
+
+    threads = [threading.Thread(target=caller, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert len(embed.calls) < 8
+    assert sum(len(c) for c in embed.calls) == 16
+    for i in range(8):
+        assert results[i] == [[float(i), 1.0], [1.0, 1.0]]
+
+
+@pytest.mark.anyio
+async def test_async_callers_and_batch_cap():
+    embed = CountingEmbed()
+    batcher = EmbeddingBatcher(embed, max_batch=4, max_wait=0.05)
+    out = await asyncio.gather(*(batcher.aembed([f"t{i}"]) for i in range(10)))
+
+    assert [v[0][0] for v in out] == [float(len(f"t{i}")) for i in range(10)]
+    assert all(len(c) <= 4 for c in embed.calls)
+    assert await batcher.aembed([]) == []
+
+
+def test_model_errors_reach_every_caller_in_the_batch():
+    def broken(texts):
+        raise RuntimeError("model failed")
+
+    batcher = EmbeddingBatcher(broken, max_wait=0.0)
+    with pytest.raises(RuntimeError, match="model failed"):
+        batcher.embed(["a"])
+    # The collector keeps serving after a failure
+    with pytest.raises(RuntimeError):
+        batcher.embed(["b"])
@@ -0,0 +1,73 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.orchestrator import grammar
+from agent_host.app.orchestrator import session
+from agent_host.app.orchestrator import tools as tool_registry
+
+PROFILE = {"agent_id": "agent-g", "character": "Tester", "notes": "none"}
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+def test_tool_call_schema_has_one_branch_per_tool():
+    schema = grammar.tool_call_schema()
+    names = [b["properties"]["name"]["const"] for b in schema["oneOf"]]
+    assert names == list(tool_registry.TOOLS)
+    search = schema["oneOf"][names.index("duckduckgo.search")]
+    assert search["properties"]["payload"] == tool_registry.TOOLS["duckduckgo.search"].schema
+    assert grammar.tool_call_schema() is schema, "schema is cached per registry version"
+
+    fmt = grammar.tool_call_response_format()
+    assert fmt["type"] == "json_schema"
+    assert fmt["json_schema"]["schema"] is schema
+
+
+@pytest.mark.anyio
+async def test_stream_switches_to_constrained_call(tmp_path, monkeypatch):
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", str(tmp_path))
+    monkeypatch.setattr(session, "CONSTRAIN_TOOL_CALLS", True)
+
+    closed = []
+
+    async def fake_stream_chat(messages, **kwargs):
+        try:
+            for tok in ["Let me check. TOOL", '_CALL: {"na', 'me": broken']:
+                yield tok
+        finally:
+            closed.append(True)
+
+    requests = []
+
+    async def fake_nonstream_chat(messages, **kwargs):
+        requests.append((list(messages), kwargs))
+        if "response_format" in kwargs:
+            return {"text": '{"name":"duckduckgo.search","payload":{"query":"tea"}}', "tool_calls": []}
+        return {"text": "Tea is great.", "tool_calls": []}
+
+    payloads = []
+    original = session.TOOLS["duckduckgo.search"]
+    monkeypatch.setitem(session.TOOLS, "duckduckgo.search", tool_registry.ToolSpec(
+        original.name, original.description, original.schema,
+        handler=lambda p: payloads.append(p) or {"ok": True},
+    ))
+    monkeypatch.setattr(session, "stream_chat", fake_stream_chat)
+    monkeypatch.setattr(session, "nonstream_chat", fake_nonstream_chat)
+
+    events = [e async for e in session.run_turn(PROFILE, "tea?")]
+    tokens = [e["data"] for e in events if e["type"] == "token"]
+
+    assert closed == [True]
+    assert "".join(tokens[:3]) == 'Let me check. TOOL_CALL:{"name":"duckduckgo.search","payload":{"query":"tea"}}'
+    constrained_messages, constrained_kwargs = requests[0]
+    assert constrained_messages[-1] == {"role": "assistant", "content": "Let me check. TOOL_CALL:"}
+    assert constrained_kwargs["response_format"] == grammar.tool_call_response_format()
+    assert payloads == [{"query": "tea"}]
+    assert tokens[-1] == "Tea is great."
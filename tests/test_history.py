@@ -1,3 +1,4 @@
+import json
 import sys
 from pathlib import Path
 
@@ -105,3 +106,120 @@ def test_history_endpoints(tmp_path, monkeypatch):
     payload = resp.json()
     assert len(payload["history"]) == 1
     assert payload["history"][0]["message_id"] == first["message_id"]
+
+
+def test_window_cache_serves_appends_without_reading(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    agent = "cached"
+    H.append_turn(root, agent, "user", "hi")
+    assert [m["content"] for m in H.load_history(root, agent)] == ["hi"]
+
+    def no_reads(lines):
+        raise AssertionError("history file re-read")
+
+    monkeypatch.setattr(H, "_parse_lines", no_reads)
+    H.append_turn(root, agent, "assistant", "hello", truncated=True)
+    msgs = H.load_history(root, agent, max_pairs=1)
+    assert [m["content"] for m in msgs] == ["hi", "hello"]
+    assert msgs[1]["truncated"] is True
+
+    msgs[0]["content"] = "mutated"  # callers get copies
+    assert H.load_history(root, agent)[0]["content"] == "hi"
+
+
+def test_window_cache_reloads_after_external_edit(tmp_path):
+    root = tmp_path.as_posix()
+    agent = "edited"
+    H.append_turn(root, agent, "user", "one")
+    assert len(H.load_history(root, agent)) == 1
+
+    path = tmp_path / agent / "chat_history.jsonl"
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"role": "assistant", "content": "from outside"}\n')
+    assert [m["content"] for m in H.load_history(root, agent)] == ["one", "from outside"]
+
+    # An append after an outside edit must not be layered on the stale window
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"role": "user", "content": "again"}\n')
+    H.append_turn(root, agent, "assistant", "two")
+    assert [m["content"] for m in H.load_history(root, agent)] == ["one", "from outside", "again", "two"]
+
+
+def test_window_cache_is_lru_bounded(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    monkeypatch.setattr(H, "HISTORY_CACHE_AGENTS", 2)
+    H.invalidate()
+    for agent in ("a", "b", "c"):
+        H.append_turn(root, agent, "user", agent)
+        H.load_history(root, agent)
+    assert [key[1] for key in H._WINDOWS] == ["b", "c"]
+
+
+def test_history_pagination_and_cursors(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    agent = "paged"
+    monkeypatch.setattr(main_app, "CHROMA_PERSIST_ROOT", root, raising=False)
+    client = TestClient(main_app.app)
+    ids = [H.append_turn(root, agent, "user", f"m{i}")["message_id"] for i in range(5)]
+
+    page = client.get(f"/agents/{agent}/history", params={"limit": 2}).json()
+    assert [m["content"] for m in page["history"]] == ["m3", "m4"]
+    assert page["has_more"] is True
+
+    page = client.get(f"/agents/{agent}/history", params={"before": ids[3], "limit": 2}).json()
+    assert [m["content"] for m in page["history"]] == ["m1", "m2"]
+    assert page["has_more"] is True
+
+    page = client.get(f"/agents/{agent}/history", params={"after": ids[2]}).json()
+    assert [m["content"] for m in page["history"]] == ["m3", "m4"]
+    assert page["has_more"] is False
+
+    resp = client.get(f"/agents/{agent}/history", params={"before": "nope"})
+    assert resp.status_code == 404
+
+
+def test_history_since_and_etag(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    agent = "synced"
+    monkeypatch.setattr(main_app, "CHROMA_PERSIST_ROOT", root, raising=False)
+    client = TestClient(main_app.app)
+    first = H.append_turn(root, agent, "user", "hi")
+    second = H.append_turn(root, agent, "assistant", "hello")
+
+    full = client.get(f"/agents/{agent}/history")
+    seq = full.json()["seq"]
+    etag = full.headers["etag"]
+    assert client.get(f"/agents/{agent}/history", headers={"If-None-Match": etag}).status_code == 304
+
+    H.append_turn(root, agent, "user", "more")
+    H.update_turn(root, agent, first["message_id"], {"content": "hi!"})
+    H.delete_turn(root, agent, second["message_id"])
+
+    assert client.get(f"/agents/{agent}/history", headers={"If-None-Match": etag}).status_code == 200
+    delta = client.get(f"/agents/{agent}/history", params={"since": seq}).json()
+    assert [m["content"] for m in delta["history"]] == ["hi!", "more"]
+    assert delta["deleted"] == [second["message_id"]]
+    assert delta["seq"] == seq + 3
+
+    empty = client.get(f"/agents/{agent}/history", params={"since": delta["seq"]}).json()
+    assert empty["history"] == [] and empty["deleted"] == []
+
+    lines = client.get(f"/agents/{agent}/history", params={"since": seq, "format": "ndjson"}).text.splitlines()
+    assert [json.loads(line).get("content") for line in lines[:-1]] == ["hi!", "more"]
+    assert json.loads(lines[-1]) == {"end": True, "seq": seq + 3, "deleted": [second["message_id"]]}
+
+
+def test_empty_or_garbled_seq_counter_rescans_records(tmp_path):
+    root = tmp_path.as_posix()
+    agent = "counter"
+    H.append_turn(root, agent, "user", "one")
+    H.append_turn(root, agent, "assistant", "two")
+    seq_path = tmp_path / agent / "chat_history.seq"
+    assert seq_path.read_text() == "2"
+
+    for broken in ("", "not a number"):
+        seq_path.write_text(broken)
+        assert H.current_seq(root, agent) == 2
+    assert H.append_turn(root, agent, "user", "three")["seq"] == 3
+    assert seq_path.read_text() == "3"
+    assert [p.name for p in (tmp_path / agent).iterdir() if p.name.endswith(".tmp")] == []
@@ -0,0 +1,132 @@
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.orchestrator import history as H
+from agent_host.app.orchestrator import history_index, session, tools
+from agent_host.app import main as main_app
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+def _ids(results):
+    return [r["message_id"] for r in results]
+
+
+def test_search_ranks_and_stays_in_sync(tmp_path):
+    root = tmp_path.as_posix()
+    agent = "searcher"
+    trip = H.append_turn(root, agent, "user", "We planned a trip to Lisbon in May")
+    food = H.append_turn(root, agent, "assistant", "Lisbon has great pastel de nata and Lisbon fish")
+    H.append_turn(root, agent, "user", "Unrelated chatter about the weather")
+
+    results = H.search(root, agent, "lisbon")
+    assert _ids(results) == [food["message_id"], trip["message_id"]]
+    assert "Lisbon" in results[0]["snippet"]
+
+    # Appends, updates and deletes reach the built index without a rebuild
+    index = history_index.cached(root, agent)
+    later = H.append_turn(root, agent, "user", "Porto instead of Lisbon?")
+    H.update_turn(root, agent, trip["message_id"], {"content": "We planned a trip to Madrid"})
+    H.delete_turn(root, agent, food["message_id"])
+    assert history_index.cached(root, agent) is index
+    assert _ids(H.search(root, agent, "lisbon")) == [later["message_id"]]
+    assert _ids(H.search(root, agent, "madrid")) == [trip["message_id"]]
+
+
+def test_search_filters_and_external_edits(tmp_path):
+    root = tmp_path.as_posix()
+    agent = "filtered"
+    H.write_all(root, agent, [
+        {"role": "user", "content": "budget spreadsheet", "created_at": "2025-08-10T10:00:00Z"},
+        {"role": "assistant", "content": "the budget is fine", "created_at": "2025-09-02T10:00:00Z"},
+        {"role": "user", "content": "new budget numbers", "created_at": "2025-09-20T10:00:00Z"},
+    ])
+    assert len(H.search(root, agent, "budget")) == 3
+    assert [r["role"] for r in H.search(root, agent, "budget", role="assistant")] == ["assistant"]
+    september = H.search(root, agent, "budget", since="2025-09-01", until="2025-09-15")
+    assert [r["created_at"] for r in september] == ["2025-09-02T10:00:00Z"]
+
+    path = tmp_path / agent / "chat_history.jsonl"
+    with open(path, "a", encoding="utf-8") as f:
+        f.write('{"role": "user", "content": "budget appended by hand"}\n')
+    assert len(H.search(root, agent, "budget")) == 4
+
+
+def test_snippet_is_windowed_around_match():
+    text = "x " * 200 + "needle here" + " y" * 200
+    snip = history_index.snippet(text, ["needle"], width=40)
+    assert "needle" in snip
+    assert snip.startswith("…") and snip.endswith("…")
+
+
+def test_search_endpoint_and_tool(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    monkeypatch.setattr(main_app, "CHROMA_PERSIST_ROOT", root, raising=False)
+    monkeypatch.setattr(tools, "CHROMA_PERSIST_ROOT", root)
+    hit = H.append_turn(root, "api", "user", "remember the blue kayak")
+    H.append_turn(root, "api", "assistant", "noted")
+
+    resp = TestClient(main_app.app).get("/agents/api/history/search", params={"q": "kayak"})
+    assert resp.status_code == 200
+    assert _ids(resp.json()["results"]) == [hit["message_id"]]
+
+    out = tools.TOOLS["history.search"].handler({"agent_id": "api", "query": "blue kayak"})
+    assert _ids(out["results"]) == [hit["message_id"]]
+
+
+@pytest.mark.anyio
+async def test_search_tool_is_scoped_to_the_session_agent(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", root)
+    monkeypatch.setattr(tools, "CHROMA_PERSIST_ROOT", root)
+    mine = H.append_turn(root, "me", "user", "my kayak is blue")
+    H.append_turn(root, "other", "user", "the other kayak is red")
+    assert "agent_id" not in tools.TOOLS["history.search"].schema["properties"]
+
+    async def fake_stream_chat(messages, **kwargs):
+        yield 'TOOL_CALL: {"name":"history.search","payload":{"query":"kayak","agent_id":"other"}}'
+
+    async def fake_nonstream_chat(messages, **kwargs):
+        return {"text": "ok", "tool_calls": []}
+
+    monkeypatch.setattr(session, "stream_chat", fake_stream_chat)
+    monkeypatch.setattr(session, "nonstream_chat", fake_nonstream_chat)
+    profile = {"agent_id": "me", "character": "Tester", "notes": ""}
+    events = [e async for e in session.run_turn(profile, "what colour was the kayak?")]
+
+    result = next(e for e in events if e["type"] == "tool")["data"]["Tool result"]
+    assert mine["message_id"] in result
+    assert "red" not in result
+
+
+def test_common_terms_score_a_bounded_newest_first_candidate_set(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    agent = "chatty"
+    monkeypatch.setattr(history_index, "HISTORY_INDEX_CANDIDATES", 5)
+    H.write_all(root, agent, [{"role": "user", "content": f"the message number {i}"} for i in range(100)])
+    rare = H.append_turn(root, agent, "user", "the zebra appeared")
+
+    assert _ids(H.search(root, agent, "the zebra", k=3))[0] == rare["message_id"]
+    # Every message contains "the": only the 5 newest are considered
+    results = H.search(root, agent, "the", k=10)
+    assert len(results) == 5
+    assert results[0]["snippet"] in {f"the message number {i}" for i in range(96, 100)} | {"the zebra appeared"}
+
+    # Contents are not kept in memory; deletes beyond a quarter compact the postings
+    index = history_index.cached(root, agent)
+    assert not hasattr(next(iter(index._docs.values())), "content")
+    for record in H.load_all_turns(root, agent)[:80]:
+        H.delete_turn(root, agent, record["message_id"])
+    assert history_index.cached(root, agent) is index
+    assert index._stale < 80
+    assert len({doc_id for p in index._postings.values() for doc_id in p}) == len(index) + index._stale
+    assert H.search(root, agent, "number 85")[0]["snippet"] == "the message number 85"
@@ -0,0 +1,35 @@
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.orchestrator import tools
+
+SRC = str(Path(__file__).resolve().parents[1] / "src")
+
+
+def test_importing_main_skips_heavy_dependencies():
+    code = (
+        "import json, sys\n"
+        "import agent_host.app.main\n"
+        "heavy = ('chromadb', 'bs4', 'onnxruntime', 'agent_host.app.clients.duckduckgo')\n"
+        "print(json.dumps(sorted(m for m in sys.modules if m.split('.')[0] in heavy or m in heavy)))\n"
+    )
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([SRC, os.environ.get("PYTHONPATH", "")]), "WARMUP": "0"}
+    out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, env=env)
+    assert json.loads(out.stdout.strip().splitlines()[-1]) == []
+
+
+def test_string_handlers_resolve_on_first_use():
+    spec = tools.ToolSpec("t", "d", {}, handler="json:dumps")
+    assert spec._handler == "json:dumps"
+    assert spec.handler is json.dumps
+    assert spec._handler is json.dumps
+
+    web = tools.TOOLS["duckduckgo.search"]
+    from agent_host.app.orchestrator import web_tools
+    assert web.handler is web_tools.search
+    assert tools.TOOLS["duckduckgo.fetch_content"].handler is web_tools.fetch_content
@@ -0,0 +1,86 @@
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app import metrics
+import agent_host.app.main as main_module
+
+
+def test_histogram_exposition():
+    registry = []
+    hist = metrics.Histogram("test_latency_seconds", "Test latency.", ("stage",), buckets=(0.1, 1.0),
+                             registry=registry)
+    assert registry == [hist] and hist not in metrics._REGISTRY
+    hist.observe(0.05, stage="a")
+    hist.observe(0.5, stage="a")
+    hist.observe(5.0, stage="a")
+
+    text = hist.render()
+    assert "# TYPE test_latency_seconds histogram" in text
+    assert 'test_latency_seconds_bucket{stage="a",le="0.1"} 1' in text
+    assert 'test_latency_seconds_bucket{stage="a",le="1"} 2' in text
+    assert 'test_latency_seconds_bucket{stage="a",le="+Inf"} 3' in text
+    assert 'test_latency_seconds_count{stage="a"} 3' in text
+    assert 'test_latency_seconds_sum{stage="a"} 5.55' in text
+
+
+def test_relabel_llamacpp():
+    raw = (
+        "# HELP llamacpp:prompt_tokens_total Number of prompt tokens processed.\n"
+        "# TYPE llamacpp:prompt_tokens_total counter\n"
+        "llamacpp:prompt_tokens_total 1234\n"
+        "llamacpp:requests_deferred 2\n"
+    )
+    out = metrics.relabel_llamacpp(raw, "http://llama:50000").splitlines()
+    assert out == [
+        "# HELP agent_host_llamacpp_prompt_tokens_total Number of prompt tokens processed.",
+        "# TYPE agent_host_llamacpp_prompt_tokens_total counter",
+        'agent_host_llamacpp_prompt_tokens_total{backend="http://llama:50000"} 1234',
+        'agent_host_llamacpp_requests_deferred{backend="http://llama:50000"} 2',
+    ]
+
+
+def test_metrics_endpoint(monkeypatch):
+    scraped = []
+
+    async def fake_scrape(base_url):
+        scraped.append(base_url)
+        return 'agent_host_llamacpp_up{backend="fake"} 1'
+
+    monkeypatch.setattr(metrics, "scrape_llamacpp", fake_scrape)
+    monkeypatch.setattr(main_module, "LLAMACPP_BASE_URLS", ["http://only-backend:8080"])
+    metrics.TOOL_SECONDS.observe(0.2, tool="duckduckgo.search")
+
+    resp = TestClient(main_module.app).get("/metrics")
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/plain")
+    body = resp.text
+    assert "# TYPE agent_host_sessions_in_flight gauge" in body
+    assert 'agent_host_tool_seconds_count{tool="duckduckgo.search"}' in body
+    assert 'agent_host_llamacpp_up{backend="fake"} 1' in body
+    assert scraped == ["http://only-backend:8080"]
+
+
+def test_merged_backends_keep_each_family_contiguous():
+    def body(backend):
+        return metrics.relabel_llamacpp(
+            "# HELP llamacpp:prompt_tokens_total Prompt tokens.\n"
+            "# TYPE llamacpp:prompt_tokens_total counter\n"
+            "llamacpp:prompt_tokens_total 5\n"
+            "# TYPE llamacpp:latency histogram\n"
+            'llamacpp:latency_bucket{le="1"} 1\n'
+            "llamacpp:latency_sum 0.5\n"
+            "llamacpp:latency_count 1\n", backend)
+
+    lines = metrics.merge_families([body("a"), body("b")]).splitlines()
+    assert lines[:4] == [
+        "# HELP agent_host_llamacpp_prompt_tokens_total Prompt tokens.",
+        "# TYPE agent_host_llamacpp_prompt_tokens_total counter",
+        'agent_host_llamacpp_prompt_tokens_total{backend="a"} 5',
+        'agent_host_llamacpp_prompt_tokens_total{backend="b"} 5',
+    ]
+    assert lines[4] == "# TYPE agent_host_llamacpp_latency histogram"
+    assert len(lines) == 11 and all(not line.startswith("#") for line in lines[5:])
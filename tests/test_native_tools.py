@@ -0,0 +1,117 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.clients import llamacpp
+from agent_host.app.orchestrator import session
+from agent_host.app.orchestrator.tools import ToolSpec
+
+PROFILE = {"agent_id": "agent-n", "character": "Tester", "notes": "none"}
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+def test_merge_tool_call_deltas():
+    calls = []
+    llamacpp._merge_tool_call_deltas(calls, [
+        {"index": 0, "id": "call_1", "function": {"name": "duckduckgo__search", "arguments": '{"que'}}
+    ])
+    llamacpp._merge_tool_call_deltas(calls, [{"index": 0, "function": {"arguments": 'ry":"tea"}'}}])
+    assert calls == [{
+        "id": "call_1",
+        "type": "function",
+        "function": {"name": "duckduckgo__search", "arguments": '{"query":"tea"}'},
+    }]
+    assert list(session.parse_native_tool_calls(calls)) == [
+        ("call_1", "duckduckgo.search", {"query": "tea"})
+    ]
+
+
+@pytest.mark.anyio
+async def test_run_turn_native_tool_calls(tmp_path, monkeypatch):
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", str(tmp_path))
+    monkeypatch.setattr(session, "TOOL_CALL_MODE", "native")
+    monkeypatch.setattr(session, "native_tools_supported", lambda: True)
+
+    seen = {}
+
+    async def fake_stream_chat(messages, tool_calls=None, **kwargs):
+        seen["system"] = messages[0]["content"]
+        seen["tools"] = kwargs.get("tools")
+        tool_calls.append({
+            "id": "call_1",
+            "type": "function",
+            "function": {"name": "duckduckgo__search", "arguments": '{"query":"tea"}'},
+        })
+        yield "Searching."
+
+    async def fake_nonstream_chat(messages, **kwargs):
+        seen["followup"] = list(messages)
+        return {"text": "Found it.", "tool_calls": []}
+
+    payloads = []
+    original = session.TOOLS["duckduckgo.search"]
+    monkeypatch.setitem(session.TOOLS, "duckduckgo.search", ToolSpec(
+        original.name, original.description, original.schema,
+        handler=lambda p: payloads.append(p) or {"ok": True},
+    ))
+    monkeypatch.setattr(session, "stream_chat", fake_stream_chat)
+    monkeypatch.setattr(session, "nonstream_chat", fake_nonstream_chat)
+
+    events = [e async for e in session.run_turn(PROFILE, "find tea")]
+
+    assert "TOOL_CALL" not in seen["system"]
+    assert any(t["function"]["name"] == "duckduckgo__search" for t in seen["tools"])
+    assert payloads == [{"query": "tea"}]
+    assert seen["followup"][-2]["tool_calls"][0]["id"] == "call_1"
+    assert seen["followup"][-1] == {"role": "tool", "tool_call_id": "call_1", "content": "{'ok': True}"}
+    assert [e["type"] for e in events] == ["token", "tool", "token", "done"]
+
+
+@pytest.mark.anyio
+async def test_run_turn_falls_back_to_text_convention(tmp_path, monkeypatch):
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", str(tmp_path))
+    monkeypatch.setattr(session, "TOOL_CALL_MODE", "native")
+    monkeypatch.setattr(session, "native_tools_supported", lambda: True)
+
+    prompts = []
+
+    async def fake_stream_chat(messages, tool_calls=None, **kwargs):
+        prompts.append(messages[0]["content"])
+        if "tools" in kwargs:
+            raise llamacpp.NativeToolsUnsupported("tools param requires --jinja flag")
+        yield "plain answer"
+
+    monkeypatch.setattr(session, "stream_chat", fake_stream_chat)
+
+    events = [e async for e in session.run_turn(PROFILE, "hi")]
+
+    assert len(prompts) == 2
+    assert "TOOL_CALL" not in prompts[0]
+    assert "TOOL_CALL" in prompts[1]
+    assert events[0] == {"type": "token", "data": "plain answer"}
+
+
+def test_only_tool_rejections_disable_native_calls(monkeypatch):
+    monkeypatch.setattr(llamacpp, "_NATIVE_TOOLS_UNSUPPORTED", {})
+    payload = {"model": "m", "tools": [{"type": "function"}]}
+
+    # Busy slots, rate limits and server errors are not capability answers
+    for status_code, body in ((503, "slot unavailable"), (429, "too many requests"), (500, "tools crashed")):
+        llamacpp._check_tools_rejected(status_code, body, payload)
+    llamacpp._check_tools_rejected(400, "context length exceeded", payload)
+    assert llamacpp.native_tools_supported("m")
+
+    with pytest.raises(llamacpp.NativeToolsUnsupported):
+        llamacpp._check_tools_rejected(400, "tools param requires --jinja flag", payload)
+    assert not llamacpp.native_tools_supported("m")
+
+    # Re-checked after NATIVE_TOOLS_RECHECK_SECONDS
+    llamacpp._NATIVE_TOOLS_UNSUPPORTED["m"] = 0.0
+    assert llamacpp.native_tools_supported("m")
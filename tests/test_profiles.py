@@ -0,0 +1,100 @@
+import json
+import os
+import sys
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.agents import profiles
+from agent_host.app.models import AgentProfile
+
+
+def _profile(agent_id: str = "a1", notes: str = "none") -> AgentProfile:
+    return AgentProfile(agent_id=agent_id, character="Helper", notes=notes)
+
+
+def test_read_profile_is_cached_until_file_changes(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    profiles.write_profile(root, _profile())
+
+    loads = []
+    original_load = json.load
+
+    def counting_load(f):
+        loads.append(f.name)
+        return original_load(f)
+
+    monkeypatch.setattr(profiles.json, "load", counting_load)
+
+    assert profiles.read_profile(root, "a1").notes == "none"
+    assert profiles.read_profile(root, "a1").notes == "none"
+    assert loads == [], "profile written through the module should already be cached"
+
+    # External edit: new content and size, so the stat signature changes
+    path = tmp_path / "a1" / "profile.json"
+    path.write_text(json.dumps(_profile(notes="edited externally").model_dump()))
+    assert profiles.read_profile(root, "a1").notes == "edited externally"
+    assert len(loads) == 1
+
+
+def test_read_profile_returns_independent_copies(tmp_path):
+    root = tmp_path.as_posix()
+    profiles.write_profile(root, _profile())
+
+    prof = profiles.read_profile(root, "a1")
+    prof.notes = "mutated"
+    assert profiles.read_profile(root, "a1").notes == "none"
+
+
+def test_write_profile_is_atomic(tmp_path):
+    root = tmp_path.as_posix()
+    profiles.write_profile(root, _profile())
+    profiles.update_profile(root, "a1", {"notes": "updated"})
+
+    assert os.listdir(tmp_path / "a1") == ["profile.json"]
+    assert json.loads((tmp_path / "a1" / "profile.json").read_text())["notes"] == "updated"
+
+
+def test_list_profiles_uses_index(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    for agent_id in ("b", "a", "c"):
+        profiles.create_profile(root, _profile(agent_id))
+
+    assert [p.agent_id for p in profiles.list_profiles(root)] == ["a", "b", "c"]
+
+    monkeypatch.setattr(profiles, "PROFILE_CACHE_TTL", 3600.0)
+
+    def no_listdir(path):
+        raise AssertionError("listing within the TTL should not touch disk")
+
+    monkeypatch.setattr(profiles.os, "listdir", no_listdir)
+    assert [p.agent_id for p in profiles.list_profiles(root)] == ["a", "b", "c"]
+
+    profiles.delete_profile(root, "b")
+    profiles.create_profile(root, _profile("d"))
+    assert [p.agent_id for p in profiles.list_profiles(root)] == ["a", "c", "d"]
+
+
+def test_write_profile_keeps_file_mode(tmp_path):
+    root = tmp_path.as_posix()
+    profiles.write_profile(root, _profile())
+    path = tmp_path / "a1" / "profile.json"
+    assert path.stat().st_mode & 0o777 == 0o666 & ~profiles._UMASK
+
+    os.chmod(path, 0o640)
+    profiles.update_profile(root, "a1", {"notes": "updated"})
+    assert path.stat().st_mode & 0o777 == 0o640
+
+
+def test_list_profiles_sees_profile_created_in_existing_dir(tmp_path, monkeypatch):
+    root = tmp_path.as_posix()
+    profiles.create_profile(root, _profile("a"))
+    # e.g. chat history written before the profile existed
+    (tmp_path / "b").mkdir()
+    assert [p.agent_id for p in profiles.list_profiles(root)] == ["a"]
+
+    root_mtime = os.stat(root).st_mtime_ns
+    (tmp_path / "b" / "profile.json").write_text(json.dumps(_profile("b").model_dump()))
+    assert os.stat(root).st_mtime_ns == root_mtime
+    monkeypatch.setattr(profiles, "PROFILE_CACHE_TTL", 0.0)
+    assert [p.agent_id for p in profiles.list_profiles(root)] == ["a", "b"]
@@ -0,0 +1,93 @@
+import sys
+import threading
+import time
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app import config, profiling
+from agent_host.app.orchestrator import session
+import agent_host.app.main as main_module
+
+PROFILE = {"agent_id": "agent-p", "character": "Tester", "notes": "none"}
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+def _busy_until(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampler_collapses_thread_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=_busy_until, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        with profiling.StackSampler(interval=0.002) as sampler:
+            time.sleep(0.1)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert sampler.samples > 0
+    lines = sampler.collapsed().splitlines()
+    busy = [line for line in lines if line.startswith("busy-worker;")]
+    assert busy and all(line.rsplit(" ", 1)[1].isdigit() for line in busy)
+    assert any(f"{__name__}:_busy_until" in line for line in busy)
+    assert not any(line.startswith("stack-sampler;") for line in lines)
+
+
+def test_watchdog_saves_only_slow_turns(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "STACK_PROFILE_DIR", str(tmp_path))
+    watchdog = profiling.SlowTurnWatchdog(threshold=0.05, interval=0.002)
+
+    fast = watchdog.begin("fast")
+    assert watchdog.end(fast) is None
+
+    slow = watchdog.begin("slow")
+    time.sleep(0.3)
+    path = watchdog.end(slow)
+
+    assert path == str(tmp_path / "slow-slow.folded")
+    assert "test_watchdog_saves_only_slow_turns" in Path(path).read_text()
+    assert profiling.list_saved() == ["slow-slow.folded"]
+
+
+@pytest.mark.anyio
+async def test_profiled_turn_returns_collapsed_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", str(tmp_path / "agents"))
+    monkeypatch.setattr(config, "STACK_PROFILE_DIR", str(tmp_path / "profiles"))
+
+    async def fake_stream_chat(messages, **kwargs):
+        time.sleep(0.05)  # blocking work the sampler should see
+        yield "hi"
+
+    monkeypatch.setattr(session, "stream_chat", fake_stream_chat)
+
+    events = [e async for e in session.run_turn(PROFILE, "hello", profile_stacks=True)]
+    info = events[-1]["data"]["profile"]
+
+    assert info["samples"] > 0
+    assert "fake_stream_chat" in Path(info["path"]).read_text()
+
+
+def test_admin_profile_endpoints(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "STACK_PROFILE_DIR", str(tmp_path))
+    client = TestClient(main_module.app)
+
+    resp = client.post("/admin/profile", params={"seconds": 0.05})
+    assert resp.status_code == 200
+    assert resp.text.strip()
+
+    names = client.get("/admin/profiles").json()["profiles"]
+    assert len(names) == 1
+    assert client.get(f"/admin/profiles/{names[0]}").text == resp.text
+    assert client.get("/admin/profiles/missing.folded").status_code == 404
+    assert client.post("/admin/profile", params={"seconds": 120}).status_code == 400
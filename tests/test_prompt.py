@@ -0,0 +1,55 @@
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.orchestrator import prompt
+from agent_host.app.orchestrator import tools as tool_registry
+
+PROFILE = {"agent_id": "a1", "character": "You are a helper", "notes": "likes tea"}
+
+
+def test_compile_prompt_sections_and_order():
+    compiled = prompt.compile_prompt(PROFILE, now=datetime(2025, 9, 28, 14, 30, 15))
+    text = compiled.text
+
+    assert text.startswith("You are a helper.\nSystem-managed notes: likes tea")
+    assert text.endswith("Current date: 2025-09-28\nCurrent time: 14:30:15\n")
+    assert text.index("AVAILABLE TOOLS:") < text.index("Current date:")
+    assert compiled.static_prefix in text
+    assert "Current time" not in compiled.static_prefix
+
+    lengths = compiled.token_lengths()
+    assert set(lengths) == {"character", "tools", "volatile"}
+    assert all(n > 0 for n in lengths.values())
+
+
+def test_tool_schemas_are_canonical_json():
+    catalog = prompt.render_tool_catalog()
+    for spec in tool_registry.TOOLS.values():
+        rendered = json.dumps(spec.schema, sort_keys=True, separators=(",", ":"))
+        assert f"Input JSON schema: {rendered}" in catalog
+
+
+def test_catalog_cached_per_registry_version(monkeypatch):
+    first = prompt.render_tool_catalog()
+    assert prompt.render_tool_catalog() is first
+
+    monkeypatch.setattr(tool_registry, "TOOLS", dict(tool_registry.TOOLS))
+    monkeypatch.setattr(prompt, "_catalog_cache", prompt._catalog_cache)
+    tool_registry.register(tool_registry.ToolSpec(
+        name="test.echo",
+        description="Echo the payload back.",
+        schema={"type": "object", "properties": {"text": {"type": "string"}}},
+        handler=lambda payload: payload,
+    ))
+    updated = prompt.render_tool_catalog()
+    assert "- test.echo" in updated
+    assert updated is not first
+
+
+def test_prompt_without_tools():
+    compiled = prompt.compile_prompt(PROFILE, include_tools=False)
+    assert "TOOL_CALL" not in compiled.text
@@ -0,0 +1,66 @@
+import json
+import pickle
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app import config
+from agent_host.app.clients.embeddings import RemoteEmbeddingFunction
+from agent_host.app.memory import chroma_store
+
+
+@pytest.fixture()
+def server():
+    """Fake /v1/embeddings: vector = [len(text), index]; answers in reverse order."""
+    requests = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        assert request.url.path == "/v1/embeddings"
+        body = json.loads(request.content)
+        requests.append(body["input"])
+        data = [{"index": i, "embedding": [float(len(t)), 1.0]} for i, t in enumerate(body["input"])]
+        return httpx.Response(200, json={"data": list(reversed(data))})
+
+    return requests, httpx.MockTransport(handler)
+
+
+def test_batches_and_caches_requests(server):
+    requests, transport = server
+    embed = RemoteEmbeddingFunction("http://embed:8080", batch_size=2, transport=transport)
+
+    vectors = embed(["a", "bb", "ccc", "a"])
+    assert [v[0] for v in vectors] == [1.0, 2.0, 3.0, 1.0]
+    assert requests == [["a", "bb"], ["ccc"]]
+
+    assert embed.embed_query(["bb", "dddd"])[1] == [4.0, 1.0]
+    assert requests[-1] == ["dddd"]
+
+
+def test_cache_is_bounded_and_pickling_drops_the_client(server):
+    requests, transport = server
+    embed = RemoteEmbeddingFunction("http://embed:8080", cache_size=1, transport=transport)
+    embed(["a"])
+    embed(["b"])
+    embed(["a"])
+    assert requests == [["a"], ["b"], ["a"]]
+
+    pooled = RemoteEmbeddingFunction("http://embed:8080")
+    pooled.client()
+    clone = pickle.loads(pickle.dumps(pooled))
+    assert clone._client is None and clone.base_url == "http://embed:8080"
+
+
+def test_chroma_store_selects_remote_backend(monkeypatch, server):
+    monkeypatch.setattr(config, "EMBEDDING_BACKEND", "remote")
+    monkeypatch.setattr(chroma_store, "_remote_embedding", None)
+    chroma_store.reset_clients()
+    try:
+        embed = chroma_store.embedding_function()
+        assert isinstance(embed, RemoteEmbeddingFunction)
+        assert chroma_store.batchers()[0].fn == embed
+    finally:
+        chroma_store.reset_clients()
@@ -0,0 +1,128 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.clients import llamacpp
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+URLS = ["http://llama-a:50000", "http://llama-b:50000", "http://llama-c:50000"]
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeBackends:
+    """Several fake llama-servers behind one MockTransport, told apart by host."""
+
+    def __init__(self):
+        self.hits = {}
+        self.down = set()
+        self.busy_slots = {}
+        self.release = None  # when set, completions wait for it
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host in self.down:
+            raise httpx.ConnectError("connection refused", request=request)
+        if request.url.path == "/slots":
+            busy = self.busy_slots.get(host, 0)
+            return httpx.Response(200, json=[{"id": i, "is_processing": i < busy} for i in range(2)])
+        self.hits[host] = self.hits.get(host, 0) + 1
+        if self.release is not None:
+            await self.release.wait()
+        body = json.loads(request.content)
+        if body["stream"]:
+            chunk = {"choices": [{"delta": {"content": host}}]}
+            text = f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n"
+            return httpx.Response(200, text=text, headers={"content-type": "text/event-stream"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": host}}]})
+
+
+@pytest.fixture()
+def backends(monkeypatch):
+    fake = FakeBackends()
+    router = llamacpp.Router(URLS, transport=httpx.MockTransport(fake.handler))
+    monkeypatch.setattr(llamacpp, "ROUTER", router)
+    fake.router = router
+    return fake
+
+
+@pytest.mark.anyio
+async def test_failover_before_first_token(backends):
+    backends.down.add("llama-a")
+    backends.router.backends[1].outstanding = 5  # steer the first pick to llama-a
+    backends.router.backends[2].outstanding = 5
+
+    tokens = [t async for t in llamacpp.stream_chat(MESSAGES)]
+    assert tokens in (["llama-b"], ["llama-c"])
+    assert backends.router.backends[0].healthy is False
+
+    out = await llamacpp.nonstream_chat(MESSAGES)
+    assert out["text"] in ("llama-b", "llama-c")
+
+
+@pytest.mark.anyio
+async def test_all_backends_down_raises(backends):
+    backends.down.update({"llama-a", "llama-b", "llama-c"})
+    with pytest.raises(httpx.ConnectError):
+        await llamacpp.nonstream_chat(MESSAGES)
+
+
+@pytest.mark.anyio
+async def test_least_outstanding_spreads_concurrent_requests(backends):
+    backends.release = asyncio.Event()
+    calls = [asyncio.create_task(llamacpp.nonstream_chat(MESSAGES)) for _ in range(3)]
+    await asyncio.sleep(0.05)
+    assert [b.outstanding for b in backends.router.backends] == [1, 1, 1]
+
+    backends.release.set()
+    results = await asyncio.gather(*calls)
+    assert sorted(r["text"] for r in results) == ["llama-a", "llama-b", "llama-c"]
+    assert [b.outstanding for b in backends.router.backends] == [0, 0, 0]
+
+
+@pytest.mark.anyio
+async def test_agent_affinity_sticks_until_backend_is_full(backends):
+    first = await llamacpp.nonstream_chat(MESSAGES, affinity="agent-1")
+    backends.router.backends[0].outstanding = 1  # others now look less loaded
+    again = await llamacpp.nonstream_chat(MESSAGES, affinity="agent-1")
+    assert again["text"] == first["text"]
+
+    pinned = next(b for b in backends.router.backends if b.url.endswith(first["text"] + ":50000"))
+    pinned.idle_slots = 0
+    moved = await llamacpp.nonstream_chat(MESSAGES, affinity="agent-1")
+    assert moved["text"] != first["text"]
+
+
+@pytest.mark.anyio
+async def test_poll_reads_slots_and_health(backends):
+    backends.busy_slots = {"llama-a": 2, "llama-b": 1}
+    backends.down.add("llama-c")
+    await backends.router.poll()
+
+    a, b, c = backends.router.backends
+    assert (a.idle_slots, a.total_slots, a.healthy) == (0, 2, True)
+    assert (b.idle_slots, b.total_slots, b.healthy) == (1, 2, True)
+    assert c.healthy is False
+    assert backends.router.pick().url == URLS[1]
+
+    backends.down.clear()
+    await backends.router.poll()
+    assert c.healthy is True
+
+
+def test_slot_ids_dropped_with_several_backends():
+    payload = {"id_slot": 2}
+    llamacpp.Router(URLS).prepare(payload)
+    assert payload == {}
+    payload = {"id_slot": 2}
+    llamacpp.Router(URLS[:1]).prepare(payload)
+    assert payload == {"id_slot": 2}
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.agents import profiles
+from agent_host.app.models import AgentProfile
+from agent_host.app.orchestrator import scheduler, session
+import agent_host.app.main as main_module
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.mark.anyio
+async def test_scheduler_bounds_concurrency_and_prefers_same_prefix():
+    sched = scheduler.SlotScheduler(slots=2)
+    running = 0
+    peak = 0
+
+    async def job():
+        nonlocal running, peak
+        async with sched.slot("k"):
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    await asyncio.gather(*(job() for _ in range(6)))
+    assert peak == 2
+    assert sched.queue_depth == 0
+
+    slot_a = await sched.acquire("a")
+    slot_b = await sched.acquire("b")
+    sched.release(slot_a, "a")
+    sched.release(slot_b, "b")
+    assert await sched.acquire("b") == slot_b
+    assert await sched.acquire("a") == slot_a
+
+
+@pytest.mark.anyio
+async def test_cancelled_waiter_passes_on_its_slot():
+    sched = scheduler.SlotScheduler(slots=1)
+    held = await sched.acquire()
+    first = asyncio.create_task(sched.acquire())
+    second = asyncio.create_task(sched.acquire())
+    await asyncio.sleep(0)
+
+    sched.release(held)
+    first.cancel()
+    assert await asyncio.wait_for(second, 1) == held
+
+
+def test_batch_endpoint_streams_ndjson_with_pinned_slots(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    monkeypatch.setattr(main_module, "CHROMA_PERSIST_ROOT", root)
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", root)
+    for agent_id in ("a1", "a2"):
+        profiles.write_profile(root, AgentProfile(agent_id=agent_id, character="Tester", notes=""))
+
+    in_flight = 0
+    peak = 0
+    slots_seen = []
+
+    async def fake_nonstream_chat(messages, **kwargs):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        slots_seen.append(kwargs.get("id_slot"))
+        await asyncio.sleep(0.01)
+        in_flight -= 1
+        return {"text": f"reply to {messages[-1]['content']}", "tool_calls": [], "raw": {}}
+
+    monkeypatch.setattr(session, "nonstream_chat", fake_nonstream_chat)
+
+    requests = [{"agent_id": "a1" if i % 2 else "a2", "user": f"q{i}"} for i in range(10)]
+    requests.append({"agent_id": "ghost", "user": "hi"})
+    resp = TestClient(main_module.app).post("/chat/batch", json={"requests": requests})
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("application/x-ndjson")
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert sorted(r["index"] for r in lines) == list(range(11))
+    by_index = {r["index"]: r for r in lines}
+    assert by_index[10]["ok"] is False
+    assert by_index[3]["ok"] is True and by_index[3]["text"] == "reply to q3"
+    assert peak <= scheduler.SCHEDULER.slots
+    assert all(slot is not None for slot in slots_seen)
+
+
+@pytest.mark.anyio
+async def test_acquire_serves_waiters_in_arrival_order():
+    sched = scheduler.SlotScheduler(slots=1)
+    held = await sched.acquire("a")
+    order = []
+
+    async def waiter(name, key):
+        slot = await sched.acquire(key)
+        order.append(name)
+        sched.release(slot, key)
+
+    tasks = [asyncio.create_task(waiter("w1", "b")), asyncio.create_task(waiter("w2", "c"))]
+    await asyncio.sleep(0)
+    sched.release(held, "a")
+    # A newcomer with the freed slot's key must queue behind w1 and w2
+    late = asyncio.create_task(waiter("late", "a"))
+    await asyncio.gather(*tasks, late)
+    assert order == ["w1", "w2", "late"]
+
+
+@pytest.mark.anyio
+async def test_run_batch_serializes_turns_per_agent(tmp_path, monkeypatch):
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", str(tmp_path))
+    running = {}
+    overlap = []
+    seen = []
+
+    async def fake_nonstream_chat(messages, **kwargs):
+        agent = kwargs["affinity"]
+        if running.get(agent):
+            overlap.append(agent)
+        running[agent] = True
+        seen.append((agent, messages[-1]["content"]))
+        await asyncio.sleep(0.01)
+        running[agent] = False
+        return {"text": "ok", "tool_calls": [], "raw": {}}
+
+    monkeypatch.setattr(session, "nonstream_chat", fake_nonstream_chat)
+
+    class Req:
+        temperature = None
+        seed = None
+
+        def __init__(self, user, tools):
+            self.user = user
+            self.tool_calls_allowed = tools
+
+    items = []
+    for i in range(6):
+        agent = "x" if i % 2 else "y"
+        profile = {"agent_id": agent, "character": "Tester", "notes": ""}
+        # Differing tool settings give one agent's turns different prefix keys
+        items.append((i, profile, Req(f"q{i}", i % 3 != 0)))
+    results = [r async for r in scheduler.run_batch(items, scheduler=scheduler.SlotScheduler(slots=4))]
+
+    assert all(r["ok"] for r in results)
+    assert overlap == []
+    assert [u for a, u in seen if a == "x"] == ["q1", "q3", "q5"]
+    assert [u for a, u in seen if a == "y"] == ["q0", "q2", "q4"]
+    history = session.H.load_history(str(tmp_path), "x")
+    assert [m["content"] for m in history] == ["q1", "ok", "q3", "ok", "q5", "ok"]
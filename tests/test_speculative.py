@@ -0,0 +1,97 @@
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app.orchestrator import session
+from agent_host.app.orchestrator.tools import ToolSpec
+
+PROFILE = {"agent_id": "agent-s", "character": "Tester", "notes": "none"}
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture()
+def search_calls(tmp_path, monkeypatch):
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", str(tmp_path))
+    monkeypatch.setattr(session, "SPECULATIVE_PREFETCH", True)
+    monkeypatch.setattr(session, "SPECULATIVE_TOOLS", ["duckduckgo.search"])
+
+    calls = []
+    original = session.TOOLS["duckduckgo.search"]
+    monkeypatch.setitem(session.TOOLS, "duckduckgo.search", ToolSpec(
+        original.name, original.description, original.schema,
+        handler=lambda p: calls.append(p) or {"results": ["tea.example"]},
+    ))
+
+    async def fake_nonstream_chat(messages, **kwargs):
+        return {"text": "done", "tool_calls": []}
+
+    monkeypatch.setattr(session, "nonstream_chat", fake_nonstream_chat)
+    return calls
+
+
+def _fake_stream(text):
+    async def fake_stream_chat(messages, **kwargs):
+        yield text
+    return fake_stream_chat
+
+
+@pytest.mark.anyio
+async def test_tool_call_served_from_prefetch(search_calls, monkeypatch):
+    monkeypatch.setattr(session, "stream_chat", _fake_stream(
+        'TOOL_CALL: {"name":"duckduckgo.search","payload":{"query":"Tea prices","k":5}}'
+    ))
+
+    events = [e async for e in session.run_turn(PROFILE, "tea  prices")]
+
+    assert search_calls == [{"query": "tea  prices"}], "handler should only run speculatively"
+    tool_event = next(e for e in events if e["type"] == "tool")
+    assert "tea.example" in tool_event["data"]["Tool result"]
+    summary = events[-1]["data"]["speculative"]
+    assert (summary["hits"], summary["misses"], summary["cancelled"]) == (1, 0, 0)
+
+
+@pytest.mark.anyio
+async def test_unused_prefetch_is_cancelled(search_calls, monkeypatch):
+    monkeypatch.setattr(session, "stream_chat", _fake_stream("No tools needed."))
+
+    events = [e async for e in session.run_turn(PROFILE, "hello")]
+
+    summary = events[-1]["data"]["speculative"]
+    assert (summary["hits"], summary["misses"], summary["cancelled"]) == (0, 0, 1)
+
+
+@pytest.mark.anyio
+async def test_agent_scoped_prefetch_is_keyed_on_session_agent(tmp_path, monkeypatch):
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", str(tmp_path))
+    monkeypatch.setattr(session, "SPECULATIVE_PREFETCH", True)
+    monkeypatch.setattr(session, "SPECULATIVE_TOOLS", ["memory.retrieve"])
+    calls = []
+    monkeypatch.setitem(session.TOOLS, "memory.retrieve", ToolSpec(
+        "memory.retrieve", "Look up memories.",
+        {"type": "object", "properties": {
+            "agent_id": {"type": "string", "default": "default"},
+            "query": {"type": "string"},
+        }},
+        handler=lambda p: calls.append(p) or {"results": ["green tea"]},
+    ))
+    monkeypatch.setattr(session, "stream_chat", _fake_stream(
+        'TOOL_CALL: {"name":"memory.retrieve","payload":{"query":"favourite tea"}}'
+    ))
+
+    async def fake_nonstream_chat(messages, **kwargs):
+        return {"text": "done", "tool_calls": []}
+
+    monkeypatch.setattr(session, "nonstream_chat", fake_nonstream_chat)
+
+    events = [e async for e in session.run_turn(PROFILE, "Favourite tea")]
+
+    assert calls == [{"query": "Favourite tea", "agent_id": "agent-s"}]
+    summary = events[-1]["data"]["speculative"]
+    assert (summary["hits"], summary["misses"]) == (1, 0)
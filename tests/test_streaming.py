@@ -0,0 +1,145 @@
+import asyncio
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app import streaming
+from agent_host.app.agents import profiles
+from agent_host.app.models import AgentProfile
+from agent_host.app.orchestrator import session
+import agent_host.app.main as main_module
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+async def _turn(n, closed=None):
+    try:
+        for i in range(n):
+            yield {"type": "token", "data": f"t{i} "}
+            await asyncio.sleep(0)
+        yield {"type": "done", "data": {}}
+    finally:
+        if closed is not None:
+            closed.append(True)
+
+
+def _text(batches):
+    return "".join(ev["data"] for batch in batches for ev in batch if ev["type"] == "token")
+
+
+async def _consume(buffer, delay=0.0, window=0.0, max_bytes=1 << 20):
+    batches = []
+    async for batch in buffer.batches(window, max_bytes):
+        batches.append(batch)
+        await asyncio.sleep(delay)
+    return batches
+
+
+@pytest.mark.anyio
+async def test_coalesce_policy_keeps_every_token_within_bound():
+    buffer = streaming.EventBuffer(maxsize=4, policy="coalesce")
+    producer = asyncio.create_task(streaming.pump(_turn(200), buffer))
+    batches = await _consume(buffer, delay=0.01)
+    await producer
+
+    assert _text(batches) == "".join(f"t{i} " for i in range(200))
+    assert batches[-1][-1]["type"] == "done"
+    assert len(batches) < 200
+    assert all(len(batch) <= 4 for batch in batches)
+
+
+@pytest.mark.anyio
+async def test_drop_policy_defers_tokens_to_the_final_chunk():
+    buffer = streaming.EventBuffer(maxsize=4, policy="drop")
+    await streaming.pump(_turn(50), buffer)  # client reads nothing until the turn is over
+    batches = await _consume(buffer)
+
+    events = [ev for batch in batches for ev in batch]
+    assert _text(batches) == "".join(f"t{i} " for i in range(50))
+    assert events[-1]["type"] == "done"
+    assert events[-1]["data"]["deferred_tokens"] > 0
+
+
+@pytest.mark.anyio
+async def test_abort_policy_closes_the_turn():
+    closed = []
+    buffer = streaming.EventBuffer(maxsize=4, policy="abort")
+    await streaming.pump(_turn(50, closed), buffer)
+    batches = await _consume(buffer)
+
+    assert closed == [True]
+    assert batches[-1][-1]["type"] == "error"
+
+
+@pytest.mark.anyio
+async def test_tokens_batched_by_window_and_bytes():
+    buffer = streaming.EventBuffer(maxsize=1000)
+    producer = asyncio.create_task(streaming.pump(_turn(100), buffer))
+    batches = await _consume(buffer, window=0.05, max_bytes=40)
+    await producer
+
+    assert len(batches[0]) == 1  # first token is not held back
+    sizes = [len(_text([b])) for b in batches[1:-1]]
+    assert sizes and all(size >= 40 for size in sizes)
+
+
+def test_sse_chat_sends_fewer_chunks_than_tokens(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    monkeypatch.setattr(main_module, "CHROMA_PERSIST_ROOT", root)
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", root)
+    profiles.write_profile(root, AgentProfile(agent_id="a1", character="Tester", notes=""))
+
+    async def fake_stream_chat(messages, **kwargs):
+        for i in range(100):
+            yield f"w{i} "
+
+    monkeypatch.setattr(session, "stream_chat", fake_stream_chat)
+
+    resp = TestClient(main_module.app).post("/chat", json={"agent_id": "a1", "user": "hi"})
+    chunks = []
+    event = None
+    for line in resp.text.splitlines():
+        if line.startswith("event:"):
+            event = line.split(":", 1)[1].strip()
+        elif line.startswith("data:") and event == "chunk":
+            chunks.append(line[len("data: "):])
+
+    assert "".join(chunks) == "".join(f"w{i} " for i in range(100))
+    assert len(chunks) < 100
+
+
+@pytest.mark.anyio
+async def test_failing_turn_still_closes_the_buffer():
+    async def broken_turn():
+        yield {"type": "token", "data": "partial"}
+        raise RuntimeError("backend went away")
+
+    buffer = streaming.EventBuffer(maxsize=8)
+    producer = asyncio.create_task(streaming.pump(broken_turn(), buffer))
+    batches = await asyncio.wait_for(_consume(buffer), 1)
+    assert batches[-1][-1] == {"type": "error", "data": "backend went away"}
+    with pytest.raises(RuntimeError):
+        await producer
+
+
+def test_sse_chat_ends_when_the_turn_raises(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    monkeypatch.setattr(main_module, "CHROMA_PERSIST_ROOT", root)
+    profiles.write_profile(root, AgentProfile(agent_id="a1", character="Tester", notes=""))
+
+    async def broken_run_turn(*args, **kwargs):
+        yield {"type": "token", "data": "partial"}
+        raise RuntimeError("backend went away")
+
+    monkeypatch.setattr(main_module, "run_turn", broken_run_turn)
+
+    # The stream ends (instead of waiting forever) and the turn's own error surfaces
+    with pytest.raises(RuntimeError, match="backend went away"):
+        TestClient(main_module.app).post("/chat", json={"agent_id": "a1", "user": "hi"})
@@ -0,0 +1,92 @@
+import json
+import sys
+from pathlib import Path
+
+import httpx
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app import tracing
+from agent_host.app.orchestrator import session
+
+PROFILE = {"agent_id": "agent-t", "character": "Tester", "notes": "none"}
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+def test_span_tree_and_otlp_payload():
+    trace = tracing.Trace("turn", agent_id="a1")
+    with trace.span("history.load") as span:
+        span.attributes["records"] = 3
+    with trace.span("llm", phase="reply"):
+        with trace.span("llm", phase="tool_call"):
+            pass
+    trace.finish()
+
+    summary = trace.summary()
+    assert summary["name"] == "turn"
+    assert [c["name"] for c in summary["children"]] == ["history.load", "llm"]
+    assert summary["children"][1]["children"][0]["attributes"] == {"phase": "tool_call"}
+
+    body = tracing.to_otlp(trace)
+    spans = body["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    assert len(spans) == 4
+    assert all(s["traceId"] == trace.trace_id for s in spans)
+    by_id = {s["spanId"]: s for s in spans}
+    nested = spans[3]
+    assert by_id[nested["parentSpanId"]]["name"] == "llm"
+    assert {"key": "records", "value": {"intValue": "3"}} in spans[1]["attributes"]
+
+
+@pytest.mark.anyio
+async def test_export_otlp_to_collector_stand_in():
+    received = []
+
+    def collector(request: httpx.Request) -> httpx.Response:
+        received.append((request.url.path, json.loads(request.content)))
+        return httpx.Response(200, json={"partialSuccess": {}})
+
+    trace = tracing.Trace("turn")
+    trace.finish()
+    ok = await tracing.export_otlp(trace, "http://collector:4318", transport=httpx.MockTransport(collector))
+
+    assert ok is True
+    assert received[0][0] == "/v1/traces"
+    assert received[0][1]["resourceSpans"][0]["scopeSpans"][0]["spans"][0]["name"] == "turn"
+
+
+def test_trace_log_rotates(tmp_path):
+    path = (tmp_path / "traces" / "turns.jsonl").as_posix()
+    for _ in range(3):
+        trace = tracing.Trace("turn")
+        trace.finish()
+        tracing.append_trace_log(trace, path, max_bytes=200)
+
+    assert Path(path + ".1").exists()
+    assert json.loads(Path(path).read_text().splitlines()[-1])["name"] == "turn"
+
+
+@pytest.mark.anyio
+async def test_done_event_carries_turn_trace(tmp_path, monkeypatch):
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", str(tmp_path))
+
+    async def fake_stream_chat(messages, stats=None, **kwargs):
+        stats["timings"] = {"prompt_n": 12, "cache_n": 30, "predicted_n": 2}
+        yield "hi"
+        yield " there"
+
+    monkeypatch.setattr(session, "stream_chat", fake_stream_chat)
+
+    events = [e async for e in session.run_turn(PROFILE, "hello")]
+    trace = events[-1]["data"]["trace"]
+
+    names = [c["name"] for c in trace["children"]]
+    assert names == ["prompt_build", "history.load", "history.append", "llm", "history.append"]
+    llm = trace["children"][3]
+    assert llm["attributes"]["prompt_tokens"] == 12
+    assert llm["attributes"]["cached_tokens"] == 30
+    assert llm["attributes"]["generated_tokens"] == 2
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app import config
+from agent_host.app.memory import chroma_store, migrate, numpy_store
+from agent_host.app.memory.embedding import EmbedderMismatch
+
+
+class HashEmbedding:
+    """Bag-of-words hashing embedding, so the tests need no model download."""
+
+    dim = 64
+
+    def __call__(self, input):
+        out = []
+        for text in input:
+            vec = [0.0] * self.dim
+            for word in text.lower().split():
+                vec[int(hashlib.md5(word.encode()).hexdigest(), 16) % self.dim] += 1.0
+            norm = sum(v * v for v in vec) ** 0.5 or 1.0
+            out.append([v / norm for v in vec])
+        return out
+
+    def embed_query(self, input):
+        return self(input)
+
+    @staticmethod
+    def name():
+        return "test-hash"
+
+    def is_legacy(self):
+        return False
+
+
+class SmallHashEmbedding(HashEmbedding):
+    dim = 32
+
+    @staticmethod
+    def name():
+        return "test-hash-small"
+
+
+@pytest.fixture()
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(chroma_store, "embedding_function", lambda: HashEmbedding())
+    chroma_store.reset_clients()
+    yield tmp_path.as_posix()
+    chroma_store.reset_clients()
+
+
+def _texts(results):
+    return sorted(r["text"] for r in results)
+
+
+@pytest.mark.parametrize("layout", ["per_agent", "collection", "shared"])
+def test_layouts_keep_agents_apart(store, monkeypatch, layout):
+    monkeypatch.setattr(config, "CHROMA_LAYOUT", layout)
+    a_ids = chroma_store.upsert_memories("alice", store, [
+        {"memory_id": "m1", "text": "alice likes green tea", "tag": "food"},
+        {"text": "alice flies to Oslo", "tag": "travel"},
+    ])
+    chroma_store.upsert_memories("bob", store, [{"memory_id": "m1", "text": "bob likes black coffee", "tag": "food"}])
+
+    alice = chroma_store.query_memories("alice", store, "likes", k=10)
+    assert _texts(alice) == ["alice flies to Oslo", "alice likes green tea"]
+    assert all("agent_id" not in r["metadata"] for r in alice)
+    assert {r["memory_id"] for r in alice} == set(a_ids)
+
+    food = chroma_store.query_memories("alice", store, "likes", k=10, where={"tag": "food"})
+    assert [r["memory_id"] for r in food] == ["m1"]
+
+    assert chroma_store.update_memory("bob", store, "m1", {"text": "bob likes tea now"})
+    chroma_store.delete_memory("alice", store, "m1")
+    assert _texts(chroma_store.query_memories("alice", store, "likes", k=10)) == ["alice flies to Oslo"]
+    assert _texts(chroma_store.query_memories("bob", store, "likes", k=10)) == ["bob likes tea now"]
+
+
+@pytest.mark.parametrize("layout", ["collection", "shared"])
+def test_migrate_from_per_agent(store, monkeypatch, layout):
+    monkeypatch.setattr(config, "CHROMA_LAYOUT", "per_agent")
+    for agent in ("alice", "bob"):
+        chroma_store.upsert_memories(agent, store, [
+            {"memory_id": f"{agent}-{i}", "text": f"{agent} note {i}", "type": "fact"} for i in range(3)
+        ])
+
+    results = migrate.migrate(store, layout)
+    assert results == {"alice": (migrate.COPIED, 3), "bob": (migrate.COPIED, 3)}
+
+    monkeypatch.setattr(config, "CHROMA_LAYOUT", layout)
+    res = chroma_store.query_memories("bob", store, "note", k=10)
+    assert sorted(r["memory_id"] for r in res) == ["bob-0", "bob-1", "bob-2"]
+    assert all(r["metadata"]["type"] == "fact" for r in res)
+
+
+def test_migrate_keeps_stores_that_did_not_copy(store, monkeypatch):
+    monkeypatch.setattr(config, "CHROMA_LAYOUT", "per_agent")
+    for agent in ("alice", "bob"):
+        chroma_store.upsert_memories(agent, store, [{"memory_id": f"{agent}-0", "text": f"{agent} note"}])
+    (Path(store) / "carol" / "memory").mkdir(parents=True)  # a store without a collection
+    chroma_store.reset_clients()
+
+    real_client = migrate.chromadb.PersistentClient
+
+    def flaky_client(path, **kwargs):
+        if "bob" in path:
+            raise RuntimeError("database is locked")
+        return real_client(path, **kwargs)
+
+    monkeypatch.setattr(migrate.chromadb, "PersistentClient", flaky_client)
+    results = migrate.migrate(store, "shared", remove_old=True)
+
+    assert results["alice"] == (migrate.COPIED, 1)
+    assert results["bob"] == (migrate.FAILED, 0)
+    assert results["carol"] == (migrate.ABSENT, 0)
+    assert not (Path(store) / "alice" / "memory").exists()
+    assert (Path(store) / "bob" / "memory").exists()
+    assert (Path(store) / "carol" / "memory").exists()
+
+
+@pytest.mark.parametrize("dtype", ["float16", "int8"])
+def test_numpy_backend_roundtrip(store, monkeypatch, dtype):
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(config, "NUMPY_STORE_DTYPE", dtype)
+    chroma_store.upsert_memories("small", store, [
+        {"memory_id": "tea", "text": "likes green tea", "tag": "food", "date": 20250901},
+        {"memory_id": "oslo", "text": "flies to Oslo in May", "tag": "travel", "date": 20250510},
+        {"memory_id": "coffee", "text": "hates black coffee", "tag": "food", "date": 20240101},
+    ])
+    assert isinstance(chroma_store.backend_for("small", store), numpy_store.NumpyStore)
+    assert not (Path(store) / "small" / "memory").exists()
+
+    res = chroma_store.query_memories("small", store, "likes green tea", k=2)
+    assert res[0]["memory_id"] == "tea"
+    assert res[0]["distance"] == pytest.approx(0.0, abs=0.02)
+    assert res[0]["metadata"]["tag"] == "food"
+
+    filtered = chroma_store.query_memories("small", store, "tea", k=5,
+                                           where={"tag": "food", "date": {"$gt": 20250000}})
+    assert [r["memory_id"] for r in filtered] == ["tea"]
+
+    assert chroma_store.update_memory("small", store, "oslo", {"text": "flies to Bergen", "tag": "trip"})
+    chroma_store.delete_memory("small", store, "coffee")
+    res = chroma_store.query_memories("small", store, "flies to Bergen", k=5)
+    assert [r["memory_id"] for r in res] == ["oslo", "tea"]
+    assert res[0]["metadata"]["tag"] == "trip"
+
+
+def test_numpy_backend_promotes_to_chroma(store, monkeypatch):
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(config, "VECTOR_PROMOTE_AT", 3)
+    chroma_store.upsert_memories("growing", store, [{"text": f"note {i}"} for i in range(3)])
+    assert isinstance(chroma_store.backend_for("growing", store), numpy_store.NumpyStore)
+
+    chroma_store.upsert_memories("growing", store, [{"memory_id": "last", "text": "note 3"}])
+    assert isinstance(chroma_store.backend_for("growing", store), chroma_store.ChromaBackend)
+    assert not Path(numpy_store.store_path(store, "growing")).exists()
+    res = chroma_store.query_memories("growing", store, "note 3", k=10)
+    assert len(res) == 4 and res[0]["memory_id"] == "last"
+
+
+@pytest.mark.parametrize("layout,backend", [("per_agent", "chroma"), ("collection", "chroma"),
+                                            ("shared", "chroma"), ("per_agent", "numpy")])
+def test_changed_embedder_is_refused_until_reembedded(store, monkeypatch, layout, backend):
+    monkeypatch.setattr(config, "CHROMA_LAYOUT", layout)
+    monkeypatch.setattr(config, "VECTOR_BACKEND", backend)
+    chroma_store.upsert_memories("alice", store, [
+        {"memory_id": "tea", "text": "likes green tea"}, {"memory_id": "oslo", "text": "flies to Oslo"},
+    ])
+    chroma_store.upsert_memories("bob", store, [{"memory_id": "tea", "text": "bob likes tea"}])
+    if backend == "numpy":
+        records = json.loads((Path(numpy_store.store_path(store, "alice")) / "records.json").read_text())
+        assert (records["embedder"], records["embedding_dim"]) == ("test-hash", 64)
+    else:
+        meta = chroma_store.get_collection_for_agent("alice", store).metadata
+        assert (meta["embedder"], meta["embedding_dim"]) == ("test-hash", 64)
+
+    monkeypatch.setattr(chroma_store, "embedding_function", lambda: SmallHashEmbedding())
+    chroma_store.reset_clients()
+    with pytest.raises(EmbedderMismatch, match="--reembed"):
+        chroma_store.query_memories("alice", store, "tea", k=1)
+    with pytest.raises(EmbedderMismatch):
+        chroma_store.upsert_memories("alice", store, [{"text": "more tea"}])
+
+    counts = migrate.reembed(store, None)
+    assert sum(counts.values()) == 3
+    res = chroma_store.query_memories("alice", store, "green tea", k=2)
+    assert [r["memory_id"] for r in res] == ["tea", "oslo"]
+    assert [r["text"] for r in chroma_store.query_memories("bob", store, "tea", k=5)] == ["bob likes tea"]
+
+
+def test_where_evaluation_matches_chroma_operators():
+    meta = {"tag": "food", "date": 20250901}
+    assert numpy_store.matches(meta, {"$and": [{"tag": "food"}, {"date": {"$gte": 20250901}}]})
+    assert numpy_store.matches(meta, {"$or": [{"tag": "work"}, {"tag": {"$in": ["food"]}}]})
+    assert not numpy_store.matches(meta, {"tag": {"$ne": "food"}})
+    assert not numpy_store.matches({"tag": "food"}, {"date": {"$gt": 1}})
+
+
+def test_upsert_during_promotion_is_not_lost(store, monkeypatch):
+    import threading
+    import time
+
+    monkeypatch.setattr(config, "VECTOR_BACKEND", "numpy")
+    monkeypatch.setattr(config, "VECTOR_PROMOTE_AT", 3)
+    chroma_store.upsert_memories("racing", store, [{"text": f"note {i}"} for i in range(3)])
+
+    writer = threading.Thread(target=chroma_store.upsert_memories,
+                              args=("racing", store, [{"memory_id": "late", "text": "late note"}]))
+    real_export = numpy_store.NumpyStore.export
+
+    def slow_export(self):
+        # Another request writes to the agent between the export and the rmtree
+        out = real_export(self)
+        writer.start()
+        time.sleep(0.2)
+        return out
+
+    monkeypatch.setattr(numpy_store.NumpyStore, "export", slow_export)
+    chroma_store.upsert_memories("racing", store, [{"text": "note 3"}])
+    writer.join(5)
+
+    assert isinstance(chroma_store.backend_for("racing", store), chroma_store.ChromaBackend)
+    res = chroma_store.query_memories("racing", store, "note", k=10)
+    assert len(res) == 5 and "late" in {r["memory_id"] for r in res}
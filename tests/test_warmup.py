@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app import config, warmup
+from agent_host.app.agents import profiles
+from agent_host.app.memory import chroma_store
+from agent_host.app.models import AgentProfile
+from agent_host.app.orchestrator import history, session
+import agent_host.app.main as main_module
+
+
+@pytest.fixture()
+def anyio_backend():
+    return "asyncio"
+
+
+class FakeBatcher:
+    def __init__(self):
+        self.calls = []
+
+    async def aembed(self, texts):
+        self.calls.append(texts)
+        return [[0.0] for _ in texts]
+
+
+class FakeBackend:
+    def count(self):
+        return 3
+
+
+def _seed(root, agent_ids):
+    for i, agent_id in enumerate(agent_ids):
+        profiles.write_profile(root, AgentProfile(agent_id=agent_id, character=f"Character {agent_id}", notes=""))
+        history.append_turn(root, agent_id, "user", f"hello from {agent_id}")
+        history.append_turn(root, agent_id, "assistant", "hi")
+        stamp = 1_700_000_000 + i
+        os.utime(os.path.join(root, agent_id, "chat_history.jsonl"), (stamp, stamp))
+
+
+def test_recently_active_orders_by_history_mtime(tmp_path):
+    root = str(tmp_path)
+    _seed(root, ["old", "mid", "new"])
+    os.makedirs(os.path.join(root, "no-history"))
+    assert history.recently_active(root, 2) == ["new", "mid"]
+    assert history.recently_active(str(tmp_path / "missing"), 5) == []
+
+
+@pytest.mark.anyio
+async def test_warmup_opens_stores_embeds_and_prefills(tmp_path, monkeypatch):
+    root = str(tmp_path)
+    _seed(root, ["old", "mid", "new"])
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", root)
+    monkeypatch.setattr(config, "WARMUP_AGENTS", 2)
+    monkeypatch.setattr(config, "WARMUP_IMPORTS", ["json", "no_such_module_xyz"])
+    opened = []
+    monkeypatch.setattr(chroma_store, "backend_for", lambda agent_id, r: opened.append(agent_id) or FakeBackend())
+    batcher = FakeBatcher()
+    monkeypatch.setattr(chroma_store, "batchers", lambda: (batcher, batcher))
+    calls = []
+
+    async def fake_nonstream_chat(messages, **kwargs):
+        calls.append((messages, kwargs))
+        kwargs["stats"]["usage"] = {"prompt_tokens": 10}
+        return {"text": "", "tool_calls": [], "raw": {}}
+
+    monkeypatch.setattr(session, "nonstream_chat", fake_nonstream_chat)
+
+    state = warmup.Warmup()
+    assert not state.ready
+    await warmup.run(root, state)
+
+    assert state.ready and not state.timed_out
+    assert state.agents == ["new", "mid"]
+    assert opened == ["new", "mid"]
+    assert batcher.calls == [["warmup"]]
+    assert state.steps["imports"]["missing"] == ["no_such_module_xyz"]
+    assert state.steps["stores"] == {"ok": True, "memories": 6, "seconds": state.steps["stores"]["seconds"]}
+    assert state.steps["prefill"]["agents"] == 2
+    assert state.steps["prefill"]["prompt_tokens"] == 20
+
+    assert len(calls) == 2
+    for messages, kwargs in calls:
+        assert kwargs["max_tokens"] == 0 and kwargs["n_predict"] == 0
+        assert kwargs["cache_prompt"] is True
+        assert "id_slot" in kwargs
+        assert messages[0]["role"] == "system"
+        assert [m["role"] for m in messages[1:]] == ["user", "assistant"]
+    assert {kwargs["affinity"] for _, kwargs in calls} == {"new", "mid"}
+    assert any("Character new" in messages[0]["content"] for messages, _ in calls)
+
+
+@pytest.mark.anyio
+async def test_failed_step_and_timeout_still_become_ready(tmp_path, monkeypatch):
+    monkeypatch.setattr(config, "WARMUP_IMPORTS", [])
+
+    def broken():
+        raise RuntimeError("no model")
+
+    monkeypatch.setattr(chroma_store, "batchers", broken)
+    state = await warmup.run(str(tmp_path), warmup.Warmup())
+    assert state.ready
+    assert state.steps["embedding"]["ok"] is False
+    assert "no model" in state.steps["embedding"]["error"]
+    assert "prefill" not in state.steps
+
+    async def slow():
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(chroma_store, "batchers", lambda: (None, type("B", (), {"aembed": lambda self, t: slow()})()))
+    monkeypatch.setattr(config, "WARMUP_TIMEOUT", 0.05)
+    state = await warmup.run(str(tmp_path), warmup.Warmup())
+    assert state.ready and state.timed_out
+
+
+def test_healthz_gated_on_warmup(monkeypatch):
+    state = warmup.Warmup()
+    monkeypatch.setattr(warmup, "STATE", state)
+    client = TestClient(main_module.app)
+    r = client.get("/healthz")
+    assert r.status_code == 503
+    assert r.json()["ok"] is False
+    state.done = True
+    r = client.get("/healthz")
+    assert r.status_code == 200 and r.json()["warmup"]["ready"] is True
+
+    monkeypatch.setattr(warmup, "STATE", warmup.Warmup(enabled=False))
+    assert client.get("/healthz").json() == {"ok": True}
+
+
+def test_warmup_imports_default_follows_backends():
+    code = "import json; from agent_host.app import config; print(json.dumps(config.WARMUP_IMPORTS))"
+    src = str(Path(__file__).resolve().parents[1] / "src")
+
+    def imports(**env):
+        env = {k: v for k, v in os.environ.items() if k not in ("WARMUP_IMPORTS", "EMBED_PROCESSES")} | env
+        env["PYTHONPATH"] = os.pathsep.join([src, os.environ.get("PYTHONPATH", "")])
+        out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True, env=env)
+        return json.loads(out.stdout.strip().splitlines()[-1])
+
+    assert imports(EMBEDDING_BACKEND="chroma", VECTOR_BACKEND="chroma") == ["chromadb", "onnxruntime", "tokenizers"]
+    assert imports(EMBEDDING_BACKEND="remote", VECTOR_BACKEND="chroma") == ["chromadb"]
+    assert imports(EMBEDDING_BACKEND="remote", VECTOR_BACKEND="numpy") == []
+    assert imports(EMBEDDING_BACKEND="chroma", VECTOR_BACKEND="chroma", EMBED_PROCESSES="2") == ["chromadb"]
+    assert imports(EMBEDDING_BACKEND="remote", WARMUP_IMPORTS="json") == ["json"]
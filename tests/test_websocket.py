@@ -0,0 +1,86 @@
+import asyncio
+import sys
+from pathlib import Path
+
+from fastapi.testclient import TestClient
+
+sys.path.append(str(Path(__file__).resolve().parents[1] / "src"))
+
+from agent_host.app import streaming
+from agent_host.app.agents import profiles
+from agent_host.app.models import AgentProfile
+from agent_host.app.orchestrator import session
+import agent_host.app.main as main_module
+
+
+def _setup(tmp_path, monkeypatch, delay=0.0):
+    root = str(tmp_path)
+    monkeypatch.setattr(main_module, "CHROMA_PERSIST_ROOT", root)
+    monkeypatch.setattr(session, "CHROMA_PERSIST_ROOT", root)
+    for agent_id in ("a1", "a2"):
+        profiles.write_profile(root, AgentProfile(agent_id=agent_id, character="Tester", notes=""))
+
+    async def fake_stream_chat(messages, **kwargs):
+        for tok in ("one", " two", " three"):
+            await asyncio.sleep(delay)
+            yield tok
+
+    monkeypatch.setattr(session, "stream_chat", fake_stream_chat)
+
+
+def _collect(receive, until_done):
+    frames = {}
+    finished = set()
+    while finished != until_done:
+        ev = receive()
+        frames.setdefault(ev["id"], []).append(ev)
+        if ev["type"] in ("done", "error", "cancelled"):
+            finished.add(ev["id"])
+    return frames
+
+
+def test_coalesce_merges_adjacent_tokens_per_session():
+    events = [
+        {"id": "a", "type": "token", "data": "x"},
+        {"id": "a", "type": "token", "data": "y"},
+        {"id": "b", "type": "token", "data": "z"},
+        {"id": "a", "type": "token", "data": "w"},
+        {"id": "a", "type": "done", "data": {}},
+    ]
+    assert streaming.coalesce_events(events) == [
+        {"id": "a", "type": "token", "data": "xy"},
+        {"id": "b", "type": "token", "data": "z"},
+        {"id": "a", "type": "token", "data": "w"},
+        {"id": "a", "type": "done", "data": {}},
+    ]
+
+
+def test_binary_frame_roundtrip():
+    for ev in ({"id": "s1", "type": "token", "data": "héllo"},
+               {"id": "s1", "type": "done", "data": {"trace": {"name": "turn"}}}):
+        assert streaming.decode_binary_frame(streaming.encode_binary_frame(ev)) == ev
+
+
+def test_multiplexed_sessions_over_one_socket(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch)
+    with TestClient(main_module.app).websocket_connect("/ws") as ws:
+        ws.send_json({"op": "chat", "id": "s1", "agent_id": "a1", "user": "hi"})
+        ws.send_json({"op": "chat", "id": "s2", "agent_id": "a2", "user": "hey"})
+        ws.send_json({"op": "chat", "id": "s3", "agent_id": "ghost", "user": "hey"})
+        frames = _collect(ws.receive_json, {"s1", "s2", "s3"})
+
+    for sid in ("s1", "s2"):
+        text = "".join(f["data"] for f in frames[sid] if f["type"] == "token")
+        assert text == "one two three"
+        assert frames[sid][-1]["type"] == "done"
+    assert frames["s3"][-1]["type"] == "error"
+
+
+def test_cancel_one_session_in_binary_mode(tmp_path, monkeypatch):
+    _setup(tmp_path, monkeypatch, delay=0.2)
+    with TestClient(main_module.app).websocket_connect("/ws?encoding=binary") as ws:
+        ws.send_json({"op": "chat", "id": "slow", "agent_id": "a1", "user": "hi"})
+        ws.send_json({"op": "cancel", "id": "slow"})
+        frames = _collect(lambda: streaming.decode_binary_frame(ws.receive_bytes()), {"slow"})
+
+    assert frames["slow"][-1]["type"] == "cancelled"